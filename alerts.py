@@ -0,0 +1,489 @@
+import atexit
+import json
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+
+import pandas as pd
+
+import magasins
+import storage
+from metrics import timed
+from verrous import VerrouFichier
+
+# ─────────────────────────────────────────────
+# ALERTES DE STOCK BAS
+# ─────────────────────────────────────────────
+# Chaque store prévient sa surveillance après une modification, avec les
+# seules pièces touchées (voir StockStore.abonner). Ces pièces sont
+# notées, puis vérifiées contre leur Seuil_Alerte par le thread des
+# alertes : la sortie n'attend pas, et la table n'est reparcourue qu'après
+# un rechargement complet du stock.
+#
+# Une alerte s'ouvre quand Quantite <= Seuil_Alerte et reste dans la table
+# des alertes ouvertes du magasin (table SQLite `alertes`, ou fichier JSON
+# à côté du classeur) : d'autres sorties sur la même pièce ne la
+# relancent pas. Elle se résout d'elle-même quand la pièce repasse au-dessus
+# du seuil (entrée, transfert reçu, modification) ou disparaît du stock.
+#
+# Ouvertures et résolutions partent dans une file de notifications
+# regroupées : un envoi quand plus rien n'arrive depuis ALERTES_DEBOUNCE_S
+# (au plus tard après ALERTES_ATTENTE_MAX_S). Une alerte ouverte puis
+# résolue entre deux envois n'est pas notifiée. Le canal est interchangeable :
+# fichier JSON local (par défaut, et pour les essais) ou courriel SMTP.
+
+ALERTES_PATH = "alertes_ouvertes.json"           # backend Excel, dans le dossier du magasin
+ALERTES_NOTIFICATIONS_PATH = os.environ.get("GMAO_ALERTES_FICHIER", "alertes_notifications.jsonl")
+ALERTES_SMTP = os.environ.get("GMAO_ALERTES_SMTP")        # "hote:port" ; sinon notifications dans le fichier
+ALERTES_EXPEDITEUR = os.environ.get("GMAO_ALERTES_EXPEDITEUR", "gmao@localhost")
+ALERTES_DESTINATAIRES = [a.strip() for a in os.environ.get("GMAO_ALERTES_DESTINATAIRES", "").split(",") if a.strip()]
+ALERTES_DEBOUNCE_S = 30
+ALERTES_ATTENTE_MAX_S = 300
+ALERTES_RETRY_S = 60
+ALERTE_COLUMNS = ["ID_QR", "Designation", "Quantite", "Seuil_Alerte", "Ouverte_le"]
+
+
+def _maintenant():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ─────────────────────────────────────────────
+# CANAUX DE NOTIFICATION
+# ─────────────────────────────────────────────
+# Un canal reçoit une liste d'événements :
+#   {"type": "ouverte" | "resolue", "magasin", "id_qr", "designation",
+#    "quantite", "seuil", "date", "cause"}
+# et lève une exception si l'envoi échoue (nouvel essai plus tard).
+
+class CanalFichier:
+    """Un envoi = une ligne JSON ajoutée au fichier (journal local, essais)."""
+
+    def __init__(self, path=ALERTES_NOTIFICATIONS_PATH):
+        self.path = path
+
+    def envoyer(self, evenements):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"date": _maintenant(), "alertes": evenements}, ensure_ascii=False) + "\n")
+
+
+class CanalSMTP:
+    """Un courriel récapitulatif par envoi."""
+
+    def __init__(self, hote, port=25, expediteur=ALERTES_EXPEDITEUR, destinataires=ALERTES_DESTINATAIRES):
+        self.hote, self.port = hote, int(port)
+        self.expediteur, self.destinataires = expediteur, list(destinataires)
+
+    def envoyer(self, evenements):
+        ouvertes = [e for e in evenements if e["type"] == "ouverte"]
+        msg = EmailMessage()
+        msg["Subject"] = (f"[GMAO] {len(ouvertes)} pièce(s) sous le seuil d'alerte, "
+                          f"{len(evenements) - len(ouvertes)} alerte(s) résolue(s)")
+        msg["From"] = self.expediteur
+        msg["To"] = ", ".join(self.destinataires)
+        msg.set_content("\n".join(
+            f"{'🔴' if e['type'] == 'ouverte' else '🟢'} [{e['magasin']}] {e['id_qr']} — {e['designation']} : "
+            f"{e['quantite']} en stock (seuil {e['seuil']})"
+            + ("" if e["type"] == "ouverte" else f", résolue ({e['cause']})")
+            for e in evenements))
+        with smtplib.SMTP(self.hote, self.port, timeout=10) as smtp:
+            smtp.send_message(msg)
+
+
+def canal_par_defaut():
+    """SMTP si GMAO_ALERTES_SMTP est défini, sinon le fichier local."""
+    if ALERTES_SMTP:
+        hote, _, port = ALERTES_SMTP.partition(":")
+        return CanalSMTP(hote, port or 25)
+    return CanalFichier()
+
+
+# ─────────────────────────────────────────────
+# FILE DE NOTIFICATIONS
+# ─────────────────────────────────────────────
+
+class FileNotifications:
+    def __init__(self, canal=None, debounce_s=ALERTES_DEBOUNCE_S, attente_max_s=ALERTES_ATTENTE_MAX_S):
+        self.canal = canal or canal_par_defaut()
+        self.debounce_s = debounce_s
+        self.attente_max_s = attente_max_s
+        self._lock = threading.Lock()
+        self._envoi_lock = threading.Lock()
+        self._en_attente = {}      # (magasin, id_qr) -> dernier événement
+        self._premier = None       # arrivée du plus ancien événement en attente
+        self._dernier = None
+        self._pas_avant = 0.0      # après un échec d'envoi
+        self.envoyes = 0
+        self.erreur = None
+
+    def __len__(self):
+        return len(self._en_attente)
+
+    def publier(self, evenement):
+        cle = (evenement["magasin"], evenement["id_qr"])
+        with self._lock:
+            precedent = self._en_attente.pop(cle, None)
+            if precedent is None or precedent["type"] == evenement["type"]:
+                self._en_attente[cle] = evenement
+            # Sinon : ouverte puis résolue (ou l'inverse) avant l'envoi, rien à dire
+            self._dernier = time.monotonic()
+            if not self._en_attente:
+                self._premier = None
+            elif self._premier is None:
+                self._premier = self._dernier
+
+    def echeance(self):
+        """Secondes avant le prochain envoi (None si rien n'attend)."""
+        with self._lock:
+            if not self._en_attente:
+                return None
+            du = min(self._dernier + self.debounce_s, self._premier + self.attente_max_s)
+            return max(0.0, du - time.monotonic(), self._pas_avant - time.monotonic())
+
+    @timed("alertes.notification")
+    def envoyer(self, forcer=False):
+        """Envoie les événements en attente si le délai est écoulé (ou tout de suite si forcer)."""
+        with self._envoi_lock:
+            echeance = self.echeance()
+            if echeance is None or (echeance > 0 and not forcer):
+                return 0
+            with self._lock:
+                evenements = list(self._en_attente.values())
+                self._en_attente.clear()
+                self._premier = None
+            try:
+                self.canal.envoyer(evenements)
+            except Exception as e:
+                # Remis en file, sans écraser ce qui est arrivé entre-temps
+                with self._lock:
+                    for ev in evenements:
+                        self._en_attente.setdefault((ev["magasin"], ev["id_qr"]), ev)
+                    self._premier = self._dernier = time.monotonic()
+                    self._pas_avant = self._premier + ALERTES_RETRY_S
+                self.erreur = str(e)
+                return 0
+            self.erreur = None
+            self.envoyes += len(evenements)
+            return len(evenements)
+
+
+_file = None
+_file_lock = threading.Lock()
+
+
+def get_file() -> FileNotifications:
+    """File de notifications du processus (canal choisi par l'environnement)."""
+    global _file
+    with _file_lock:
+        if _file is None:
+            _file = FileNotifications()
+        return _file
+
+
+def set_file(file):
+    """Remplace la file (autre canal, délais d'essai)."""
+    global _file
+    with _file_lock:
+        _file = file
+
+
+# ─────────────────────────────────────────────
+# TABLE DES ALERTES OUVERTES
+# ─────────────────────────────────────────────
+# ouvrir() / resoudre() traitent un lot de pièces (une transaction, une
+# écriture du fichier) et ne renvoient que celles que ce processus a
+# vraiment changées : l'application et l'API de scan partagent la table
+# et ne notifient pas deux fois. Le fichier JSON (backend Excel) est relu
+# à chaque modification sous un verrou de fichier (ALERTES_PATH + ".lock"),
+# et à chaque lecture s'il a changé.
+
+class _TableSQLite:
+    def __init__(self, stockage):
+        self._stockage = stockage
+
+    def ids(self, parmi=None):
+        conn = self._stockage.get_connection()
+        if parmi is None:
+            return {r[0] for r in conn.execute("SELECT id_qr FROM alertes")}
+        parmi = list(parmi)
+        ouvertes = set()
+        for k in range(0, len(parmi), 500):
+            lot = parmi[k:k + 500]
+            ouvertes.update(r[0] for r in conn.execute(
+                f"SELECT id_qr FROM alertes WHERE id_qr IN ({','.join('?' * len(lot))})", lot))
+        return ouvertes
+
+    def nombre(self):
+        return self._stockage.get_connection().execute("SELECT COUNT(*) FROM alertes").fetchone()[0]
+
+    def lister(self):
+        conn = self._stockage.get_connection()
+        return [list(r) for r in conn.execute(
+            "SELECT id_qr, designation, quantite, seuil, ouverte_le FROM alertes ORDER BY ouverte_le, id_qr")]
+
+    def ouvrir(self, lignes):
+        """lignes : [[id_qr, designation, quantite, seuil, date], ...]. Renvoie les ID ouverts."""
+        conn = self._stockage.get_connection()
+        with conn:
+            return [ligne[0] for ligne in lignes if conn.execute(
+                "INSERT OR IGNORE INTO alertes (id_qr, designation, quantite, seuil, ouverte_le) "
+                "VALUES (?, ?, ?, ?, ?)", ligne).rowcount == 1]
+
+    def resoudre(self, ids):
+        conn = self._stockage.get_connection()
+        with conn:
+            return [i for i in ids if conn.execute("DELETE FROM alertes WHERE id_qr = ?", (i,)).rowcount == 1]
+
+
+class _TableFichier:
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._verrou = VerrouFichier(path + ".lock")   # écritures, entre processus
+        self._signature = None      # (inode, mtime, taille) du fichier lu
+        self._alertes = {}
+
+    def _relire(self):
+        """Recharge le fichier s'il a changé (sous self._lock)."""
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            self._signature, self._alertes = None, {}
+            return
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if signature != self._signature:
+            try:
+                with open(self._path, encoding="utf-8") as f:
+                    self._alertes = {a[0]: a for a in json.load(f)}
+            except ValueError:
+                self._alertes = {}
+            self._signature = signature
+
+    def _ecrire(self):
+        tmp = self._path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(self._alertes.values()), f, ensure_ascii=False)
+        os.replace(tmp, self._path)
+        st = os.stat(self._path)
+        self._signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def ids(self, parmi=None):
+        with self._lock:
+            self._relire()
+            return set(self._alertes) if parmi is None else {i for i in parmi if i in self._alertes}
+
+    def nombre(self):
+        with self._lock:
+            self._relire()
+            return len(self._alertes)
+
+    def lister(self):
+        with self._lock:
+            self._relire()
+            return sorted(self._alertes.values(), key=lambda a: (a[4], a[0]))
+
+    def ouvrir(self, lignes):
+        with self._lock, self._verrou:
+            self._relire()
+            ouverts = [ligne[0] for ligne in lignes if ligne[0] not in self._alertes]
+            for ligne in lignes:
+                self._alertes.setdefault(ligne[0], list(ligne))
+            if ouverts:
+                self._ecrire()
+            return ouverts
+
+    def resoudre(self, ids):
+        with self._lock, self._verrou:
+            self._relire()
+            resolus = [i for i in ids if self._alertes.pop(i, None) is not None]
+            if resolus:
+                self._ecrire()
+            return resolus
+
+
+# ─────────────────────────────────────────────
+# SURVEILLANCE D'UN MAGASIN
+# ─────────────────────────────────────────────
+
+class Surveillance:
+    def __init__(self, nom, store, stockage, file=None):
+        self.nom = nom
+        self._store = store
+        self._stockage = stockage
+        self._file = file
+        self._table = (_TableSQLite(stockage) if storage.use_sqlite()
+                       else _TableFichier(os.path.join(stockage.dossier, ALERTES_PATH)))
+        self._lock = threading.Lock()
+        self._verif_lock = threading.Lock()
+        self._a_verifier = {}      # id_qr -> dernière cause
+        self._tout = True          # premier passage : tout le stock
+        self.erreur = None
+        store.abonner(self._noter)
+
+    @property
+    def file(self):
+        return self._file or get_file()
+
+    def _noter(self, store, ids, cause):
+        # Appelé par le store (parfois sous son verrou) : noter seulement
+        with self._lock:
+            if ids is None:
+                self._tout = True
+            else:
+                for id_qr in ids:
+                    self._a_verifier[id_qr] = cause
+        _reveil.set()
+
+    def en_attente(self):
+        with self._lock:
+            return self._tout or bool(self._a_verifier)
+
+    @timed("alertes.verification")
+    def verifier(self):
+        """Vérifie les pièces notées depuis le dernier passage. Renvoie le nombre d'événements."""
+        with self._verif_lock:
+            with self._lock:
+                tout, self._tout = self._tout, False
+                pieces, self._a_verifier = self._a_verifier, {}
+            if not tout and not pieces:
+                return 0
+            try:
+                return self._rescanner() if tout else self._verifier(pieces)
+            except Exception as e:
+                # Pièces remises en attente : nouvel essai au prochain passage
+                with self._lock:
+                    self._tout = self._tout or tout
+                    for id_qr, cause in pieces.items():
+                        self._a_verifier.setdefault(id_qr, cause)
+                self.erreur = str(e)
+                raise
+
+    def _verifier(self, pieces):
+        etats = self._store.seuils(pieces)
+        ouvertes = self._table.ids(pieces)
+        a_ouvrir, a_resoudre = {}, {}
+        for id_qr, cause in pieces.items():
+            etat = etats.get(id_qr)
+            basse = etat is not None and etat[1] <= etat[2]
+            if basse and id_qr not in ouvertes:
+                a_ouvrir[id_qr] = (etat, cause)
+            elif not basse and id_qr in ouvertes:
+                a_resoudre[id_qr] = (etat or ("", 0, 0), cause if etat else "suppression")
+        return self._appliquer(a_ouvrir, a_resoudre)
+
+    def _rescanner(self):
+        """Tout le stock en une passe vectorisée (démarrage, rechargement)."""
+        vue = self._store.vue() if self._stockage.has_stock() else None
+        if vue is None or vue.empty:
+            basses, etats = set(), {}
+        else:
+            basses = set(vue.loc[vue["Alerte"], "ID_QR"].map(str))
+            etats = dict(zip(vue["ID_QR"].map(str), zip(vue["Designation"], vue["Quantite"], vue["Seuil_Alerte"])))
+        ouvertes = self._table.ids()
+        a_ouvrir = {i: (etats[i], "rechargement") for i in sorted(basses - ouvertes)}
+        a_resoudre = {i: (etats.get(i, ("", 0, 0)), "rechargement" if i in etats else "suppression")
+                      for i in sorted(ouvertes - basses)}
+        return self._appliquer(a_ouvrir, a_resoudre)
+
+    def _appliquer(self, a_ouvrir, a_resoudre):
+        """Écrit les changements dans la table, puis notifie ceux que ce processus a faits."""
+        date_str = _maintenant()
+        ouverts = self._table.ouvrir([[i, str(etat[0]), int(etat[1]), int(etat[2]), date_str]
+                                      for i, (etat, _) in a_ouvrir.items()]) if a_ouvrir else []
+        resolus = self._table.resoudre(list(a_resoudre)) if a_resoudre else []
+        for id_qr in ouverts:
+            self.file.publier(self._evenement("ouverte", id_qr, *a_ouvrir[id_qr]))
+        for id_qr in resolus:
+            self.file.publier(self._evenement("resolue", id_qr, *a_resoudre[id_qr]))
+        self.erreur = None
+        return len(ouverts) + len(resolus)
+
+    def _evenement(self, type_, id_qr, etat, cause):
+        designation, quantite, seuil = etat
+        return {"type": type_, "magasin": self.nom, "id_qr": id_qr, "designation": str(designation),
+                "quantite": int(quantite), "seuil": int(seuil), "date": _maintenant(), "cause": cause}
+
+    def __len__(self):
+        return self._table.nombre()
+
+    def ouvertes(self) -> pd.DataFrame:
+        """Alertes ouvertes, avec la quantité actuelle de chaque pièce."""
+        df = pd.DataFrame(self._table.lister(), columns=ALERTE_COLUMNS)
+        if not df.empty:
+            actuelles = self._store.seuils(df["ID_QR"].tolist())
+            df["Quantite"] = [actuelles.get(i, (None, q))[1] for i, q in zip(df["ID_QR"], df["Quantite"])]
+        return df
+
+
+# ─────────────────────────────────────────────
+# SURVEILLANCES ET THREAD DES ALERTES
+# ─────────────────────────────────────────────
+
+_lock = threading.Lock()
+_surveillances = {}
+_reveil = threading.Event()
+_thread = None
+
+
+def surveillance(nom=None) -> Surveillance:
+    """Surveillance du magasin (créée au premier appel, branchée sur son store)."""
+    nom = nom or magasins.MAGASIN_PRINCIPAL
+    with _lock:
+        s = _surveillances.get(nom)
+        if s is None:
+            s = _surveillances[nom] = Surveillance(nom, magasins.store(nom), magasins.stockage(nom))
+            _reveil.set()
+        return s
+
+
+def traiter(forcer=False):
+    """Un passage : vérifie les pièces notées de chaque magasin puis envoie les notifications dues."""
+    with _lock:
+        liste = list(_surveillances.values())
+    for s in liste:
+        try:
+            s.verifier()
+        except Exception:
+            # s.erreur est affichée ; les pièces restent en attente
+            pass
+    return get_file().envoyer(forcer)
+
+
+def _boucle():
+    while True:
+        echeance = get_file().echeance()
+        _reveil.wait(ALERTES_DEBOUNCE_S if echeance is None else echeance)
+        _reveil.clear()
+        traiter()
+
+
+def demarrer():
+    """Surveille tous les magasins et lance le thread des alertes (une fois par processus)."""
+    global _thread
+    for nom in magasins.noms():
+        surveillance(nom)
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_boucle, name="alertes", daemon=True)
+            _thread.start()
+            atexit.register(_envoyer_a_la_sortie)
+
+
+def _envoyer_a_la_sortie():
+    try:
+        traiter(forcer=True)
+    except Exception:
+        # Les alertes ouvertes restent dans leur table ; seule la notification est perdue
+        pass
+
+
+def etat():
+    """Nombre d'alertes ouvertes par magasin, notifications en attente, dernière erreur."""
+    with _lock:
+        liste = list(_surveillances.values())
+    file = get_file()
+    return {"ouvertes": {s.nom: len(s) for s in liste},
+            "en_attente": len(file), "envoyes": file.envoyes,
+            "erreur": file.erreur or next((s.erreur for s in liste if s.erreur), None)}
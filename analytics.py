@@ -0,0 +1,140 @@
+import math
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+# ─────────────────────────────────────────────
+# CONSOMMATION & POINTS DE COMMANDE
+# ─────────────────────────────────────────────
+# Les sorties sont agrégées par pièce et par jour sur une fenêtre glissante.
+# À chaque rafraîchissement, seules les sorties arrivées depuis le dernier
+# passage sont lues et ajoutées aux totaux journaliers ; les jours sortis
+# de la fenêtre sont retirés. Les indicateurs sont ensuite calculés par
+# group-by vectorisés :
+#   conso/jour       = quantité sortie sur la fenêtre / nb de jours
+#   jours de cover   = stock / conso par jour
+#   point de commande = conso/jour x délai + stock de sécurité
+#   quantité suggérée = de quoi remonter à conso/jour x (délai + couverture)
+#                       + sécurité, dès que le stock atteint le point de commande
+
+FENETRE_JOURS = 90
+FENETRE_COURTE_JOURS = 30
+DELAI_FOURNISSEUR_JOURS = 14
+COUVERTURE_JOURS = 30
+Z_SERVICE = 1.65          # ~95 % de taux de service pour le stock de sécurité
+
+COLONNES_PROPOSITION = ["ID_QR", "Designation", "Quantite", "Seuil_Alerte", "Conso_Jour_30j", "Conso_Jour_90j",
+                        "Jours_Couverture", "Point_Commande", "Qte_Suggeree", "Prix_Unitaire_DH", "Montant_DH"]
+
+
+class Consommation:
+    def __init__(self, stockage=storage.principal):
+        self._stockage = stockage    # storage.Stockage du magasin
+        self._lock = threading.Lock()
+        self._journalier = pd.Series(dtype=float)   # (ID_QR, jour) -> quantité sortie
+        self._curseur = 0
+        self._cache = None                          # (clé, propositions)
+
+    def _ajouter(self, df):
+        if df.empty:
+            return
+        jours = pd.to_datetime(df["Date"], errors="coerce").dt.normalize()
+        ids = df["ID_QR"].astype(str).str.replace(" ", "")
+        qte = pd.to_numeric(df["Quantite_Sortie"], errors="coerce").fillna(0)
+        ajout = qte.groupby([ids.rename("ID_QR"), jours.rename("Jour")]).sum()
+        if self._journalier.empty:
+            self._journalier = ajout.astype(float)
+        else:
+            self._journalier = self._journalier.add(ajout, fill_value=0)
+
+    def rafraichir(self, maintenant=None):
+        """Intègre les nouvelles sorties et fait glisser la fenêtre. Renvoie le curseur."""
+        debut = (maintenant or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0) \
+            - timedelta(days=FENETRE_JOURS - 1)
+        with self._lock:
+            df, curseur, complet = self._stockage.historique_depuis(self._curseur, start=debut)
+            if complet:
+                self._journalier = pd.Series(dtype=float)
+            self._ajouter(df)
+            self._curseur = curseur
+            if len(self._journalier):
+                jours = self._journalier.index.get_level_values("Jour")
+                self._journalier = self._journalier[jours >= debut]
+            return self._curseur, debut
+
+    def taux(self, maintenant=None):
+        """Par pièce : conso/jour sur 30 et 90 jours et écart-type journalier."""
+        _, debut = self.rafraichir(maintenant)
+        return self._taux(debut)
+
+    def _taux(self, debut):
+        with self._lock:
+            journalier = self._journalier
+        if journalier.empty:
+            # Colonnes float : un magasin sans sortie ne doit pas donner des colonnes objet
+            return pd.DataFrame(columns=["Conso_Jour_30j", "Conso_Jour_90j", "Ecart_Type_Jour"], dtype=float)
+        par_piece = journalier.groupby(level="ID_QR")
+        somme = par_piece.sum()
+        carres = (journalier ** 2).groupby(level="ID_QR").sum()
+        recent = journalier[journalier.index.get_level_values("Jour")
+                            >= debut + timedelta(days=FENETRE_JOURS - FENETRE_COURTE_JOURS)]
+        moyenne = somme / FENETRE_JOURS
+        # Jours sans sortie compris : variance = E[x²] - E[x]²
+        variance = (carres / FENETRE_JOURS - moyenne ** 2).clip(lower=0)
+        return pd.DataFrame({
+            "Conso_Jour_30j": recent.groupby(level="ID_QR").sum().reindex(somme.index, fill_value=0)
+                              / FENETRE_COURTE_JOURS,
+            "Conso_Jour_90j": moyenne,
+            "Ecart_Type_Jour": np.sqrt(variance),
+        })
+
+    def propositions(self, df_stock, version=None, maintenant=None):
+        """Indicateurs de réapprovisionnement pour chaque pièce du stock."""
+        curseur, debut = self.rafraichir(maintenant)
+        cle = (version, curseur, debut)
+        with self._lock:
+            if version is not None and self._cache is not None and self._cache[0] == cle:
+                return self._cache[1]
+        taux = self._taux(debut)
+
+        df = df_stock[["ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH", "Seuil_Alerte"]].copy()
+        df = df.join(taux, on="ID_QR")
+        df[["Conso_Jour_30j", "Conso_Jour_90j", "Ecart_Type_Jour"]] = \
+            df[["Conso_Jour_30j", "Conso_Jour_90j", "Ecart_Type_Jour"]].fillna(0.0)
+        # Le rythme récent compte s'il est plus élevé (pas de rupture sur une hausse)
+        conso = np.maximum(df["Conso_Jour_30j"], df["Conso_Jour_90j"])
+        securite = Z_SERVICE * df["Ecart_Type_Jour"] * math.sqrt(DELAI_FOURNISSEUR_JOURS)
+        df["Point_Commande"] = np.ceil(conso * DELAI_FOURNISSEUR_JOURS + securite).astype(int)
+        cible = np.ceil(conso * (DELAI_FOURNISSEUR_JOURS + COUVERTURE_JOURS) + securite)
+        a_commander = (df["Quantite"] <= df["Point_Commande"]) & (conso > 0)
+        df["Qte_Suggeree"] = np.where(a_commander, np.maximum(cible - df["Quantite"], 0), 0).astype(int)
+        with np.errstate(divide="ignore"):
+            df["Jours_Couverture"] = np.where(conso > 0, df["Quantite"] / conso, np.inf).round(1)
+        df["Montant_DH"] = (df["Qte_Suggeree"] * df["Prix_Unitaire_DH"]).round(2)
+        df["Conso_Jour_30j"] = df["Conso_Jour_30j"].round(2)
+        df["Conso_Jour_90j"] = df["Conso_Jour_90j"].round(2)
+        df = df[COLONNES_PROPOSITION].sort_values("Jours_Couverture", kind="stable").reset_index(drop=True)
+        with self._lock:
+            self._cache = (cle, df)
+        return df
+
+
+def proposition_achat(propositions: pd.DataFrame) -> pd.DataFrame:
+    """Lignes à commander, prêtes pour l'export."""
+    return propositions[propositions["Qte_Suggeree"] > 0].reset_index(drop=True)
+
+
+_consommations = {}
+_consommation_lock = threading.Lock()
+
+
+def get_consommation(stockage=storage.principal) -> Consommation:
+    """Suivi de consommation d'un magasin, unique dans le processus."""
+    with _consommation_lock:
+        if stockage.dossier not in _consommations:
+            _consommations[stockage.dossier] = Consommation(stockage)
+        return _consommations[stockage.dossier]
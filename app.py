@@ -1,20 +1,20 @@
 import streamlit as st
 import pandas as pd
-from fpdf import FPDF
+import numpy as np
 from datetime import datetime, timedelta
-from openpyxl import load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-import io
 import os
+import shutil
 import hashlib
-import numpy as np
-from PIL import Image
-try:
-    import zxingcpp
-    QR_DECODE_AVAILABLE = True
-except ImportError:
-    QR_DECODE_AVAILABLE = False
+
+import alerts
+import exports
+import magasins
+import metrics
+import storage
+from analytics import get_consommation, proposition_achat, DELAI_FOURNISSEUR_JOURS
+from invoice import generate_pdf, batch_zip, bons_sortie_par_technicien
+from qr_decode import QR_DECODE_AVAILABLE, decode_frame
+from stock_store import StockError
 
 # ─────────────────────────────────────────────
 # CONFIGURATION
@@ -22,7 +22,11 @@ except ImportError:
 
 st.set_page_config(page_title="GMAO Stock - Campus UIR", layout="wide")
 
-EXCEL_PATH = "stock_campus_emi.xlsx"
+# Tous les magasins préparés et chargés en parallèle, une fois par processus
+magasins.charger()
+# Alertes de stock bas : vérifiées après chaque modification, hors des pages
+alerts.demarrer()
+metrics.start_dump()
 
 # ⚠️ Changer ces identifiants selon vos besoins
 USERS = {
@@ -44,146 +48,75 @@ MENUS_ADMIN = [
     "✏️ Modifier le Stock",
     "📥 Entrée & Facturation",
     "📋 Historique Hebdo",
-    "📤 Sortie de Pièce (Scan)"
+    "🕰️ Stock à date",
+    "🏬 Magasins",
+    "📤 Sortie de Pièce (Scan)",
+    "⏱️ Performances"
 ]
 MENUS_TECH = ["📤 Sortie de Pièce (Scan)"]
 
+TECHNICIENS = storage.TECHNICIENS
+
 
 # ─────────────────────────────────────────────
-# FONCTIONS EXCEL
+# FONCTIONS STOCKAGE
 # ─────────────────────────────────────────────
 
-def load_stock_from_excel():
-    df = pd.read_excel(EXCEL_PATH, sheet_name="Stock", engine="openpyxl", dtype={"ID_QR": str})
-    df["ID_QR"] = df["ID_QR"].astype(str).str.strip().str.rstrip(".0")
-    df = df[df["ID_QR"].notna() & (df["ID_QR"] != "TOTAL") & (df["ID_QR"] != "nan")]
-    # Remplir les None par des valeurs par défaut
-    if "Quantite" not in df.columns:        df["Quantite"] = 0
-    if "Prix_Unitaire_DH" not in df.columns: df["Prix_Unitaire_DH"] = 0
-    if "Seuil_Alerte" not in df.columns:    df["Seuil_Alerte"] = 0
-    df["Quantite"]        = pd.to_numeric(df["Quantite"], errors="coerce").fillna(0).astype(int)
-    df["Prix_Unitaire_DH"] = pd.to_numeric(df["Prix_Unitaire_DH"], errors="coerce").fillna(0).astype(float)
-    df["Seuil_Alerte"]    = pd.to_numeric(df["Seuil_Alerte"], errors="coerce").fillna(0).astype(int)
-    return df[["ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH", "Seuil_Alerte"]].copy()
-
-
-def save_stock_to_excel(df: pd.DataFrame):
+# Magasin choisi dans la barre latérale ; son stock est partagé par toutes
+# les sessions du serveur
+if st.session_state.get("magasin") not in magasins.noms():
+    st.session_state.magasin = magasins.MAGASIN_PRINCIPAL
+MAGASIN = st.session_state.magasin
+store = magasins.store(MAGASIN)
+stockage = magasins.stockage(MAGASIN)
+surveillance = alerts.surveillance(MAGASIN)
+
+
+def run_stock_op(op, *args, **kwargs):
+    """Exécute une opération du store ; affiche l'erreur et renvoie None en cas d'échec."""
     try:
-        wb = load_workbook(EXCEL_PATH)
-        ws = wb["Stock"]
-        border = Border(left=Side(style="thin"), right=Side(style="thin"),
-                        top=Side(style="thin"), bottom=Side(style="thin"))
-        alt_fill = PatternFill("solid", start_color="EAF0FB")
-
-        # Effacer les anciennes données
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-            for cell in row:
-                cell.value = None
-
-        # Réécrire ligne par ligne (colonnes essentielles uniquement)
-        for r_idx, row in enumerate(df.itertuples(index=False), start=2):
-            seuil = getattr(row, "Seuil_Alerte", 0) or 0
-            values = [str(row.ID_QR), row.Designation, int(row.Quantite),
-                      float(row.Prix_Unitaire_DH), f"=C{r_idx}*D{r_idx}", seuil]
-            for c_idx, val in enumerate(values, 1):
-                cell = ws.cell(r_idx, c_idx, val)
-                cell.border = border
-                cell.font = Font(name="Arial", size=10)
-                cell.alignment = Alignment(horizontal="center" if c_idx != 2 else "left")
-                if r_idx % 2 == 0:
-                    cell.fill = alt_fill
-
-        # Ligne TOTAL
-        total_row = len(df) + 2
-        ws.cell(total_row, 1, "TOTAL").font = Font(bold=True, name="Arial")
-        ws.cell(total_row, 1).border = border
-        total_cell = ws.cell(total_row, 5, f"=SUM(E2:E{total_row-1})")
-        total_cell.font = Font(bold=True, name="Arial", color="2E4057")
-        total_cell.border = border
-        total_cell.alignment = Alignment(horizontal="center")
-        for c in [2, 3, 4, 6]:
-            ws.cell(total_row, c).border = border
-
-        wb.save(EXCEL_PATH)
+        result = op(*args, **kwargs)
+        return True if result is None else result
+    except StockError as e:
+        st.error(f"❌ {e}")
     except Exception as e:
-        st.error(f"❌ Erreur sauvegarde Excel : {e}")
-
-
-def ensure_historique_sheet():
-    wb = load_workbook(EXCEL_PATH)
-    if "Historique_Sorties" not in wb.sheetnames:
-        ws2 = wb.create_sheet("Historique_Sorties")
-        header_fill = PatternFill("solid", start_color="2E4057")
-        header_font = Font(bold=True, color="FFFFFF", name="Arial", size=11)
-        border = Border(left=Side(style="thin"), right=Side(style="thin"),
-                        top=Side(style="thin"), bottom=Side(style="thin"))
-        for col, (h, w) in enumerate(zip(
-            ["Date", "ID_QR", "Designation", "Quantite_Sortie", "Technicien"],
-            [22, 12, 35, 18, 25]
-        ), 1):
-            cell = ws2.cell(row=1, column=col, value=h)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = Alignment(horizontal="center")
-            cell.border = border
-            ws2.column_dimensions[get_column_letter(col)].width = w
-        wb.save(EXCEL_PATH)
-
-
-def append_sortie_to_excel(date_str, id_qr, designation, qte, technicien):
-    wb = load_workbook(EXCEL_PATH)
-    ws = wb["Historique_Sorties"]
-    border = Border(left=Side(style="thin"), right=Side(style="thin"),
-                    top=Side(style="thin"), bottom=Side(style="thin"))
-    next_row = ws.max_row + 1
-    for c_idx, val in enumerate([date_str, id_qr, designation, qte, technicien], 1):
-        cell = ws.cell(next_row, c_idx, val)
-        cell.border = border
-        cell.font = Font(name="Arial", size=10)
-        if next_row % 2 == 0:
-            cell.fill = PatternFill("solid", start_color="EAF0FB")
-    wb.save(EXCEL_PATH)
-
-
-def load_historique_from_excel():
-    return pd.read_excel(EXCEL_PATH, sheet_name="Historique_Sorties", engine="openpyxl")
-
-
-def to_excel_download(df: pd.DataFrame) -> bytes:
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Historique")
-    return output.getvalue()
-
-
-def generate_pdf(id_trans, fournisseur, items_list, total_general) -> bytes:
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", "B", 16)
-    pdf.cell(200, 10, "BON DE RÉCEPTION / FACTURATION STOCK", ln=True, align="C")
-    pdf.set_font("Arial", size=12)
-    pdf.cell(200, 10, f"Référence : {id_trans} | Date : {datetime.now().strftime('%d/%m/%Y')}", ln=True, align="C")
-    pdf.ln(10)
-    pdf.cell(100, 10, "Organisme : Campus Universitaire / UIR", ln=True)
-    pdf.cell(100, 10, f"Fournisseur : {fournisseur}", ln=True)
-    pdf.ln(10)
-    pdf.set_fill_color(200, 220, 255)
-    pdf.set_font("Arial", "B", 11)
-    for col, w in zip(["Désignation", "Qté", "Prix Unitaire", "Total (DH)"], [80, 30, 40, 40]):
-        pdf.cell(w, 10, col, border=1, fill=True)
-    pdf.ln()
-    pdf.set_font("Arial", size=11)
-    for item in items_list:
-        pdf.cell(80, 10, item["nom"], border=1)
-        pdf.cell(30, 10, str(item["qte"]), border=1)
-        pdf.cell(40, 10, str(item["prix"]), border=1)
-        pdf.cell(40, 10, str(item["total"]), border=1)
-        pdf.ln()
-    pdf.ln(5)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(150, 10, "TOTAL GÉNÉRAL : ", align="R")
-    pdf.cell(40, 10, f"{total_general} DH", border=1, align="C")
-    return pdf.output(dest="S").encode("latin-1")
+        st.error(f"❌ Erreur sauvegarde : {e}")
+    return None
+
+
+def choisir_piece(label, key):
+    """Recherche d'une pièce par ID ou désignation (index côté serveur).
+
+    Seuls les meilleurs résultats sont envoyés au navigateur. Renvoie
+    l'ID_QR choisi, ou None tant que rien n'est trouvé.
+    """
+    saisie = st.text_input(f"🔎 {label}", key=f"{key}_saisie",
+                           placeholder="ID ou désignation (ex : roulement 6204, PMP-01)")
+    resultats = store.rechercher(saisie) if saisie.strip() else []
+    if not resultats:
+        if saisie.strip():
+            st.caption("Aucune pièce ne correspond.")
+        return None
+    choix = st.selectbox("Résultats", resultats, format_func=lambda r: f"{r[0]} — {r[1]}",
+                         key=f"{key}_choix", label_visibility="collapsed")
+    return choix[0]
+
+
+def bouton_export(label, rapport, version, fabrique, base, feuille="Export", fmt=None, key=None):
+    """Bouton de téléchargement : l'export n'est produit qu'au clic, puis gardé par version.
+
+    fabrique() renvoie le DataFrame (ou les octets) à exporter ; le format
+    est celui choisi dans la barre latérale, sauf si fmt est imposé.
+    """
+    fmt = fmt or st.session_state.get("format_export", "xlsx")
+    st.download_button(
+        label=f"{label} ({exports.FORMATS[fmt][0]})",
+        data=lambda: exports.exporter((MAGASIN, rapport), version, fabrique, fmt, feuille),
+        file_name=exports.nom_fichier(base, fmt),
+        mime=exports.type_mime(fmt),
+        on_click="ignore",
+        key=key
+    )
 
 
 # ─────────────────────────────────────────────
@@ -196,7 +129,6 @@ for key, val in [
     ("role", None),
     ("username", None),
     ("nom_user", None),
-    ("stock_df", None),
 ]:
     if key not in st.session_state:
         st.session_state[key] = val
@@ -225,8 +157,6 @@ def page_accueil():
             st.session_state.guest_mode = True
             st.session_state.role = "technicien"
             st.session_state.nom_user = "Technicien"
-            if os.path.exists(EXCEL_PATH):
-                st.session_state.stock_df = load_stock_from_excel()
             st.rerun()
 
         st.markdown("<br>", unsafe_allow_html=True)
@@ -268,38 +198,66 @@ def page_app():
     st.sidebar.markdown(f"### 👋 Bonjour, **{nom}**")
     badge = "🔴 Admin" if role == "admin" else "🟢 Technicien"
     st.sidebar.markdown(f"Rôle : {badge}")
+    st.sidebar.selectbox("🏬 Magasin", magasins.noms(), key="magasin")
+    if role == "admin":
+        for nom_mag, res in magasins.charger().items():
+            if isinstance(res, Exception):
+                st.sidebar.error(f"❌ Magasin {nom_mag} illisible au démarrage : {res}")
     st.sidebar.markdown("---")
 
     # Upload Excel (admin seulement)
     if role == "admin":
         st.sidebar.markdown("### 📂 Charger un fichier Excel")
         uploaded_file = st.sidebar.file_uploader("Déposer votre fichier .xlsx", type=["xlsx"])
-        if uploaded_file is not None:
-            with open(EXCEL_PATH, "wb") as f:
-                f.write(uploaded_file.read())
-            df_check = pd.read_excel(EXCEL_PATH, sheet_name=None, engine="openpyxl")
-            if "Stock" not in df_check:
-                st.sidebar.error("❌ Feuille 'Stock' introuvable.")
+        # Le widget renvoie le fichier à chaque rerun : n'importer qu'une fois
+        upload_key = (uploaded_file.name, uploaded_file.size) if uploaded_file is not None else None
+        if upload_key is not None and st.session_state.get("upload_key") != upload_key:
+            st.session_state.upload_key = upload_key
+            # Copie à côté du classeur en place : il n'est remplacé qu'après validation
+            upload_path = os.path.splitext(stockage.excel_path)[0] + "_upload.xlsx"
+            with open(upload_path, "wb") as f:
+                shutil.copyfileobj(uploaded_file, f)
+            try:
+                n_pieces, anomalies = stockage.import_uploaded_workbook(upload_path)
+            except ValueError as e:
+                os.remove(upload_path)
+                st.sidebar.error(f"❌ {e}")
             else:
-                df_s = df_check["Stock"]
-                missing = {"ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH"} - set(df_s.columns)
-                if missing:
-                    st.sidebar.error(f"❌ Colonnes manquantes : {', '.join(missing)}")
-                else:
-                    ensure_historique_sheet()
-                    st.session_state.stock_df = load_stock_from_excel()
-                    st.sidebar.success(f"✅ Fichier chargé : {uploaded_file.name}")
-
-        if st.sidebar.button("🔄 Recharger depuis Excel", key="btn_sidebar_reload"):
-            if os.path.exists(EXCEL_PATH):
-                st.session_state.stock_df = load_stock_from_excel()
+                store.reload()
+                st.sidebar.success(f"✅ Fichier chargé : {uploaded_file.name} ({n_pieces} pièces)")
+                if anomalies:
+                    with st.sidebar.expander(f"⚠️ {len(anomalies)} ligne(s) en anomalie"):
+                        st.write("\n".join(f"- {a}" for a in anomalies))
+
+        if st.sidebar.button("🔄 Recharger le stock", key="btn_sidebar_reload"):
+            if stockage.has_stock():
+                store.reload()
                 st.sidebar.success("Rechargé !")
                 st.rerun()
+        st.sidebar.selectbox("📤 Format des exports", list(exports.FORMATS),
+                             format_func=lambda f: exports.FORMATS[f][0], key="format_export")
         st.sidebar.markdown("---")
 
     # Menu selon rôle
     menus = MENUS_ADMIN if role == "admin" else MENUS_TECH
-    menu  = st.sidebar.radio("Navigation", menus)
+    menu  = st.sidebar.radio("Navigation", menus, key="menu_nav")
+
+    # Indicateur de sauvegarde (écriture différée sur le backend Excel)
+    persistance = stockage.persistence_status()
+    derniere = (f"{datetime.fromtimestamp(persistance['derniere']):%H:%M:%S}"
+                if persistance["derniere"] else "—")
+    st.sidebar.caption(f"💾 Dernière sauvegarde : {derniere}"
+                       + (f" · {persistance['en_attente']} modification(s) en attente"
+                          if persistance["en_attente"] else ""))
+    if persistance["erreur"]:
+        st.sidebar.warning(f"Sauvegarde en échec, nouvel essai automatique : {persistance['erreur']}")
+    if role == "admin":
+        n_alertes = len(surveillance)
+        st.sidebar.caption(f"🔔 {n_alertes} alerte(s) de stock bas ouverte(s)" if n_alertes
+                           else "🔔 Aucune alerte de stock bas")
+        etat_alertes = alerts.etat()
+        if etat_alertes["erreur"]:
+            st.sidebar.warning(f"Alertes : {etat_alertes['erreur']} (nouvel essai automatique)")
 
     st.sidebar.markdown("---")
     # Bouton selon le mode
@@ -321,11 +279,10 @@ def page_app():
     # ── TITRE ──
     st.title("🛠️ Gestion de Stock & Maintenance - Campus UIR")
 
-    # ── GARDE : chargement initial du stock (une seule fois) ──
-    if st.session_state.stock_df is None:
-        if os.path.exists(EXCEL_PATH):
-            st.session_state.stock_df = load_stock_from_excel()
-        elif role == "admin":
+    # ── GARDE : stock disponible (chargé une fois par processus dans le store) ──
+    # La page Magasins reste accessible : création d'un magasin encore vide
+    if not stockage.has_stock() and menu != "🏬 Magasins":
+        if role == "admin":
             st.info("👈 **Chargez votre fichier Excel** via la barre latérale pour commencer.")
             st.markdown("""
 **Colonnes requises dans la feuille `Stock` :**
@@ -346,33 +303,75 @@ def page_app():
         st.subheader("Inventaire des pièces de rechange")
 
         if st.button("🔄 Rafraîchir le stock", type="primary", key="btn_refresh_stock"):
-            st.session_state.stock_df = load_stock_from_excel()
+            store.reload()
             st.rerun()
 
+        vue = store.vue()
         col1, col2 = st.columns([3, 1])
         with col1:
-            df_display = st.session_state.stock_df.copy()
-            df_display["Valeur_Totale_DH"] = df_display["Quantite"] * df_display["Prix_Unitaire_DH"]
-
-            def highlight_low(row):
-                seuil = row.get("Seuil_Alerte", 0) or 0
-                color = "background-color: #FFD6D6" if row["Quantite"] <= seuil else ""
-                return [color] * len(row)
-
-            st.dataframe(df_display.style.apply(highlight_low, axis=1), use_container_width=True)
-            st.caption("🔴 Fond rouge = quantité ≤ seuil d'alerte")
+            f1, f2, f3, f4 = st.columns([3, 2, 1, 1])
+            with f1:
+                recherche = st.text_input("🔍 Rechercher (ID ou désignation)", key="stock_recherche")
+            with f2:
+                tri = st.selectbox("Trier par", ["ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH",
+                                                 "Valeur_Totale_DH", "Seuil_Alerte"], key="stock_tri")
+            with f3:
+                decroissant = st.toggle("↓ Décroissant", key="stock_desc")
+            with f4:
+                alertes_seules = st.toggle("🔴 Alertes", key="stock_alertes")
+
+            taille = st.session_state.get("stock_taille", 100)
+            _, n_lignes = store.page(recherche, tri, decroissant, alertes_seules, 1, taille)
+            n_pages = max(1, -(-n_lignes // taille))
+            p1, p2 = st.columns([1, 1])
+            with p1:
+                num_page = st.number_input(f"Page (sur {n_pages})", min_value=1, max_value=n_pages,
+                                           value=min(st.session_state.get("stock_page", 1), n_pages))
+                st.session_state.stock_page = num_page
+            with p2:
+                st.selectbox("Lignes par page", [50, 100, 250, 500], index=1, key="stock_taille")
+            page_df, _ = store.page(recherche, tri, decroissant, alertes_seules, num_page, taille)
+
+            # Seule la page affichée est stylée (masque vectorisé, pas de callback par ligne)
+            alerte = page_df.pop("Alerte").to_numpy()
+            styles = np.where(alerte[:, None], "background-color: #FFD6D6", "")
+            st.dataframe(
+                page_df.style.apply(lambda d: pd.DataFrame(np.broadcast_to(styles, d.shape), index=d.index,
+                                                           columns=d.columns), axis=None),
+                use_container_width=True
+            )
+            st.caption(f"🔴 Fond rouge = quantité ≤ seuil d'alerte — {n_lignes} pièce(s) trouvée(s)")
         with col2:
-            st.metric("Nb références", len(df_display))
-            total_val = int((df_display["Quantite"] * df_display["Prix_Unitaire_DH"]).sum())
-            st.metric("Valeur totale stock", f"{total_val:,} DH")
+            st.metric("Nb références", len(vue))
+            st.metric("Valeur totale stock", f"{int(vue['Valeur_Totale_DH'].sum()):,} DH")
+            st.metric("Pièces en alerte", int(vue["Alerte"].sum()))
+        # ── Consommation & réapprovisionnement (calculés sur l'historique des sorties) ──
+        with st.expander("📈 Consommation & proposition d'achat"):
+            propositions = get_consommation(stockage).propositions(store.df, store.version)
+            a_commander = proposition_achat(propositions)
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Pièces à commander", len(a_commander))
+            c2.metric("Montant proposé", f"{int(a_commander['Montant_DH'].sum()):,} DH")
+            c3.metric(f"Couverture < {DELAI_FOURNISSEUR_JOURS} j (délai fournisseur)",
+                      int((propositions["Jours_Couverture"] < DELAI_FOURNISSEUR_JOURS).sum()))
+            st.dataframe(a_commander if st.toggle("Seulement les pièces à commander", value=True,
+                                                  key="conso_a_commander") else propositions,
+                         use_container_width=True)
+            if not a_commander.empty:
+                bouton_export("🛒 Exporter la proposition d'achat", "proposition_achat",
+                              (store.version, datetime.now().date()), lambda: a_commander, f"proposition_achat_{datetime.now():%Y%m%d}",
+                              feuille="Proposition_Achat")
+
+        # ── Alertes ouvertes (résolues d'elles-mêmes quand la pièce repasse au-dessus du seuil) ──
+        with st.expander(f"🔔 Alertes de stock bas ouvertes ({len(surveillance)})"):
+            st.dataframe(surveillance.ouvertes(), use_container_width=True)
+            st.caption("Une alerte s'ouvre quand la quantité atteint le seuil et se ferme après une entrée "
+                       "qui la fait repasser au-dessus. Les notifications sont regroupées.")
+
         st.divider()
-        with open(EXCEL_PATH, "rb") as f:
-            st.download_button(
-                label="📥 Télécharger le fichier Excel",
-                data=f.read(),
-                file_name="stock_campus_emi.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+        # Classeur Stock + Historique_Sorties, produit au clic (une fois par version du stock)
+        bouton_export("📥 Télécharger le fichier", "classeur", store.version, stockage.export_workbook_bytes,
+                      "stock_campus_emi", fmt="xlsx", key="btn_export_excel")
 
     # ════════════════════════════════════════
     # ONGLET : MODIFIER LE STOCK  (admin)
@@ -384,25 +383,25 @@ def page_app():
 
         # ── Modifier ──
         with tab1:
-            df = st.session_state.stock_df
-            id_mod = st.selectbox("Sélectionner la pièce à modifier", df["ID_QR"], key="mod_id")
-            idx = df[df["ID_QR"] == id_mod].index[0]
-            row = df.loc[idx]
-
-            with st.form("form_modifier"):
-                new_designation = st.text_input("Désignation", value=str(row["Designation"]))
-                new_qte         = st.number_input("Quantité", min_value=0, value=int(row["Quantite"]))
-                new_prix        = st.number_input("Prix Unitaire (DH)", min_value=0.0, value=float(row["Prix_Unitaire_DH"]), step=0.5)
-                new_seuil       = st.number_input("Seuil d'alerte", min_value=0, value=int(row["Seuil_Alerte"] or 0))
-                submit_mod      = st.form_submit_button("💾 Enregistrer les modifications", type="primary")
-
-            if submit_mod:
-                st.session_state.stock_df.at[idx, "Designation"]     = new_designation
-                st.session_state.stock_df.at[idx, "Quantite"]        = new_qte
-                st.session_state.stock_df.at[idx, "Prix_Unitaire_DH"]= new_prix
-                st.session_state.stock_df.at[idx, "Seuil_Alerte"]    = new_seuil
-                save_stock_to_excel(st.session_state.stock_df)
-                st.success(f"✅ Pièce **{id_mod}** mise à jour et sauvegardée dans Excel.")
+            id_mod = choisir_piece("Pièce à modifier", "mod")
+            row = store.get(id_mod) if id_mod is not None else None
+
+            if row is not None:
+                with st.form("form_modifier"):
+                    new_designation = st.text_input("Désignation", value=str(row["Designation"]))
+                    new_qte         = st.number_input("Quantité", min_value=0, value=int(row["Quantite"]))
+                    new_prix        = st.number_input("Prix Unitaire (DH)", min_value=0.0, value=float(row["Prix_Unitaire_DH"]), step=0.5)
+                    new_seuil       = st.number_input("Seuil d'alerte", min_value=0, value=int(row["Seuil_Alerte"] or 0))
+                    submit_mod      = st.form_submit_button("💾 Enregistrer les modifications", type="primary")
+
+                if submit_mod:
+                    done = run_stock_op(
+                        store.update_piece, id_mod,
+                        Designation=new_designation, Quantite=new_qte,
+                        Prix_Unitaire_DH=new_prix, Seuil_Alerte=new_seuil, auteur=nom
+                    )
+                    if done is not None:
+                        st.success(f"✅ Pièce **{id_mod}** mise à jour et sauvegardée.")
 
         # ── Ajouter ──
         with tab2:
@@ -415,87 +414,272 @@ def page_app():
                 submit_aj = st.form_submit_button("➕ Ajouter la pièce", type="primary")
 
             if submit_aj:
-                df = st.session_state.stock_df
                 if new_id.strip() == "":
                     st.error("❌ L'ID QR ne peut pas être vide.")
-                elif new_id in df["ID_QR"].values:
-                    st.error(f"❌ L'ID **{new_id}** existe déjà.")
-                else:
-                    nouvelle_ligne = pd.DataFrame([{
-                        "ID_QR": new_id, "Designation": new_des,
-                        "Quantite": new_q, "Prix_Unitaire_DH": new_p, "Seuil_Alerte": new_s
-                    }])
-                    st.session_state.stock_df = pd.concat(
-                        [st.session_state.stock_df, nouvelle_ligne], ignore_index=True
-                    )
-                    save_stock_to_excel(st.session_state.stock_df)
+                elif run_stock_op(store.add_piece, new_id, new_des, new_q, new_p, new_s, auteur=nom) is not None:
                     st.success(f"✅ Pièce **{new_id}** ajoutée avec succès.")
 
         # ── Supprimer ──
         with tab3:
-            df = st.session_state.stock_df
-            id_del = st.selectbox("Sélectionner la pièce à supprimer", df["ID_QR"], key="del_id")
-            st.warning(f"⚠️ Vous allez supprimer définitivement **{id_del}** du stock.")
-            if st.button("🗑️ Confirmer la suppression", type="primary", key="btn_supprimer"):
-                st.session_state.stock_df = df[df["ID_QR"] != id_del].reset_index(drop=True)
-                save_stock_to_excel(st.session_state.stock_df)
-                st.success(f"✅ Pièce **{id_del}** supprimée et Excel mis à jour.")
-                st.rerun()
+            id_del = choisir_piece("Pièce à supprimer", "del")
+            if id_del is not None:
+                st.warning(f"⚠️ Vous allez supprimer définitivement **{id_del}** du stock.")
+                if st.button("🗑️ Confirmer la suppression", type="primary", key="btn_supprimer"):
+                    if run_stock_op(store.delete_piece, id_del, auteur=nom) is not None:
+                        st.success(f"✅ Pièce **{id_del}** supprimée du stock.")
+                        st.rerun()
 
     # ════════════════════════════════════════
     # ONGLET : ENTRÉE & FACTURATION  (admin)
     # ════════════════════════════════════════
     elif menu == "📥 Entrée & Facturation":
         st.subheader("Réception de commande & Génération de facture")
-        with st.form("form_entree"):
-            fournisseur = st.text_input("Nom du Fournisseur")
-            id_piece    = st.selectbox("Sélectionner la pièce reçue", st.session_state.stock_df["ID_QR"])
-            qte_entree  = st.number_input("Quantité reçue", min_value=1, value=1)
-            valider     = st.form_submit_button("Enregistrer l'Entrée & Préparer Facture", type="primary")
-
-        if valider:
-            df  = st.session_state.stock_df
-            idx = df[df["ID_QR"] == id_piece].index[0]
-            st.session_state.stock_df.at[idx, "Quantite"] += qte_entree
-            nom_p  = df.at[idx, "Designation"]
-            prix_p = df.at[idx, "Prix_Unitaire_DH"]
-            save_stock_to_excel(st.session_state.stock_df)
-            st.success(f"✅ Stock mis à jour pour **{nom_p}**. Excel sauvegardé.")
-            items_pdf = [{"nom": nom_p, "qte": qte_entree, "prix": prix_p, "total": qte_entree * prix_p}]
-            pdf_bytes = generate_pdf(
-                f"FAC-{datetime.now().strftime('%H%M%S')}", fournisseur, items_pdf, qte_entree * prix_p
-            )
-            st.download_button(
-                label="📄 Télécharger la Feuille de Facturation (PDF)",
-                data=pdf_bytes,
-                file_name=f"facture_{id_piece}.pdf",
-                mime="application/pdf"
-            )
+        tab_une, tab_bl = st.tabs(["📦 Une pièce", "🚚 Bon de livraison (plusieurs lignes)"])
+
+        # ── Une pièce ──
+        with tab_une:
+            # Recherche hors du formulaire : les résultats suivent la saisie
+            id_piece = choisir_piece("Pièce reçue", "entree")
+            valider = False
+            if id_piece is not None:
+                with st.form("form_entree"):
+                    fournisseur = st.text_input("Nom du Fournisseur")
+                    qte_entree  = st.number_input("Quantité reçue", min_value=1, value=1)
+                    valider     = st.form_submit_button("Enregistrer l'Entrée & Préparer Facture", type="primary")
+
+            row = run_stock_op(store.entree, id_piece, qte_entree, auteur=nom) if valider else None
+            if row is not None:
+                nom_p  = row["Designation"]
+                prix_p = row["Prix_Unitaire_DH"]
+                st.success(f"✅ Stock mis à jour pour **{nom_p}**. Stock sauvegardé.")
+                items_pdf = [{"nom": nom_p, "qte": qte_entree, "prix": prix_p, "total": qte_entree * prix_p}]
+                pdf_bytes = generate_pdf(
+                    f"FAC-{datetime.now().strftime('%H%M%S')}", fournisseur, items_pdf, qte_entree * prix_p
+                )
+                st.download_button(
+                    label="📄 Télécharger la Feuille de Facturation (PDF)",
+                    data=pdf_bytes,
+                    file_name=f"facture_{id_piece}.pdf",
+                    mime="application/pdf"
+                )
+
+        # ── Bon de livraison : toutes les lignes en une seule écriture ──
+        with tab_bl:
+            fournisseur_bl = st.text_input("Nom du Fournisseur", key="bl_fournisseur")
+            fichier_bl = st.file_uploader("Bon de livraison (.csv / .xlsx) — colonnes ID_QR, Quantite",
+                                          type=["csv", "xlsx"], key="bl_fichier")
+            if fichier_bl is not None:
+                lignes, erreurs = storage.read_bon_livraison(fichier_bl.getvalue(), fichier_bl.name)
+                for err in erreurs:
+                    st.warning(f"⚠️ {err}")
+            else:
+                st.caption("Ou saisissez les lignes reçues :")
+                lignes = st.data_editor(
+                    pd.DataFrame({"ID_QR": pd.Series(dtype=str), "Quantite": pd.Series(dtype=int)}),
+                    num_rows="dynamic", use_container_width=True, key="bl_editor"
+                ).dropna()
+                lignes = lignes[lignes["Quantite"] > 0]
+
+            if not lignes.empty:
+                reception, inconnus = store.preparer_reception(lignes)
+                if inconnus:
+                    st.error(f"❌ ID inconnus (ignorés) : {', '.join(inconnus)}")
+                st.dataframe(reception, use_container_width=True)
+                total_bl = float(reception["Total_DH"].sum())
+                st.metric("Total réception", f"{total_bl:,.2f} DH")
+
+                if not reception.empty and st.button("📥 Enregistrer la réception", type="primary", key="btn_bl_valider"):
+                    if run_stock_op(store.entree_batch, reception, auteur=nom) is not None:
+                        st.success(f"✅ {len(reception)} ligne(s) ajoutée(s) au stock en une seule sauvegarde.")
+                        items_pdf = [{"nom": r.Designation, "qte": int(r.Quantite), "prix": r.Prix_Unitaire_DH,
+                                      "total": r.Total_DH} for r in reception.itertuples()]
+                        id_trans = f"BR-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                        st.download_button(
+                            label="📄 Télécharger le Bon de Réception (PDF)",
+                            data=generate_pdf(id_trans, fournisseur_bl, items_pdf, round(total_bl, 2)),
+                            file_name=f"bon_reception_{id_trans}.pdf",
+                            mime="application/pdf"
+                        )
 
     # ════════════════════════════════════════
     # ONGLET : HISTORIQUE HEBDO  (admin)
     # ════════════════════════════════════════
     elif menu == "📋 Historique Hebdo":
-        st.subheader("Pièces sorties pendant la semaine")
-        df_hist = load_historique_from_excel()
-        if df_hist.empty or df_hist.dropna(how="all").empty:
-            st.info("Aucune sortie enregistrée pour le moment.")
+        st.subheader("Pièces sorties sur la période")
+        archives = stockage.catalogue_archives()["archives"]
+        if archives:
+            st.caption(f"🗄️ Mois clos archivés : {archives[0]['mois']} → {archives[-1]['mois']} "
+                       f"({sum(a['lignes'] for a in archives):,} sorties), lus seulement si la période les couvre.")
+
+        # Par défaut : les 7 derniers jours (seule cette plage est lue)
+        aujourd_hui = datetime.now().date()
+        col_p, col_t, col_i = st.columns([2, 2, 1])
+        with col_p:
+            periode = st.date_input("📅 Période", value=(aujourd_hui - timedelta(days=6), aujourd_hui),
+                                    max_value=aujourd_hui, key="hist_periode")
+        with col_t:
+            tech_filtre = st.selectbox("👷 Technicien", ["Tous"] + TECHNICIENS, key="hist_tech")
+        with col_i:
+            id_filtre = st.text_input("🔢 ID pièce", key="hist_id").strip().replace(" ", "")
+
+        if len(periode) < 2:
+            st.info("Choisissez une date de fin.")
+            st.stop()
+        debut = datetime.combine(periode[0], datetime.min.time())
+        fin   = datetime.combine(periode[1], datetime.min.time()) + timedelta(days=1)
+
+        df_hebdo = stockage.query_historique(
+            debut, fin,
+            technicien=None if tech_filtre == "Tous" else tech_filtre,
+            id_qr=id_filtre or None
+        )
+        if df_hebdo.empty:
+            st.info("Aucune sortie sur cette période.")
         else:
-            df_hist["Date_dt"] = pd.to_datetime(df_hist["Date"], errors="coerce")
-            df_hebdo = df_hist[
-                df_hist["Date_dt"] > datetime.now() - timedelta(days=7)
-            ].drop(columns=["Date_dt"])
-            if df_hebdo.empty:
-                st.info("Aucune sortie cette semaine.")
-            else:
+            tab_det, tab_tech, tab_piece = st.tabs(["📄 Détail", "👷 Par technicien", "🔩 Par pièce"])
+            with tab_det:
                 st.dataframe(df_hebdo, use_container_width=True)
-                st.metric("Total sorties cette semaine", len(df_hebdo))
-                st.download_button(
-                    label="📊 Exporter vers Excel",
-                    data=to_excel_download(df_hebdo),
-                    file_name=f"rapport_hebdo_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+                st.metric("Total sorties sur la période", len(df_hebdo))
+                bouton_export("📊 Exporter", "rapport_sorties", (store.version, periode, tech_filtre, id_filtre),
+                              lambda: df_hebdo, f"rapport_sorties_{periode[0]:%Y%m%d}_{periode[1]:%Y%m%d}",
+                              feuille="Historique")
+            with tab_tech:
+                st.dataframe(stockage.rollup_historique("Technicien", debut, fin), use_container_width=True)
+                # Un bon de sortie PDF par technicien, générés en lot
+                if st.button("🧾 Préparer les bons de sortie (PDF par technicien)", key="btn_bons_lot"):
+                    docs = bons_sortie_par_technicien(df_hebdo, store.df, periode[0], periode[1])
+                    st.session_state.bons_lot = ((periode, tech_filtre, id_filtre), batch_zip(docs), len(docs))
+                lot = st.session_state.get("bons_lot")
+                if lot and lot[0] == (periode, tech_filtre, id_filtre):
+                    st.download_button(
+                        label=f"📦 Télécharger les {lot[2]} bon(s) de sortie (ZIP)",
+                        data=lot[1],
+                        file_name=f"bons_sortie_{periode[0]:%Y%m%d}_{periode[1]:%Y%m%d}.zip",
+                        mime="application/zip"
+                    )
+            with tab_piece:
+                st.dataframe(stockage.rollup_historique("ID_QR", debut, fin), use_container_width=True)
+
+    # ════════════════════════════════════════
+    # ONGLET : STOCK À DATE  (admin)
+    # ════════════════════════════════════════
+    elif menu == "🕰️ Stock à date":
+        st.subheader("Stock à une date passée")
+        st.caption("Reconstitué à partir du grand livre des mouvements (sorties, entrées, transferts, "
+                   "modifications, suppressions, imports).")
+
+        col_d, col_h = st.columns(2)
+        with col_d:
+            jour = st.date_input("📅 Date", value=datetime.now().date(), max_value=datetime.now().date(),
+                                 key="sad_date")
+        with col_h:
+            heure = st.time_input("🕐 Heure", value=datetime.max.time().replace(microsecond=0), key="sad_heure")
+        instant = datetime.combine(jour, heure)
+
+        try:
+            df_date, depuis, n_rejoues = stockage.stock_a_date(instant)
+        except ValueError as e:
+            st.info(str(e))
+            st.stop()
+        st.caption(f"Point de stock du {depuis} + {n_rejoues} mouvement(s) rejoué(s).")
+        df_date["Valeur_Totale_DH"] = df_date["Quantite"] * df_date["Prix_Unitaire_DH"]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Références", len(df_date))
+        col2.metric("Pièces en stock", int(df_date["Quantite"].sum()))
+        col3.metric("Valeur du stock", f"{df_date['Valeur_Totale_DH'].sum():,.2f} DH")
+        st.dataframe(df_date, use_container_width=True)
+        bouton_export("📊 Exporter le stock à date", "stock_a_date", (store.version, instant),
+                      lambda: df_date, f"stock_au_{instant:%Y%m%d_%H%M}", feuille="Stock_a_date")
+
+        with st.expander("📜 Mouvements depuis cette date"):
+            df_mvt = stockage.query_mouvements(instant)
+            st.dataframe(df_mvt, use_container_width=True)
+            bouton_export("📊 Exporter les mouvements", "mouvements", (store.version, instant),
+                          lambda: df_mvt, f"mouvements_depuis_{instant:%Y%m%d_%H%M}", feuille="Mouvements")
+
+    # ════════════════════════════════════════
+    # ONGLET : MAGASINS  (admin)
+    # ════════════════════════════════════════
+    elif menu == "🏬 Magasins":
+        st.subheader("Magasins : stock consolidé et transferts")
+
+        vue_tous = magasins.vue_consolidee()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Magasins", len(magasins.noms()))
+        col2.metric("Valeur totale (tous magasins)", f"{int(vue_tous['Valeur_Totale_DH'].sum()):,} DH")
+        col3.metric("Pièces en alerte", int(vue_tous["Alerte"].sum()))
+        st.dataframe(magasins.synthese(vue_tous), use_container_width=True)
+
+        tab_conso, tab_transfert, tab_nouveau = st.tabs(["📊 Stock consolidé", "🔁 Transfert", "➕ Nouveau magasin"])
+        with tab_conso:
+            consolide = magasins.stock_consolide(vue_tous)
+            st.dataframe(consolide, use_container_width=True)
+            bouton_export("📊 Exporter le stock consolidé", "stock_consolide", magasins.version(),
+                          lambda: consolide, f"stock_consolide_{datetime.now():%Y%m%d}",
+                          feuille="Stock_consolide")
+
+        with tab_transfert:
+            autres = [m for m in magasins.noms() if m != MAGASIN]
+            if not autres:
+                st.info("Créez un second magasin pour y transférer des pièces.")
+            elif not stockage.has_stock():
+                st.info(f"Le magasin **{MAGASIN}** est vide : chargez d'abord son fichier Excel.")
+            else:
+                st.caption(f"Depuis **{MAGASIN}** (magasin choisi dans la barre latérale).")
+                id_transfert = choisir_piece("Pièce à transférer", "transfert")
+                if id_transfert is not None:
+                    with st.form("form_transfert"):
+                        destination = st.selectbox("Vers le magasin", autres)
+                        qte_transfert = st.number_input("Quantité", min_value=1, value=1)
+                        valider_transfert = st.form_submit_button("🔁 Transférer", type="primary")
+                    if valider_transfert:
+                        res = run_stock_op(magasins.transferer, id_transfert, qte_transfert, MAGASIN,
+                                           destination, auteur=nom)
+                        if res is not None:
+                            st.success(f"✅ {qte_transfert} × **{id_transfert}** transféré(s) vers {destination} "
+                                       f"(reste {res[0]} ici, {res[1]} à destination).")
+
+        with tab_nouveau:
+            with st.form("form_magasin"):
+                nom_magasin = st.text_input("Nom du magasin (bâtiment, réserve...)")
+                creer_magasin = st.form_submit_button("➕ Créer le magasin")
+            if creer_magasin and run_stock_op(magasins.creer, nom_magasin) is not None:
+                # Nouveau rendu : le magasin apparaît dans la barre latérale et les transferts
+                st.session_state.magasin_cree = nom_magasin.strip()
+                st.rerun()
+            if st.session_state.get("magasin_cree"):
+                st.success(f"✅ Magasin **{st.session_state.magasin_cree}** créé. Choisissez-le dans la barre "
+                           "latérale puis chargez son fichier Excel.")
+                st.session_state.magasin_cree = None
+
+    # ════════════════════════════════════════
+    # ONGLET : PERFORMANCES  (admin)
+    # ════════════════════════════════════════
+    elif menu == "⏱️ Performances":
+        st.subheader("Temps de réponse par opération")
+        st.caption(f"Percentiles sur les {metrics.BUFFER_SIZE} derniers appels de chaque opération "
+                   "(depuis le démarrage du serveur).")
+        df_perf = metrics.snapshot()
+        if df_perf.empty:
+            st.info("Aucune mesure pour l'instant.")
+        else:
+            st.dataframe(df_perf, use_container_width=True)
+            st.bar_chart(df_perf.set_index("Operation")[["p50_ms", "p95_ms", "p99_ms"]])
+        col_a, col_b, col_c = st.columns(3)
+        with col_a:
+            st.download_button(
+                label="📥 Mesures (format Prometheus)",
+                data=metrics.prometheus_text(),
+                file_name="gmao_metrics.prom",
+                mime="text/plain"
+            )
+        with col_b:
+            if metrics.METRICS_PATH and st.button("💾 Écrire le fichier de mesures", key="btn_metrics_dump"):
+                st.success(f"✅ Écrit : {metrics.dump()}")
+        with col_c:
+            if st.button("🧹 Remettre à zéro", key="btn_metrics_reset"):
+                metrics.reset()
+                st.rerun()
 
     # ════════════════════════════════════════
     # ONGLET : SORTIE DE PIÈCE  (tous)
@@ -503,6 +687,10 @@ def page_app():
     elif menu == "📤 Sortie de Pièce (Scan)":
         st.subheader("Sortie de matériel par Scan QR")
 
+        if st.toggle("🛒 Mode panier (plusieurs pièces)", key="mode_panier"):
+            page_sortie_panier()
+            return
+
         # ── Initialisation de l'ID scanné en session ──
         if "scanned_id" not in st.session_state:
             st.session_state.scanned_id = ""
@@ -512,11 +700,9 @@ def page_app():
 
         if img_file is not None:
             if QR_DECODE_AVAILABLE:
-                img = Image.open(img_file).convert("RGB")
-                img_np = np.array(img)
-                results = zxingcpp.read_barcodes(img_np)
-                if results:
-                    decoded = results[0].text.strip().replace(" ", "")
+                codes = decode_frame(img_file.getvalue())
+                if codes:
+                    decoded = codes[0]
                     st.session_state.scanned_id = decoded
                     st.success(f"✅ QR Code détecté : **{decoded}**")
                 else:
@@ -535,81 +721,140 @@ def page_app():
         st.session_state.scanned_id = id_scan
 
         # Aperçu de la pièce si l'ID est reconnu
-        df = st.session_state.stock_df
-        # Normalisation des IDs du stock pour comparaison robuste
-        df_ids = df["ID_QR"].astype(str).str.strip()
-        if id_scan and id_scan in df_ids.values:
-            idx = df[df_ids == id_scan].index[0]
-            nom = df.at[idx, "Designation"]
-            st.info(f"🔩 **{nom}**")
+        piece = store.get(id_scan) if id_scan else None
+        if piece is not None:
+            st.info(f"🔩 **{piece['Designation']}**")
         elif id_scan:
             st.error(f"❌ Pièce '{id_scan}' non trouvée dans la base de données.")
 
         qte_sortie = st.number_input("Quantité à retirer", min_value=1, value=1)
 
         # Nom du technicien : liste déroulante
-        techniciens = [
-            "HEDDIOUI HANANE",
-            "BELALLAM EL MEHDI",
-            "TAAMY TAYEB",
-            "ELBAJJAR ANDERAHIM",
-            "EL BAGARI JOUAD",
-            "MALKI RABIE",
-            "LGHZAL ABDELLAH",
-            "BELYAMANE YOUSSEF",
-            "ELHABCHI HOUSSINE",
-            "LAHBI TEHAMI",
-            "MOUHAH AZIZ",
-            "CHERKAOUI ALAA-EDDIN",
-            "LAHMAIRI AYOUB",
-            "OULAD LAMKASSE NOUR EDDINE",
-            "EL JLAYDI AYOUB",
-        ]
-        user_name = st.selectbox("👷 Nom du technicien", techniciens)
+        user_name = st.selectbox("👷 Nom du technicien", TECHNICIENS)
 
         if "last_sortie_msg" in st.session_state and st.session_state.last_sortie_msg:
             st.success(st.session_state.last_sortie_msg)
             st.session_state.last_sortie_msg = ""
 
         if st.button("✅ Valider la Sortie", type="primary", key="btn_valider_sortie"):
-            # Relire le stock frais depuis la session au moment du clic
-            df_live = st.session_state.stock_df.copy()
-            df_live_ids = df_live["ID_QR"].astype(str).str.strip()
             id_val = st.session_state.scanned_id.strip()
 
             if not id_val:
                 st.warning("⚠️ Veuillez scanner ou saisir un ID.")
-            elif id_val in df_live_ids.values:
-                idx = df_live[df_live_ids == id_val].index[0]
-                stock_actuel = int(df_live.at[idx, "Quantite"])
-                designation  = df_live.at[idx, "Designation"]
-                if stock_actuel >= qte_sortie:
-                    # Mise à jour directe sur st.session_state.stock_df
-                    st.session_state.stock_df.at[idx, "Quantite"] = stock_actuel - qte_sortie
-                    # Sauvegarde Excel
-                    save_stock_to_excel(st.session_state.stock_df)
-                    # Historique
-                    append_sortie_to_excel(
-                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        id_val, designation, qte_sortie, user_name
-                    )
+            else:
+                # Vérification + décrément atomiques dans le store partagé (+ historique)
+                res = run_stock_op(store.sortie, id_val, qte_sortie, user_name)
+                if res is not None:
+                    designation, _ = res
                     st.session_state.scanned_id = ""
                     st.session_state.guest_mode = False
                     st.session_state.role = None
                     st.session_state.nom_user = None
                     st.session_state["last_sortie_msg"] = f"✅ Sortie validée : {qte_sortie} × {designation} retiré(s) par {user_name}."
                     st.rerun()
-                else:
-                    st.error(f"❌ Stock insuffisant ! Stock actuel : {stock_actuel}")
+
+
+# ─────────────────────────────────────────────
+# SORTIE GROUPÉE (PANIER)
+# ─────────────────────────────────────────────
+
+def page_sortie_panier():
+    """Plusieurs pièces par photo ou par scans successifs, validées en une fois."""
+    if "panier" not in st.session_state:
+        st.session_state.panier = {}
+    panier = st.session_state.panier
+
+    # ── Caméra : tous les codes de la photo vont dans le panier ──
+    img_file = st.camera_input("📷 Scanner une ou plusieurs pièces", key="cam_panier")
+    if img_file is not None:
+        data = img_file.getvalue()
+        frame_id = hashlib.blake2b(data, digest_size=16).hexdigest()
+        # Un rerun renvoie la même photo : ne l'ajouter qu'une fois
+        if st.session_state.get("panier_last_frame") != frame_id:
+            st.session_state.panier_last_frame = frame_id
+            if not QR_DECODE_AVAILABLE:
+                st.warning("⚠️ Décodage non disponible. Saisissez l'ID manuellement.")
             else:
-                st.warning(f"⚠️ Pièce '{id_val}' non trouvée dans la base de données.")
+                codes = decode_frame(data)
+                if not codes:
+                    st.warning("⚠️ Aucun code lisible sur la photo.")
+                for code in codes:
+                    if code in store:
+                        panier[code] = panier.get(code, 0) + 1
+                    else:
+                        st.error(f"❌ Pièce '{code}' non trouvée dans la base de données.")
+                if codes:
+                    st.success(f"✅ {len(codes)} code(s) détecté(s) : {', '.join(codes)}")
+
+    # ── Ajout manuel ──
+    col_id, col_q, col_b = st.columns([3, 1, 1])
+    with col_id:
+        id_manuel = st.text_input("🔢 ID de la pièce", placeholder="Ex: PMP-01", key="panier_id")
+    with col_q:
+        qte_manuel = st.number_input("Quantité", min_value=1, value=1, key="panier_qte")
+    with col_b:
+        st.markdown("<br>", unsafe_allow_html=True)
+        if st.button("➕ Ajouter", key="btn_panier_ajouter"):
+            code = id_manuel.strip().replace(" ", "")
+            if code in store:
+                panier[code] = panier.get(code, 0) + qte_manuel
+            elif code:
+                st.error(f"❌ Pièce '{code}' non trouvée dans la base de données.")
+
+    if not panier:
+        st.info("🛒 Panier vide : scannez ou saisissez des pièces.")
+        return
+
+    # ── Contenu du panier (quantités modifiables, lignes supprimables) ──
+    lignes = []
+    for code, qte in panier.items():
+        piece = store.get(code)
+        lignes.append({
+            "ID_QR": code,
+            "Designation": piece["Designation"] if piece is not None else "?",
+            "Quantite": qte,
+            "Stock": int(piece["Quantite"]) if piece is not None else 0,
+        })
+    edited = st.data_editor(
+        pd.DataFrame(lignes), num_rows="dynamic", use_container_width=True, key="panier_editor",
+        disabled=["ID_QR", "Designation", "Stock"],
+        column_config={"Quantite": st.column_config.NumberColumn("Quantité", min_value=1, step=1)}
+    )
+    st.session_state.panier = panier = {
+        r.ID_QR: int(r.Quantite) for r in edited.dropna(subset=["ID_QR"]).itertuples() if r.Quantite
+    }
+
+    user_name = st.selectbox("👷 Nom du technicien", TECHNICIENS, key="panier_tech")
+    col_v, col_vider = st.columns(2)
+    with col_vider:
+        if st.button("🗑️ Vider le panier", key="btn_panier_vider"):
+            st.session_state.panier = {}
+            st.rerun()
+    with col_v:
+        if st.button("✅ Valider le panier", type="primary", key="btn_panier_valider"):
+            # Toutes les quantités vérifiées d'abord ; rien n'est retiré si une ligne est refusée
+            res = run_stock_op(store.sortie_batch, list(panier.items()), user_name)
+            if res is not None:
+                total = sum(q for _, _, q, _ in res)
+                st.session_state.panier = {}
+                st.session_state.guest_mode = False
+                st.session_state.role = None
+                st.session_state.nom_user = None
+                st.session_state["last_sortie_msg"] = (
+                    f"✅ Sortie validée : {total} pièce(s) sur {len(res)} référence(s) "
+                    f"retirée(s) par {user_name}."
+                )
+                st.rerun()
 
 
 # ─────────────────────────────────────────────
 # ROUTAGE PRINCIPAL
 # ─────────────────────────────────────────────
 
+# Chaque rendu est chronométré sous le nom de la page affichée
 if not st.session_state.logged_in and not st.session_state.guest_mode:
-    page_accueil()
+    with metrics.mesure("page.accueil"):
+        page_accueil()
 else:
-    page_app()
+    with metrics.mesure(lambda: f"page.{st.session_state.get('menu_nav', 'app')}"):
+        page_app()
@@ -0,0 +1,981 @@
+"""Bancs d'essai de la GMAO, exécutables sans Streamlit.
+
+    python benchmark.py stress --backend sqlite --threads 16 --sorties 100
+    python benchmark.py qr --images 40            (corpus synthétique)
+    python benchmark.py qr --corpus photos/       (fichiers <ID>__*.jpg)
+    python benchmark.py pdf --workers 4
+    python benchmark.py api --requests 5000 --threads 64   (instance locale)
+    python benchmark.py api --url http://douchette:8502     (instance existante)
+    python benchmark.py table --parts 100000   (DataFrame contre StockTable)
+    python benchmark.py grand_livre --parts 10000 --mouvements 50000
+    python benchmark.py recherche --parts 100000   (index de trigrammes)
+    python benchmark.py magasins --magasins 6 --parts 20000 --workers 6
+    python benchmark.py archives --parts 5000 --historique 200000   (rotation de l'historique)
+    python benchmark.py suite --sizes 1000,10000,200000 --historique 2000000 \
+        --output rapport.json --baseline rapport_precedent.json
+
+Chaque scénario travaille dans un dossier temporaire et affiche un
+rapport JSON.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl import Workbook
+from fpdf import FPDF
+from PIL import Image, ImageFilter
+
+import alerts
+import exports
+import invoice
+import magasins
+import qr_decode
+import storage
+from stock_store import StockStore, StockInsuffisant
+from search import IndexRecherche, TOP_K
+from stock_table import StockTable
+
+
+# ─────────────────────────────────────────────
+# DONNÉES SYNTHÉTIQUES
+# ─────────────────────────────────────────────
+
+TECHNICIENS = ["HEDDIOUI HANANE", "EL AMRANI YOUSSEF", "BENALI KARIM", "TAZI SAMIRA", "OUALI MEHDI"]
+FAMILLES = ["Roulement", "Courroie", "Filtre", "Joint", "Fusible", "Contacteur", "Capteur", "Vanne"]
+
+
+def make_workbook(path, n_parts, quantite=100, seed=0, historique=0, jours=365):
+    """Classeur au format de l'application : Stock (+ Historique_Sorties).
+
+    Écrit en mode write_only pour tenir des centaines de milliers de lignes.
+    quantite=None tire des quantités réalistes (beaucoup de petites, quelques
+    ruptures) ; historique = nombre de sorties réparties sur `jours` jours.
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Stock")
+    ws.append(["ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH",
+               "Valeur_Totale_DH", "Seuil_Alerte"])
+    for i in range(n_parts):
+        qte = quantite if quantite is not None else int(rng.expovariate(1 / 25))
+        ws.append([f"P-{i:06d}", f"{rng.choice(FAMILLES)} {i}", qte,
+                   round(rng.uniform(5, 2000), 2), None, rng.randint(0, 10)])
+    ws.append(["TOTAL"])
+    if historique:
+        hs = wb.create_sheet("Historique_Sorties")
+        hs.append(storage.HISTORIQUE_COLUMNS)
+        debut = datetime.now() - timedelta(days=jours)
+        pas = jours * 86400 / historique
+        # Quelques pièces très demandées, une longue traîne rarement sortie
+        for k in range(historique):
+            i = min(int(rng.paretovariate(1.2)) - 1, n_parts - 1)
+            date = debut + timedelta(seconds=k * pas)
+            hs.append([date.strftime(storage.DATE_FORMAT), f"P-{i:06d}", f"Pièce {i}",
+                       rng.randint(1, 5), rng.choice(TECHNICIENS)])
+    wb.save(path)
+
+
+def make_qr_photo(text, rng, size=(2448, 3264), blur=0.0):
+    """Photo de téléphone simulée : QR collé sur un fond bruité, incliné, JPEG."""
+    import zxingcpp
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        qr = Image.fromarray(np.asarray(zxingcpp.write_barcode(zxingcpp.BarcodeFormat.QRCode, text, 400, 400)))
+    side = rng.randint(250, 700)
+    qr = qr.resize((side, side), Image.Resampling.NEAREST).convert("RGB")
+    qr = qr.rotate(rng.uniform(-25, 25), expand=True, fillcolor=(255, 255, 255))
+    noise = np.random.default_rng(rng.randint(0, 2**31)).integers(90, 200, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    photo = Image.fromarray(noise).resize(size, Image.Resampling.BILINEAR)
+    photo.paste(qr, (rng.randint(0, size[0] - qr.width), rng.randint(0, size[1] - qr.height)))
+    if blur:
+        photo = photo.filter(ImageFilter.GaussianBlur(blur))
+    out = io.BytesIO()
+    photo.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def load_qr_corpus(args):
+    if args.corpus:
+        files = sorted(glob.glob(os.path.join(args.corpus, "*")))
+        return [(os.path.basename(f).split("__")[0], open(f, "rb").read()) for f in files]
+    rng = random.Random(0)
+    blurs = [0.0, 0.0, 1.5, 3.0, 5.0]
+    return [(f"PMP-{i:02d}", make_qr_photo(f"PMP-{i:02d}", rng, blur=blurs[i % len(blurs)]))
+            for i in range(args.images)]
+
+
+# ─────────────────────────────────────────────
+# SCÉNARIOS
+# ─────────────────────────────────────────────
+
+def bench_stress(args):
+    """Sorties simultanées : aucune mise à jour perdue, stock jamais négatif."""
+    storage.STORAGE_BACKEND = args.backend
+    make_workbook(storage.EXCEL_PATH, args.parts, quantite=args.quantite)
+    storage.init_storage()
+    storage.ensure_historique_sheet()
+    store = StockStore()
+    ids = list(store.df["ID_QR"])
+
+    done = Counter()
+    refused = Counter()
+    counters_lock = threading.Lock()
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(args.sorties):
+            id_qr = rng.choice(ids)
+            try:
+                store.sortie(id_qr, 1, f"T{seed}")
+                with counters_lock:
+                    done[id_qr] += 1
+            except StockInsuffisant:
+                with counters_lock:
+                    refused[id_qr] += 1
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    # Vérification sur le cache et sur les données relues depuis le stockage
+    en_attente = storage.persistence_status()["en_attente"]
+    if not storage.use_sqlite():
+        # Comme à l'arrêt : écritures différées puis journal des sorties
+        storage.flush_pending()
+        storage.compact_journal()
+    expected = {i: max(args.quantite - done[i], 0) for i in ids}
+    cache = dict(zip(store.df["ID_QR"], store.df["Quantite"]))
+    persisted_df = storage.load_stock_from_db() if storage.use_sqlite() else storage.load_stock_from_excel()
+    persisted = dict(zip(persisted_df["ID_QR"], persisted_df["Quantite"]))
+    n_hist = len(storage.load_historique().dropna(how="all"))
+    total = sum(done.values())
+    return {
+        "scenario": "stress",
+        "backend": args.backend,
+        "threads": args.threads,
+        "parts": args.parts,
+        "sorties_ok": total,
+        "sorties_refusees": sum(refused.values()),
+        "errors": errors[:10],
+        "sans_erreur": not errors,
+        "seconds": round(elapsed, 3),
+        "sorties_per_s": round(total / elapsed, 1) if elapsed else None,
+        "en_attente_fin": en_attente,
+        "cache_ok": cache == expected,
+        "persisted_ok": persisted == expected,
+        "historique_ok": n_hist == total,
+    }
+
+
+def _latency_stats(samples):
+    arr = np.array(samples) * 1000
+    return {"p50_ms": round(float(np.percentile(arr, 50)), 1),
+            "p95_ms": round(float(np.percentile(arr, 95)), 1),
+            "mean_ms": round(float(arr.mean()), 1)}
+
+
+def _decode_legacy(data):
+    """Ancien chemin de app.py : RGB pleine résolution, tous les formats."""
+    import zxingcpp
+    results = zxingcpp.read_barcodes(np.array(Image.open(io.BytesIO(data)).convert("RGB")))
+    return [r.text.strip().replace(" ", "") for r in results]
+
+
+def bench_qr(args):
+    """Latence et taux de lecture : ancien décodage contre pipeline progressif."""
+    corpus = load_qr_corpus(args)
+    report = {"scenario": "qr", "images": len(corpus)}
+    for name, decode in [("ancien", _decode_legacy),
+                         ("pipeline", lambda data: qr_decode.decode_frame(data))]:
+        times, hits = [], 0
+        for expected, data in corpus:
+            qr_decode._cache.clear()
+            t0 = time.perf_counter()
+            codes = decode(data)
+            times.append(time.perf_counter() - t0)
+            hits += expected in codes
+        report[name] = {"hit_rate": round(hits / len(corpus), 3), **_latency_stats(times)}
+
+    passes = Counter(qr_decode.decode_frame_detail(data)[1] for _, data in corpus)
+    report["pipeline"]["passes"] = {str(k): v for k, v in passes.items()}
+    # Rerun Streamlit avec la même photo : servi par le cache
+    t0 = time.perf_counter()
+    for _, data in corpus:
+        qr_decode.decode_frame(data)
+    report["pipeline"]["cached_mean_ms"] = round((time.perf_counter() - t0) * 1000 / len(corpus), 3)
+    return report
+
+
+def _items(n, rng):
+    items = []
+    for i in range(n):
+        qte, prix = rng.randint(1, 50), round(rng.uniform(5, 2000), 2)
+        items.append({"nom": f"P-{i:06d} - Pièce {i} " + "roulement joint filtre "[:rng.randint(0, 24)],
+                      "qte": qte, "prix": prix, "total": round(qte * prix, 2)})
+    return items
+
+
+def _pdf_legacy(id_trans, fournisseur, items_list, total_general):
+    """Ancien generate_pdf de app.py : pas d'en-tête répété ni de sous-totaux."""
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(200, 10, "BON DE RÉCEPTION / FACTURATION STOCK", ln=True, align="C")
+    pdf.set_font("Arial", size=12)
+    pdf.cell(100, 10, f"Fournisseur : {fournisseur}", ln=True)
+    pdf.set_font("Arial", size=11)
+    for item in items_list:
+        pdf.cell(80, 10, item["nom"], border=1)
+        pdf.cell(30, 10, str(item["qte"]), border=1)
+        pdf.cell(40, 10, str(item["prix"]), border=1)
+        pdf.cell(40, 10, str(item["total"]), border=1)
+        pdf.ln()
+    pdf.cell(40, 10, f"{total_general} DH", border=1, align="C")
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def bench_pdf(args):
+    """Un bon de 1000 lignes, puis 1000 bons de 5 lignes (séquentiel et pool)."""
+    rng = random.Random(0)
+    gros = _items(1000, rng)
+    total = round(sum(i["total"] for i in gros), 2)
+    report = {"scenario": "pdf"}
+
+    t0 = time.perf_counter()
+    data = _pdf_legacy("BR-1", "Fournisseur", gros, total)
+    report["1x1000_ancien"] = {"seconds": round(time.perf_counter() - t0, 3), "bytes": len(data)}
+    t0 = time.perf_counter()
+    data = invoice.render_bon("BR-1", "Fournisseur", gros, total)
+    report["1x1000"] = {"seconds": round(time.perf_counter() - t0, 3), "bytes": len(data),
+                        "pages": data.count(b"/Type /Page\n")}
+
+    docs = []
+    for i in range(1000):
+        items = _items(5, rng)
+        docs.append({"fichier": f"bon_{i:04d}.pdf", "id_trans": f"BR-{i:04d}", "tiers": f"Fournisseur {i % 40}",
+                     "items_list": items, "total_general": round(sum(x["total"] for x in items), 2)})
+    for label, workers in [("1000x5_sequentiel", 1), ("1000x5_pool", args.workers)]:
+        t0 = time.perf_counter()
+        out = invoice.render_batch(docs, workers=workers)
+        elapsed = time.perf_counter() - t0
+        report[label] = {"workers": workers or os.cpu_count(), "seconds": round(elapsed, 3),
+                         "docs_per_s": round(len(out) / elapsed, 1)}
+    return report
+
+
+def _timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"median_s": round(statistics.median(times), 6), "min_s": round(min(times), 6), "runs": repeat}
+
+
+def _environnement():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"date": datetime.now().isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "pandas": pd.__version__,
+            "openpyxl": openpyxl.__version__, "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def _suite_taille(n_parts, args, rng):
+    """Chemins chauds de l'application pour un classeur de n_parts pièces."""
+    path = storage.EXCEL_PATH
+    t0 = time.perf_counter()
+    make_workbook(path, n_parts, quantite=None, historique=args.historique)
+    res = {"generation_s": round(time.perf_counter() - t0, 3), "fichier_mo": round(os.path.getsize(path) / 1e6, 2)}
+    r = args.repeat
+
+    # ── Classeur Excel ──
+    res["load_stock_from_excel"] = _timeit(lambda: storage.load_stock_from_excel(path), r)
+    df = storage.load_stock_from_excel(path)
+    ids = list(df["ID_QR"])
+    cible = rng.choice(ids)
+    res["save_stock_to_excel"] = _timeit(lambda: storage.save_stock_to_excel(df, path), r)
+    res["save_stock_to_excel_delta"] = _timeit(
+        lambda: storage.save_stock_to_excel(df, path, changed={cible}), r)
+    now = datetime.now().strftime(storage.DATE_FORMAT)
+    res["append_sortie_to_excel"] = _timeit(
+        lambda: storage.append_sortie_to_excel(now, cible, "Pièce", 1, TECHNICIENS[0], path), r)
+    res["load_historique_from_excel"] = _timeit(lambda: storage.load_historique_from_excel(path), r)
+    df_hist = storage.load_historique_from_excel(path)
+    fin = datetime.now() + timedelta(days=1)
+    debut = fin - timedelta(days=8)
+    res["filtre_hebdo"] = _timeit(lambda: storage._filter_historique(df_hist, debut, fin), r)
+    semaine = storage._filter_historique(df_hist, debut, fin)
+    res["to_excel_download_hebdo"] = _timeit(lambda: exports.en_xlsx(semaine), r)
+
+    # ── SQLite ──
+    res["import_excel_to_db"] = _timeit(lambda: storage.import_excel_to_db(), 1)
+    res["load_stock_from_db"] = _timeit(lambda: storage.load_stock_from_db(), r)
+    res["query_historique_db_hebdo"] = _timeit(lambda: storage.query_historique_db(debut, fin), r)
+    res["sortie_db"] = _timeit(lambda: storage.sortie_db(cible, 0, now, TECHNICIENS[0]), r)
+
+    # ── Recherche d'une pièce par ID ──
+    storage.STORAGE_BACKEND = "sqlite"
+    store = StockStore()
+    store.reload()
+    tirage = [rng.choice(ids) for _ in range(1000)]
+    t0 = time.perf_counter()
+    for i in tirage:
+        store.get(i)
+    res["lookup_index_us"] = round((time.perf_counter() - t0) / len(tirage) * 1e6, 2)
+    t0 = time.perf_counter()
+    for i in tirage[:100]:
+        df[df["ID_QR"] == i]
+    res["lookup_scan_us"] = round((time.perf_counter() - t0) / 100 * 1e6, 2)
+
+    # ── Documents ──
+    items = _items(10, rng)
+    res["generate_pdf_10_lignes"] = _timeit(
+        lambda: invoice.generate_pdf("BR-1", "Fournisseur", items, sum(x["total"] for x in items)), r)
+    return res
+
+
+def bench_suite(args):
+    """Tous les chemins chauds, par taille de classeur ; rapport comparable entre versions."""
+    rng = random.Random(0)
+    sizes = [int(x) for x in args.sizes.split(",")]
+    report = {"scenario": "suite", "environnement": _environnement(),
+              "parametres": {"sizes": sizes, "historique": args.historique, "repeat": args.repeat},
+              "tailles": {}}
+    racine = os.getcwd()
+    for n in sizes:
+        dossier = os.path.join(racine, f"n{n}")
+        os.makedirs(dossier)
+        os.chdir(dossier)
+        try:
+            report["tailles"][str(n)] = _suite_taille(n, args, rng)
+        finally:
+            os.chdir(racine)
+        print(f"… {n} pièces terminé", file=sys.stderr)
+
+    corpus = [(f"PMP-{i:02d}", make_qr_photo(f"PMP-{i:02d}", rng)) for i in range(min(args.images, 10))]
+    times = []
+    for _, data in corpus:
+        qr_decode._cache.clear()
+        t0 = time.perf_counter()
+        qr_decode.decode_frame(data)
+        times.append(time.perf_counter() - t0)
+    report["qr_decode"] = _latency_stats(times)
+
+    if args.baseline:
+        report["regressions"] = compare_reports(report, json.load(open(args.baseline)), args.tolerance)
+    return report
+
+
+def verifications_echouees(report, prefixe=""):
+    """Contrôles du rapport (valeurs booléennes) qui ont échoué : ["persisted_ok", ...]."""
+    echecs = []
+    for nom, valeur in report.items():
+        if valeur is False:
+            echecs.append(prefixe + nom)
+        elif isinstance(valeur, dict):
+            echecs += verifications_echouees(valeur, f"{prefixe}{nom}.")
+    return echecs
+
+
+def compare_reports(report, baseline, tolerance):
+    """Mesures plus lentes que la référence de plus de `tolerance` (0.2 = +20 %)."""
+    regressions = []
+    for taille, mesures in report.get("tailles", {}).items():
+        ref = baseline.get("tailles", {}).get(taille, {})
+        for nom, m in mesures.items():
+            if not isinstance(m, dict) or not isinstance(ref.get(nom), dict):
+                continue
+            avant, apres = ref[nom]["median_s"], m["median_s"]
+            if avant > 0 and apres > avant * (1 + tolerance):
+                regressions.append({"taille": int(taille), "mesure": nom, "avant_s": avant, "apres_s": apres,
+                                    "ratio": round(apres / avant, 2)})
+    return regressions
+
+
+def _port_libre():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _charge_api(url, args, ids):
+    """Envoie args.requests requêtes avec args.threads connexions simultanées."""
+    import asyncio
+    import aiohttp
+
+    rng = random.Random(0)
+    latences = {"lookup": [], "sortie": [], "lot": []}
+    statuts = Counter()
+    sorties = Counter()
+    technicien = storage.TECHNICIENS[0]
+    file_requetes = asyncio.Queue()
+    for _ in range(args.requests):
+        tirage = rng.random()
+        if tirage < 0.70:
+            file_requetes.put_nowait(("lookup", "GET", f"/api/pieces/{rng.choice(ids)}", None))
+        elif tirage < 0.95:
+            file_requetes.put_nowait(("sortie", "POST", "/api/sorties",
+                                      {"id_qr": rng.choice(ids), "quantite": 1, "technicien": technicien}))
+        else:
+            items = [{"id_qr": rng.choice(ids), "quantite": 1} for _ in range(3)]
+            file_requetes.put_nowait(("lot", "POST", "/api/sorties/lot", {"technicien": technicien, "items": items}))
+
+    async def client(session):
+        while not file_requetes.empty():
+            kind, method, chemin, body = file_requetes.get_nowait()
+            t0 = time.perf_counter()
+            async with session.request(method, url + chemin, json=body) as resp:
+                data = await resp.json()
+            latences[kind].append(time.perf_counter() - t0)
+            statuts[f"{kind}_{resp.status}"] += 1
+            if resp.status == 200 and kind == "sortie":
+                sorties[data["id_qr"]] += 1
+            elif resp.status == 200 and kind == "lot":
+                for ligne in data["sorties"]:
+                    sorties[ligne["id_qr"]] += ligne["quantite"]
+
+    headers = {"Authorization": f"Bearer {os.environ['GMAO_API_TOKEN']}"} if os.environ.get("GMAO_API_TOKEN") else {}
+    connector = aiohttp.TCPConnector(limit=args.threads)
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(args.threads)))
+        elapsed = time.perf_counter() - t0
+    return elapsed, latences, statuts, sorties
+
+
+def bench_api(args):
+    """Charge sur l'API de scan : débit, latences, et stock cohérent après coup."""
+    import asyncio
+    import urllib.request
+
+    process = None
+    url = args.url
+    if not url:
+        if args.backend != "sqlite":
+            raise SystemExit("api : l'API de scan ne démarre qu'avec le backend SQLite.")
+        make_workbook(storage.EXCEL_PATH, args.parts, quantite=args.quantite)
+        port = _port_libre()
+        url = f"http://127.0.0.1:{port}"
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan_api.py")
+        process = subprocess.Popen([sys.executable, script, "--host", "127.0.0.1", "--port", str(port)],
+                                   env=dict(os.environ, GMAO_STORAGE=args.backend),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(url + "/api/sante", timeout=1)
+                break
+            except OSError:
+                time.sleep(0.1)
+        ids = [f"P-{i:06d}" for i in range(args.parts)]
+    else:
+        ids = [p["id_qr"] for p in json.load(urllib.request.urlopen(url + f"/api/stock?taille={args.parts}"))["pieces"]]
+
+    try:
+        elapsed, latences, statuts, sorties = asyncio.run(_charge_api(url, args, ids))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {"scenario": "api", "url": url, "connexions": args.threads, "requetes": args.requests,
+              "seconds": round(elapsed, 3), "requetes_per_s": round(args.requests / elapsed, 1),
+              "statuts": dict(statuts)}
+    for kind, samples in latences.items():
+        if samples:
+            arr = np.array(samples) * 1000
+            report[kind] = {**_latency_stats(samples), "p99_ms": round(float(np.percentile(arr, 99)), 1)}
+    if process is not None:
+        # L'instance locale partait d'un stock connu : vérifier qu'aucune sortie n'est perdue
+        storage.STORAGE_BACKEND = args.backend
+        if not storage.use_sqlite():
+            storage.compact_journal()
+        # Relu dans le fichier : l'arrêt du service a dû tout écrire
+        persisted = storage.load_stock_from_db() if storage.use_sqlite() else storage.load_stock_from_excel()
+        persisted = dict(zip(persisted["ID_QR"], persisted["Quantite"]))
+        report["persisted_ok"] = all(persisted[i] == args.quantite - sorties[i] for i in ids)
+        report["jamais_negatif"] = min(persisted.values()) >= 0
+    return report
+
+
+def _stock_frame(n_parts, seed=0, libelles=None):
+    """Stock au format de storage.load_stock (sans passer par un classeur).
+
+    libelles=None : désignations toutes différentes ; sinon tirées parmi
+    ce nombre de libellés (références de catalogue répétées).
+    """
+    rng = np.random.default_rng(seed)
+    familles = np.array(FAMILLES, dtype=object)[rng.integers(0, len(FAMILLES), n_parts)]
+    numeros = np.arange(n_parts) if libelles is None else rng.integers(0, libelles, n_parts)
+    return pd.DataFrame({
+        "ID_QR": [f"P-{i:06d}" for i in range(n_parts)],
+        "Designation": [f"{f} {k}" for f, k in zip(familles, numeros)],
+        "Quantite": rng.integers(0, 500, n_parts),
+        "Prix_Unitaire_DH": rng.uniform(5, 2000, n_parts).round(2),
+        "Seuil_Alerte": rng.integers(0, 10, n_parts),
+    })
+
+
+def _memoire_retenue(fabrique):
+    """Octets encore alloués une fois l'objet construit (temporaires libérés).
+
+    Tas Python et numpy (tracemalloc) + tampons Arrow des colonnes de texte.
+    """
+    import pyarrow
+    arrow_avant = pyarrow.total_allocated_bytes()
+    tracemalloc.start()
+    objet = fabrique()
+    taille = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objet, taille + pyarrow.total_allocated_bytes() - arrow_avant
+
+
+def bench_table(args):
+    """Stock en DataFrame (ancienne représentation) contre StockTable."""
+    n = args.parts
+    rng = random.Random(0)
+    resultats = {}
+    for nom, libelles in (("memoire_mo", None), ("memoire_mo_libelles_repetes", 2000)):
+        _, avant = _memoire_retenue(lambda: _stock_frame(n, libelles=libelles))
+        table, apres = _memoire_retenue(lambda: StockTable.from_frame(_stock_frame(n, libelles=libelles)))
+        # La vue d'affichage n'ajoute que la colonne Designation (libellés par ligne)
+        _, vue = _memoire_retenue(table.frame)
+        resultats[nom] = {"dataframe": round(avant / 1024 ** 2, 3), "table": round(apres / 1024 ** 2, 3),
+                          "gain": round(avant / apres, 2), "vue_table": round(vue / 1024 ** 2, 3)}
+
+    df = _stock_frame(n)
+    table = StockTable.from_frame(df)
+    positions = [rng.randrange(n) for _ in range(10000)]
+    ajouts = iter(range(10 ** 9))
+
+    def sorties_df():
+        for p in positions:
+            df.at[p, "Quantite"] = df.at[p, "Quantite"] - 1
+
+    def sorties_table():
+        for p in positions:
+            table.modifier(p, "Quantite", table.valeur(p, "Quantite") - 1)
+
+    def ajout_df():
+        # Ancien ajout de pièce : pd.concat d'une ligne
+        return pd.concat([df, pd.DataFrame([{"ID_QR": "N", "Designation": "Nouvelle", "Quantite": 1,
+                                             "Prix_Unitaire_DH": 1.0, "Seuil_Alerte": 0}], index=[n])])
+
+    def ajout_table():
+        table.ajouter(f"N-{next(ajouts)}", "Nouvelle", 1, 1.0, 0)
+
+    def ajout_puis_vue():
+        ajout_table()
+        table.frame()
+
+    # Désignations renommées puis rétablies : les libellés connus gardent leur code
+    libelles = len(table._libelles)
+    for p in positions[:1000]:
+        ancienne = table.valeur(p, "Designation")
+        table.modifier(p, "Designation", "Renommée")
+        table.modifier(p, "Designation", ancienne)
+    resultats["libelles_reutilises"] = len(table._libelles) <= libelles + 1
+
+    # (ancienne représentation, table, opérations par mesure, unité)
+    mesures = {
+        "sortie_us": (sorties_df, sorties_table, len(positions), 1e6),
+        "ajout_us": (lambda: [ajout_df() for _ in range(20)], lambda: [ajout_table() for _ in range(20)], 20, 1e6),
+        "vue_affichage_us": (lambda: [df.copy() for _ in range(10)], lambda: [table.frame() for _ in range(10)],
+                             10, 1e6),
+        "vue_apres_ajout_ms": (lambda: ajout_df().copy(), ajout_puis_vue, 1, 1000),
+        "lecture_ligne_us": (lambda: [df.loc[p].copy() for p in positions[:1000]],
+                             lambda: [table.ligne(p) for p in positions[:1000]], 1000, 1e6),
+        # En dernier : la table perd des lignes à chaque mesure
+        "suppression_us": (lambda: [df.drop(index=rng.randrange(n)) for _ in range(100)],
+                           lambda: [table.supprimer(rng.randrange(len(table))) for _ in range(100)], 100, 1e6),
+    }
+    for nom, (fn_df, fn_table, n_ops, unite) in mesures.items():
+        avant = _timeit(fn_df, args.repeat)["median_s"] / n_ops * unite
+        apres = _timeit(fn_table, args.repeat)["median_s"] / n_ops * unite
+        resultats[nom] = {"dataframe": round(avant, 3), "table": round(apres, 3),
+                          "gain": round(avant / apres, 1) if apres > 0 else None}
+    return {"scenario": "table", "parts": n, "environnement": _environnement(), "resultats": resultats}
+
+
+def bench_grand_livre(args):
+    """Stock à date : relecture depuis le point le plus proche contre depuis le début."""
+    storage.STORAGE_BACKEND = args.backend
+    make_workbook(storage.EXCEL_PATH, args.parts, quantite=10 ** 6)
+    storage.init_storage()
+    store = StockStore()
+    ids = list(store.df["ID_QR"])
+    rng = random.Random(0)
+    # Mouvements datés d'une minute en une minute, après le point de départ
+    debut = datetime.now() + timedelta(seconds=1)
+    dates = [debut + timedelta(minutes=k) for k in range(args.mouvements)]
+    t0 = time.perf_counter()
+    for k in range(0, args.mouvements, 100):
+        for date in dates[k:k + 100]:
+            store.sortie(rng.choice(ids), rng.randint(1, 5), TECHNICIENS[0], date.strftime(storage.DATE_FORMAT))
+        # Les points sont calculés au fil de l'eau, comme le ferait le thread
+        if storage.principal._ledger_state["depuis_point"] >= storage.POINT_STOCK_MOUVEMENTS:
+            storage.creer_point_stock()
+    ecriture = time.perf_counter() - t0
+    storage.flush_pending()
+
+    def depuis_le_debut(instant):
+        limite = instant.strftime(storage.DATE_FORMAT)
+        premier = storage.principal._points()[0]
+        stock = {r[0]: r for r in storage.principal._lire_point(premier[0])}
+        for m, _ in storage.principal._mouvements_apres(premier):
+            if m["Date"] > limite:
+                break
+            storage.principal._rejouer(stock, m)
+        return stock
+
+    instants = [rng.choice(dates) for _ in range(args.repeat)]
+    ok = all(dict(zip(*storage.stock_a_date(t)[0][["ID_QR", "Quantite"]].T.to_numpy()))
+             == {i: r[2] for i, r in depuis_le_debut(t).items()} for t in instants[:3])
+    avec = _timeit(lambda: [storage.stock_a_date(t) for t in instants], 1)["median_s"] / len(instants)
+    sans = _timeit(lambda: [depuis_le_debut(t) for t in instants], 1)["median_s"] / len(instants)
+    return {"scenario": "grand_livre", "backend": args.backend, "parts": args.parts,
+            "mouvements": args.mouvements, "points": len(storage.principal._points()),
+            "environnement": _environnement(),
+            "sorties_par_s": round(args.mouvements / ecriture, 1),
+            "stock_a_date_ms": {"depuis_point": round(avec * 1000, 1), "depuis_debut": round(sans * 1000, 1),
+                                "gain": round(sans / avec, 1)},
+            "identiques": ok}
+
+
+def bench_recherche(args):
+    """Recherche de pièce : index de trigrammes contre filtre pandas sur tout le stock."""
+    df = _stock_frame(args.parts, libelles=2000)
+    t0 = time.perf_counter()
+    index = IndexRecherche(df["ID_QR"], df["Designation"])
+    construction = time.perf_counter() - t0
+    rng = random.Random(0)
+    saisies = ["roulement", "roulemnt 45", "contacteru", "P-0001", "FILTRE 12", "courroie 1"]
+    saisies += [rng.choice(df["Designation"].tolist()) for _ in range(14)]
+
+    def filtre_pandas():
+        # Ancien chemin : sous-chaîne exacte, insensible à la casse
+        for s in saisies:
+            masque = (df["ID_QR"].str.contains(s, case=False, regex=False)
+                      | df["Designation"].str.contains(s, case=False, regex=False))
+            df[masque].head(TOP_K)
+
+    def mises_a_jour():
+        for k in range(1000):
+            index.ajouter(f"N-{k}", f"Pompe doseuse {k}")
+
+    avant = _timeit(filtre_pandas, args.repeat)["median_s"] / len(saisies)
+    apres = _timeit(lambda: [index.rechercher(s) for s in saisies], args.repeat)["median_s"] / len(saisies)
+    return {"scenario": "recherche", "parts": args.parts, "environnement": _environnement(),
+            "construction_s": round(construction, 3),
+            "requete_ms": {"pandas": round(avant * 1000, 2), "index": round(apres * 1000, 2),
+                           "gain": round(avant / apres, 1)},
+            "mise_a_jour_ms": round(_timeit(mises_a_jour, 1)["median_s"], 3),
+            "exemple": {s: index.rechercher(s, 3) for s in saisies[:3]}}
+
+
+def bench_magasins(args):
+    """Plusieurs magasins : chargement séquentiel contre parallèle, transferts, vue consolidée."""
+    storage.STORAGE_BACKEND = args.backend
+    dossiers = [os.path.join(magasins.MAGASINS_DIR, f"Magasin {k}") for k in range(1, args.magasins + 1)]
+    make_workbook(storage.EXCEL_PATH, args.parts)
+    for k, dossier in enumerate(dossiers, start=1):
+        os.makedirs(dossier)
+        make_workbook(os.path.join(dossier, os.path.basename(storage.EXCEL_PATH)), args.parts, seed=k)
+
+    def charger_tout(workers):
+        # Stockages neufs à chaque essai : rien n'est déjà en mémoire
+        def un(stock):
+            stock.init_storage()
+            return len(StockStore(stock).df)
+        stockages = [storage.Stockage(d) for d in dossiers]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(pool.map(un, stockages))
+
+    charger_tout(1)      # SQLite : migration initiale des classeurs, hors mesure
+    workers = args.workers or len(dossiers)
+    sequentiel = _timeit(lambda: charger_tout(1), args.repeat)["median_s"]
+    parallele = _timeit(lambda: charger_tout(workers), args.repeat)["median_s"]
+
+    magasins.charger()
+    noms = magasins.noms()
+    ids = list(magasins.store(noms[1]).df["ID_QR"][:200])
+    t0 = time.perf_counter()
+    for k, id_qr in enumerate(ids):
+        magasins.transferer(id_qr, 1, noms[1 + k % 2], noms[2 - k % 2], "benchmark")
+    transferts = time.perf_counter() - t0
+    magasins.flush_pending()
+    consolidee = _timeit(lambda: magasins.stock_consolide(magasins.vue_consolidee()), args.repeat)
+    return {"scenario": "magasins", "backend": args.backend, "magasins": len(dossiers), "parts": args.parts,
+            "environnement": _environnement(),
+            "chargement_s": {"sequentiel": round(sequentiel, 3), "parallele": round(parallele, 3),
+                             "workers": workers, "gain": round(sequentiel / parallele, 2)},
+            "transferts_par_s": round(len(ids) / transferts, 1),
+            "stock_consolide_ms": round(consolidee["median_s"] * 1000, 1),
+            "synthese": magasins.synthese().to_dict("records")}
+
+
+def bench_exports(args):
+    """Exports : classeur en mémoire (pandas / openpyxl) contre écriture en flux, CSV, Parquet, cache."""
+    df_stock = _stock_frame(args.parts)
+    rng = random.Random(0)
+    debut = datetime.now() - timedelta(days=365)
+    df_hist = pd.DataFrame({
+        "Date": [(debut + timedelta(minutes=k)).strftime(storage.DATE_FORMAT) for k in range(args.historique)],
+        "ID_QR": [f"P-{rng.randrange(args.parts):06d}" for _ in range(args.historique)],
+        "Designation": "Pièce",
+        "Quantite_Sortie": [rng.randint(1, 5) for _ in range(args.historique)],
+        "Technicien": [rng.choice(TECHNICIENS) for _ in range(args.historique)],
+    })[storage.HISTORIQUE_COLUMNS]
+
+    def pandas_xlsx(df):
+        # Ancien chemin des rapports
+        output = io.BytesIO()
+        with pd.ExcelWriter(output, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False, sheet_name="Historique")
+        return output.getvalue()
+
+    def classeur_complet():
+        # Ancien chemin du classeur : toutes les cellules stylées en mémoire avant l'écriture
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Stock"
+        storage._write_header(ws, storage.STOCK_COLUMNS[:4] + ["Valeur_Totale_DH", "Seuil_Alerte"],
+                              [12, 35, 12, 18, 18, 14])
+        storage._write_stock_rows(ws, df_stock)
+        ws2 = wb.create_sheet("Historique_Sorties")
+        storage._write_header(ws2, storage.HISTORIQUE_COLUMNS, [22, 12, 35, 18, 25])
+        for r_idx, row in enumerate(df_hist.itertuples(index=False), start=2):
+            storage._write_sortie_row(ws2, r_idx, list(row))
+        output = io.BytesIO()
+        wb.save(output)
+        return output.getvalue()
+
+    def mesurer(fn):
+        # Durée (médiane) et pic de mémoire Python d'une génération
+        duree = _timeit(fn, args.repeat)["median_s"]
+        tracemalloc.start()
+        taille = len(fn())
+        pic = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {"s": round(duree, 3), "pic_mo": round(pic / 1e6, 1), "mo": round(taille / 1e6, 2)}
+
+    res = {
+        "rapport_xlsx": {"pandas": mesurer(lambda: pandas_xlsx(df_hist)),
+                         "flux": mesurer(lambda: exports.en_xlsx(df_hist, "Historique"))},
+        "classeur_xlsx": {"en_memoire": mesurer(classeur_complet),
+                          "flux": mesurer(lambda: storage.build_workbook_bytes(df_stock, df_hist))},
+        "rapport_csv": mesurer(lambda: exports.en_csv(df_hist)),
+        "rapport_parquet": mesurer(lambda: exports.en_parquet(df_hist)),
+    }
+    exports.vider_cache()
+    exports.exporter("rapport", 1, lambda: df_hist)
+    res["retelechargement_ms"] = round(
+        _timeit(lambda: exports.exporter("rapport", 1, lambda: df_hist), args.repeat)["median_s"] * 1000, 3)
+    return {"scenario": "exports", "parts": args.parts, "historique": args.historique,
+            "environnement": _environnement(), **res}
+
+
+def bench_alertes(args):
+    """Alertes de stock bas : vérification des seules pièces touchées contre un parcours complet."""
+    storage.STORAGE_BACKEND = args.backend
+    make_workbook(storage.EXCEL_PATH, args.parts, quantite=args.quantite)
+    magasins.charger()
+    store = magasins.store()
+    ids = list(store.df["ID_QR"])
+    rng = random.Random(0)
+    tirage = [rng.choice(ids) for _ in range(args.sorties)]
+
+    def sorties():
+        for id_qr in tirage:
+            store.sortie(id_qr, 0, TECHNICIENS[0])
+
+    sans = _timeit(sorties, 1)["median_s"]
+    alerts.set_file(alerts.FileNotifications(alerts.CanalFichier("notifications.jsonl"), debounce_s=0))
+    surveillance = alerts.surveillance()
+    surveillance.verifier()
+    avec = _timeit(sorties, 1)["median_s"]
+
+    def incremental():
+        for id_qr in tirage:
+            store.sortie(id_qr, 1, TECHNICIENS[0])
+            surveillance.verifier()
+
+    def parcours_complet():
+        # Ancien équivalent : toute la vue recalculée et comparée après chaque sortie
+        for id_qr in tirage:
+            store.sortie(id_qr, 1, TECHNICIENS[0])
+            surveillance._noter(store, None, "rechargement")
+            surveillance.verifier()
+
+    inc = _timeit(incremental, 1)["median_s"] - avec
+    complet = _timeit(parcours_complet, 1)["median_s"] - avec
+    alerts.traiter(forcer=True)
+    magasins.flush_pending()
+    vue = store.vue()
+    attendues = set(vue.loc[vue["Alerte"], "ID_QR"])
+    return {"scenario": "alertes", "backend": args.backend, "parts": args.parts, "sorties": args.sorties,
+            "environnement": _environnement(),
+            "sortie_ms": {"sans_surveillance": round(sans / len(tirage) * 1000, 3),
+                          "avec_surveillance": round(avec / len(tirage) * 1000, 3)},
+            "verification_ms": {"pieces_touchees": round(inc / len(tirage) * 1000, 3),
+                                "parcours_complet": round(complet / len(tirage) * 1000, 3),
+                                "gain": round(complet / inc, 1) if inc > 0 else None},
+            "alertes_ouvertes": len(surveillance), "table_ok": set(surveillance.ouvertes()["ID_QR"]) == attendues,
+            "notifications": alerts.get_file().envoyes}
+
+
+def bench_archives(args):
+    """Classeur vivant : écritures Excel avant / après la rotation de deux ans d'historique."""
+    storage.STORAGE_BACKEND = "excel"
+    storage.ARCHIVAGE = False
+    path = storage.EXCEL_PATH
+    make_workbook(path, args.parts, historique=args.historique, jours=730)
+    storage.init_storage()
+    df = storage.load_stock_from_excel(path)
+    cible = df["ID_QR"].iloc[0]
+    now = datetime.now().strftime(storage.DATE_FORMAT)
+    fin = datetime.now() + timedelta(days=1)
+
+    def ecritures():
+        return {"mo": round(os.path.getsize(path) / 1e6, 2),
+                "save_stock_to_excel_delta_s": _timeit(
+                    lambda: storage.save_stock_to_excel(df, path, changed={cible}), args.repeat)["median_s"],
+                "append_sortie_to_excel_s": _timeit(
+                    lambda: storage.append_sortie_to_excel(now, cible, "Pièce", 1, TECHNICIENS[0], path),
+                    args.repeat)["median_s"],
+                "requete_semaine_s": _timeit(
+                    lambda: storage.query_historique(fin - timedelta(days=8), fin), args.repeat)["median_s"]}
+
+    avant = ecritures()
+    total = len(storage.query_historique())
+    t0 = time.perf_counter()
+    archivees = storage.archiver_historique()
+    rotation = time.perf_counter() - t0
+    apres = ecritures()
+    catalogue = storage.catalogue_archives()["archives"]
+    ancien = pd.Timestamp(catalogue[0]["debut"]).to_period("M")
+
+    def mois_archive():
+        return storage.query_historique(ancien.start_time, ancien.end_time)
+
+    storage.principal._archives_cache.clear()
+    t0 = time.perf_counter()
+    n_mois = len(mois_archive())
+    premiere = time.perf_counter() - t0
+
+    # Import d'un classeur de stock : l'historique vivant et la coupure restent en place
+    vivant = len(storage.load_historique().dropna(how="all"))
+    coupure = storage._coupure_classeur(path)
+    make_workbook("depot.xlsx", args.parts, historique=100)
+    t0 = time.perf_counter()
+    storage.import_uploaded_workbook("depot.xlsx")
+    import_s = time.perf_counter() - t0
+    import_ok = (len(storage.load_historique().dropna(how="all")) == vivant
+                 and storage._coupure_classeur(path) == coupure
+                 and len(storage.load_stock_from_excel(path)) == args.parts)
+    return {"scenario": "archives", "parts": args.parts, "historique": args.historique,
+            "environnement": _environnement(),
+            "classeur_avant": avant, "classeur_apres": apres,
+            "rotation_s": round(rotation, 3), "lignes_archivees": archivees,
+            "archives": {"fichiers": len(catalogue),
+                         "mo": round(sum(os.path.getsize(os.path.join(storage.ARCHIVES_DIR, a["fichier"]))
+                                         for a in catalogue) / 1e6, 2)},
+            "requete_ms": {"mois_archive_premiere_lecture": round(premiere * 1000, 1),
+                           "mois_archive_en_cache": round(_timeit(mois_archive, args.repeat)["median_s"] * 1000, 1)},
+            "lignes_mois_archive": n_mois,
+            "import_classeur": {"s": round(import_s, 3), "historique_conserve": import_ok},
+            # + les sorties ajoutées par les mesures d'écriture
+            "historique_complet": len(storage.query_historique()) == total + args.repeat}
+
+
+SCENARIOS = {
+    "api": bench_api,
+    "stress": bench_stress,
+    "qr": bench_qr,
+    "pdf": bench_pdf,
+    "suite": bench_suite,
+    "table": bench_table,
+    "grand_livre": bench_grand_livre,
+    "recherche": bench_recherche,
+    "magasins": bench_magasins,
+    "exports": bench_exports,
+    "alertes": bench_alertes,
+    "archives": bench_archives,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--backend", choices=["sqlite", "excel"], default="sqlite")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--sorties", type=int, default=50, help="sorties par thread")
+    parser.add_argument("--parts", type=int, default=20)
+    parser.add_argument("--quantite", type=int, default=100)
+    parser.add_argument("--images", type=int, default=40, help="taille du corpus QR synthétique")
+    parser.add_argument("--corpus", help="dossier de photos nommées <ID>__*.jpg")
+    parser.add_argument("--workers", type=int, default=None, help="processus pour les lots PDF (défaut : tous les cœurs)")
+    parser.add_argument("--requests", type=int, default=2000, help="requêtes envoyées à l'API")
+    parser.add_argument("--mouvements", type=int, default=20000, help="mouvements du grand livre")
+    parser.add_argument("--magasins", type=int, default=4, help="magasins en plus du principal")
+    parser.add_argument("--url", help="API déjà lancée (sinon instance locale temporaire)")
+    parser.add_argument("--sizes", default="1000,10000", help="nombres de pièces, séparés par des virgules")
+    parser.add_argument("--historique", type=int, default=50000, help="lignes d'historique par classeur")
+    parser.add_argument("--repeat", type=int, default=3, help="répétitions par mesure (médiane)")
+    parser.add_argument("--output", help="écrit aussi le rapport JSON dans ce fichier")
+    parser.add_argument("--baseline", help="rapport précédent à comparer (suite)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="écart toléré avant de signaler une régression")
+    args = parser.parse_args(argv)
+    for attr in ("corpus", "output", "baseline"):
+        if getattr(args, attr):
+            setattr(args, attr, os.path.abspath(getattr(args, attr)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            report = SCENARIOS[args.scenario](args)
+        finally:
+            os.chdir(cwd)
+    report["echecs"] = verifications_echouees(report)
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+if __name__ == "__main__":
+    # Code de sortie non nul si un contrôle échoue (sortie perdue, historique
+    # incomplet...) ou si la comparaison avec --baseline trouve des régressions
+    rapport = main()
+    sys.exit(1 if rapport["echecs"] or rapport.get("regressions") else 0)
@@ -0,0 +1,208 @@
+import io
+import threading
+from collections import OrderedDict
+from copy import copy
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
+
+from metrics import enregistrer, timed, taille_resultat
+
+# ─────────────────────────────────────────────
+# EXPORTS (XLSX, CSV, PARQUET)
+# ─────────────────────────────────────────────
+# Les classeurs sont écrits en flux (openpyxl write_only) : chaque ligne
+# part dans le fichier dès qu'elle est produite, sans garder une cellule
+# en mémoire par valeur. CSV au format d'Excel en français (";", virgule
+# décimale, BOM UTF-8) et Parquet (pyarrow, installé avec Streamlit) pour
+# les outils d'analyse.
+#
+# Un export n'est produit que lorsqu'il est demandé (clic sur le bouton de
+# téléchargement), puis gardé sous la clé (rapport, format, version des
+# données) : retélécharger des données inchangées ne coûte rien. Une
+# nouvelle version remplace l'ancienne ; au-delà de EXPORT_CACHE_OCTETS,
+# les exports les moins récemment servis sont oubliés.
+
+EXPORT_CACHE_OCTETS = 64 * 1024 * 1024
+CSV_SEPARATEUR = ";"
+CSV_DECIMALE = ","
+LARGEUR_MIN, LARGEUR_MAX = 12, 40
+FORMATS = {
+    # format -> (libellé, extension, type MIME)
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "csv", "text/csv"),
+    "parquet": ("Parquet", "parquet", "application/vnd.apache.parquet"),
+}
+
+_FIN = Side(style="thin")
+BORDURE = Border(left=_FIN, right=_FIN, top=_FIN, bottom=_FIN)
+ENTETE_FONT = Font(bold=True, color="FFFFFF", name="Arial", size=11)
+ENTETE_FILL = PatternFill("solid", start_color="2E4057")
+TEXTE_FONT = Font(name="Arial", size=10)
+ALTERNE_FILL = PatternFill("solid", start_color="EAF0FB")
+CENTRE = Alignment(horizontal="center")
+GAUCHE = Alignment(horizontal="left")
+
+
+# ─────────────────────────────────────────────
+# XLSX EN FLUX
+# ─────────────────────────────────────────────
+
+def style(ws, font=None, fill=None, alignment=None, border=None):
+    """Combinaison de styles enregistrée une fois dans le classeur, pour cellule(..., style=)."""
+    return cellule(ws, None, font, fill, alignment, border)._style
+
+
+def cellule(ws, valeur, font=None, fill=None, alignment=None, border=None, style=None):
+    """Cellule stylée d'une feuille write_only.
+
+    Chaque attribut de style est recherché dans les tables du classeur
+    (hachage des objets openpyxl) : pour les lignes de données, passer un
+    style préparé par style() une fois pour toute la feuille.
+    """
+    if style is not None:
+        return Cell(ws, row=1, column=1, value=valeur, style_array=copy(style))
+    cell = WriteOnlyCell(ws, valeur)
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if alignment is not None:
+        cell.alignment = alignment
+    if border is not None:
+        cell.border = border
+    return cell
+
+
+def ecrire_feuille(wb, titre, colonnes, largeurs, lignes):
+    """Ajoute une feuille : en-tête stylé, puis les lignes de lignes(ws) une à une."""
+    ws = wb.create_sheet(titre)
+    # Les largeurs doivent précéder la première ligne en mode write_only
+    for col, largeur in enumerate(largeurs, 1):
+        ws.column_dimensions[get_column_letter(col)].width = largeur
+    entete = style(ws, ENTETE_FONT, ENTETE_FILL, CENTRE, BORDURE)
+    ws.append([cellule(ws, h, style=entete) for h in colonnes])
+    for ligne in lignes(ws):
+        ws.append(ligne)
+    return ws
+
+
+def classeur(feuilles) -> bytes:
+    """Classeur write_only : feuilles = [(titre, colonnes, largeurs, lignes), ...]."""
+    wb = Workbook(write_only=True)
+    for titre, colonnes, largeurs, lignes in feuilles:
+        ecrire_feuille(wb, titre, colonnes, largeurs, lignes)
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def _largeurs(df: pd.DataFrame):
+    """Largeur de colonne d'après l'en-tête et les premières valeurs."""
+    debut = df.head(200).astype(str)
+    return [min(max(LARGEUR_MIN, len(str(c)) + 2, int(debut[c].str.len().max() or 0) + 2), LARGEUR_MAX)
+            if len(debut) else max(LARGEUR_MIN, len(str(c)) + 2)
+            for c in debut.columns]
+
+
+def _valeurs(df: pd.DataFrame):
+    """Lignes de df en valeurs Python (NaN / NA / NaT -> cellule vide)."""
+    objets = df.astype(object)
+    objets = objets.where(df.notna(), None)
+    for ligne in objets.itertuples(index=False, name=None):
+        yield list(ligne)
+
+
+@timed("export.xlsx", octets=taille_resultat)
+def en_xlsx(df: pd.DataFrame, feuille="Export") -> bytes:
+    """Un DataFrame en classeur .xlsx, écrit en flux."""
+    df = df.reset_index(drop=True)
+    return classeur([(feuille[:31], [str(c) for c in df.columns], _largeurs(df), lambda ws: _valeurs(df))])
+
+
+@timed("export.csv", octets=taille_resultat)
+def en_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False, sep=CSV_SEPARATEUR, decimal=CSV_DECIMALE).encode("utf-8-sig")
+
+
+@timed("export.parquet", octets=taille_resultat)
+def en_parquet(df: pd.DataFrame) -> bytes:
+    output = io.BytesIO()
+    # Colonnes mixtes (texte et nombres) : écrites en texte
+    mixtes = [c for c in df.columns if df[c].dtype == object
+              and df[c].dropna().map(type).nunique() > 1]
+    df.astype({c: "string" for c in mixtes}).to_parquet(output, index=False, engine="pyarrow")
+    return output.getvalue()
+
+
+def convertir(df: pd.DataFrame, fmt="xlsx", feuille="Export") -> bytes:
+    if fmt == "xlsx":
+        return en_xlsx(df, feuille)
+    if fmt == "csv":
+        return en_csv(df)
+    if fmt == "parquet":
+        return en_parquet(df)
+    raise ValueError(f"Format d'export inconnu : {fmt}")
+
+
+def nom_fichier(base, fmt):
+    return f"{base}.{FORMATS[fmt][1]}"
+
+
+def type_mime(fmt):
+    return FORMATS[fmt][2]
+
+
+# ─────────────────────────────────────────────
+# CACHE PAR VERSION DES DONNÉES
+# ─────────────────────────────────────────────
+
+_cache_lock = threading.Lock()
+_cache = OrderedDict()         # (rapport, format, version) -> octets, du moins au plus récent
+_cache_octets = 0
+
+
+def _oublier(cle):
+    global _cache_octets
+    _cache_octets -= len(_cache.pop(cle))
+
+
+def exporter(rapport, version, fabrique, fmt="xlsx", feuille="Export") -> bytes:
+    """Octets de l'export, produits au plus une fois par version des données.
+
+    fabrique() renvoie le DataFrame à exporter (ou directement des octets,
+    ex. classeur complet) ; elle n'est appelée que si l'export n'est pas
+    déjà en cache. version : tout objet comparable qui change avec les
+    données (version du store, filtres, curseur de l'historique...).
+    """
+    global _cache_octets
+    cle = (rapport, fmt, version)
+    with _cache_lock:
+        data = _cache.get(cle)
+        if data is not None:
+            _cache.move_to_end(cle)
+    if data is not None:
+        enregistrer("export.cache", 0.0, len(data))
+        return data
+    data = fabrique()
+    if not isinstance(data, bytes):
+        data = convertir(data, fmt, feuille)
+    with _cache_lock:
+        # Les versions précédentes du même rapport ne resserviront pas
+        for ancienne in [k for k in _cache if k[:2] == cle[:2]]:
+            _oublier(ancienne)
+        _cache[cle] = data
+        _cache_octets += len(data)
+        while _cache_octets > EXPORT_CACHE_OCTETS and len(_cache) > 1:
+            _oublier(next(iter(_cache)))
+    return data
+
+
+def vider_cache():
+    global _cache_octets
+    with _cache_lock:
+        _cache.clear()
+        _cache_octets = 0
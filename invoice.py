@@ -0,0 +1,220 @@
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from fpdf import FPDF
+
+from metrics import timed, taille_resultat
+
+# ─────────────────────────────────────────────
+# BONS DE RÉCEPTION / FACTURATION (PDF)
+# ─────────────────────────────────────────────
+# La mise en page (colonnes, libellés, largeurs de caractères) est calculée
+# une fois par processus. Les tableaux longs sont paginés : l'en-tête des
+# colonnes est répété sur chaque page, chaque page porte son sous-total et
+# le report des pages précédentes.
+
+ORGANISME = "Campus Universitaire / UIR"
+FONT = "Arial"
+MARGE = 10
+LIGNE_H = 6          # hauteur d'une ligne de texte dans le tableau (mm)
+PIED_H = 16          # réservé en bas de page pour le sous-total et le numéro
+TOTAL_H = 14         # place nécessaire au TOTAL GÉNÉRAL après la dernière ligne
+COLONNES = (("Désignation", 90, "L"), ("Qté", 20, "R"), ("Prix Unitaire", 40, "R"), ("Total (DH)", 40, "R"))
+
+# En dessous de ce nombre de documents, le pool de processus coûte plus
+# qu'il ne rapporte
+BATCH_MIN_POOL = 16
+
+
+@lru_cache(maxsize=None)
+def _char_widths(style):
+    """Largeurs des caractères de la police standard (chargées une fois)."""
+    pdf = FPDF()
+    pdf.set_font(FONT, style, 10)
+    return pdf.current_font["cw"]
+
+
+def _text_width(text, size, style=""):
+    cw = _char_widths(style)
+    return sum(cw.get(c, 600) for c in text) * size / 1000 * 25.4 / 72
+
+
+@lru_cache(maxsize=4096)
+def _latin1(text):
+    # Les polices standard du PDF ne couvrent que le latin-1
+    return str(text).encode("latin-1", "replace").decode("latin-1")
+
+
+@lru_cache(maxsize=8192)
+def _wrap(text, width, size=10):
+    """Découpe une désignation en lignes tenant dans la largeur de la colonne."""
+    lignes, courante = [], ""
+    for mot in _latin1(text).split():
+        essai = f"{courante} {mot}" if courante else mot
+        if _text_width(essai, size) <= width:
+            courante = essai
+            continue
+        if courante:
+            lignes.append(courante)
+        # Mot plus long que la colonne : on le coupe
+        while _text_width(mot, size) > width:
+            n = len(mot)
+            while n > 1 and _text_width(mot[:n], size) > width:
+                n -= 1
+            lignes.append(mot[:n])
+            mot = mot[n:]
+        courante = mot
+    lignes.append(courante)
+    return tuple(lignes)
+
+
+def _montant(valeur):
+    return f"{float(valeur):,.2f}".replace(",", " ")
+
+
+class _BonPDF(FPDF):
+    def __init__(self, id_trans, tiers_label, tiers, titre, date_str):
+        super().__init__()
+        self.set_auto_page_break(False)
+        self.set_margins(MARGE, MARGE)
+        self.alias_nb_pages()
+        self.id_trans = id_trans
+        self.tiers_label = tiers_label
+        self.tiers = _latin1(tiers or "")
+        self.titre = titre
+        self.date_str = date_str
+        self.cumul = 0.0          # total des pages précédentes
+        self.sous_total = 0.0     # total de la page courante
+
+    def header(self):
+        if self.page_no() == 1:
+            self.set_font(FONT, "B", 16)
+            self.cell(0, 10, self.titre, ln=True, align="C")
+            self.set_font(FONT, size=12)
+            self.cell(0, 8, f"Référence : {self.id_trans} | Date : {self.date_str}", ln=True, align="C")
+            self.ln(4)
+            self.cell(0, 7, f"Organisme : {ORGANISME}", ln=True)
+            self.cell(0, 7, f"{self.tiers_label} : {self.tiers}", ln=True)
+            self.ln(4)
+        else:
+            self.cumul += self.sous_total
+            self.sous_total = 0.0
+            self.set_font(FONT, "B", 10)
+            self.cell(95, 7, f"{self.titre} - {self.id_trans}")
+            self.set_font(FONT, size=10)
+            self.cell(0, 7, f"Report : {_montant(self.cumul)} DH", ln=True, align="R")
+            self.ln(2)
+        self.set_fill_color(200, 220, 255)
+        self.set_font(FONT, "B", 10)
+        for nom, w, align in COLONNES:
+            self.cell(w, 8, nom, border=1, fill=True, align="C")
+        self.ln()
+        self.set_font(FONT, size=10)
+
+    def footer(self):
+        self.set_y(-PIED_H + 2)
+        self.set_font(FONT, "I", 9)
+        self.cell(95, 6, f"Sous-total page : {_montant(self.sous_total)} DH")
+        self.cell(0, 6, f"Page {self.page_no()}/{{nb}}", align="R")
+
+    def ligne(self, item):
+        lignes = _wrap(item["nom"], COLONNES[0][1] - 2)
+        h = len(lignes) * LIGNE_H
+        if self.get_y() + h > self.h - PIED_H:
+            self.add_page()
+        x, y = self.get_x(), self.get_y()
+        for i, texte in enumerate(lignes):
+            self.set_xy(x, y + i * LIGNE_H)
+            self.cell(COLONNES[0][1], LIGNE_H, texte)
+        self.rect(x, y, COLONNES[0][1], h)
+        self.set_xy(x + COLONNES[0][1], y)
+        valeurs = (str(item["qte"]), _montant(item["prix"]), _montant(item["total"]))
+        for (_, w, align), texte in zip(COLONNES[1:], valeurs):
+            self.cell(w, h, texte, border=1, align=align)
+        self.set_xy(x, y + h)
+        self.sous_total += float(item["total"])
+
+
+@timed("pdf.bon", octets=taille_resultat)
+def render_bon(id_trans, tiers, items_list, total_general, titre="BON DE RÉCEPTION / FACTURATION STOCK",
+               tiers_label="Fournisseur", date=None) -> bytes:
+    """PDF d'un bon : items_list = [{"nom", "qte", "prix", "total"}, ...]."""
+    date_str = (date or datetime.now()).strftime("%d/%m/%Y")
+    pdf = _BonPDF(id_trans, tiers_label, tiers, titre, date_str)
+    pdf.add_page()
+    for item in items_list:
+        pdf.ligne(item)
+    if pdf.get_y() + TOTAL_H > pdf.h - PIED_H:
+        pdf.add_page()
+    pdf.ln(4)
+    pdf.set_font(FONT, "B", 12)
+    pdf.cell(130, 10, "TOTAL GÉNÉRAL : ", align="R")
+    pdf.cell(60, 10, f"{_montant(total_general)} DH", border=1, align="C")
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def generate_pdf(id_trans, fournisseur, items_list, total_general) -> bytes:
+    return render_bon(id_trans, fournisseur, items_list, total_general)
+
+
+# ─────────────────────────────────────────────
+# GÉNÉRATION PAR LOTS
+# ─────────────────────────────────────────────
+# Un document = dict avec les arguments de render_bon et "fichier" (nom du
+# PDF dans l'archive).
+
+def _render_doc(doc):
+    args = {k: v for k, v in doc.items() if k != "fichier"}
+    return doc["fichier"], render_bon(**args)
+
+
+def render_batch(docs, workers=None):
+    """Rend tous les documents, dans un pool de processus si le lot est gros."""
+    docs = list(docs)
+    if workers == 1 or len(docs) < BATCH_MIN_POOL:
+        return [_render_doc(d) for d in docs]
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(docs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_doc, docs, chunksize=chunksize))
+
+
+@timed("pdf.lot_zip", octets=taille_resultat)
+def batch_zip(docs, workers=None) -> bytes:
+    """Archive ZIP de tous les bons du lot."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for fichier, data in render_batch(docs, workers):
+            zf.writestr(fichier, data)
+    return out.getvalue()
+
+
+def bons_sortie_par_technicien(df_hist, df_stock, debut, fin):
+    """Un bon de sortie par technicien sur la période (relevé mensuel, etc.)."""
+    if df_hist.empty:
+        return []
+    prix = df_stock.set_index("ID_QR")["Prix_Unitaire_DH"]
+    lignes = (df_hist.groupby(["Technicien", "ID_QR"], sort=True)
+              .agg(Designation=("Designation", "first"), Quantite=("Quantite_Sortie", "sum"))
+              .reset_index())
+    lignes["Prix"] = lignes["ID_QR"].map(prix).fillna(0.0)
+    lignes["Total"] = (lignes["Quantite"] * lignes["Prix"]).round(2)
+    periode = f"{debut:%Y%m%d}-{fin:%Y%m%d}"
+    docs = []
+    for technicien, groupe in lignes.groupby("Technicien", sort=True):
+        items = [{"nom": f"{r.ID_QR} - {r.Designation}", "qte": int(r.Quantite), "prix": r.Prix, "total": r.Total}
+                 for r in groupe.itertuples()]
+        docs.append({
+            "fichier": f"bon_sortie_{str(technicien).replace(' ', '_')}_{periode}.pdf",
+            "id_trans": f"BS-{periode}-{len(docs) + 1:03d}",
+            "tiers": technicien,
+            "items_list": items,
+            "total_general": round(float(groupe["Total"].sum()), 2),
+            "titre": "BON DE SORTIE DE STOCK",
+            "tiers_label": "Technicien",
+        })
+    return docs
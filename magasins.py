@@ -0,0 +1,242 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import storage
+from metrics import timed
+from stock_store import get_store, normalize_id, PieceExistante, PieceInconnue, StockError, StockStore
+
+# ─────────────────────────────────────────────
+# MAGASINS (bâtiments, réserves)
+# ─────────────────────────────────────────────
+# Le magasin principal garde les fichiers du dossier courant. Chaque autre
+# magasin est un sous-dossier de MAGASINS_DIR avec son propre classeur ou sa
+# propre base, et son storage.Stockage (verrous, écrivain, grand
+# livre) : l'activité d'un magasin n'attend jamais celle d'un autre.
+#
+# Au démarrage, les magasins sont préparés et chargés en parallèle dans un
+# pool de threads (lectures SQLite et fichiers, hors du GIL pour
+# l'essentiel). Un magasin illisible n'empêche pas de charger les autres.
+#
+# Les vues consolidées assemblent les vues d'inventaire déjà en mémoire ;
+# elles ne sont recalculées que si l'un des magasins a changé.
+#
+# Un transfert retire la quantité du magasin d'origine puis l'ajoute à la
+# destination (pièce créée à 0 si elle n'y existe pas encore) : un
+# mouvement "transfert" dans chaque grand livre, aucune ligne dans
+# l'historique des sorties. Si l'ajout échoue, la quantité est rendue au
+# magasin d'origine ; si ce retour échoue aussi, l'incident est journalisé
+# (logging) avec les deux erreurs et TransfertInterrompu donne la quantité
+# à corriger à la main (le mouvement de départ reste au grand livre).
+
+MAGASINS_DIR = "magasins"
+MAGASIN_PRINCIPAL = os.environ.get("GMAO_MAGASIN_PRINCIPAL", "Magasin central")
+CHARGEMENT_WORKERS = 8
+NOM_MAGASIN = re.compile(r"[\w][\w .'-]{0,59}")
+
+_log = logging.getLogger(__name__)
+
+
+class MagasinInconnu(StockError):
+    def __init__(self, nom):
+        super().__init__(f"Magasin '{nom}' inconnu.")
+        self.nom = nom
+
+
+class TransfertInterrompu(StockError):
+    def __init__(self, id_qr, qte, origine, destination):
+        super().__init__(f"Transfert de {qte} × '{id_qr}' interrompu : quantité retirée de {origine}, "
+                         f"ni reçue par {destination} ni rendue. À corriger à la main.")
+        self.id_qr = id_qr
+        self.qte = qte
+        self.origine = origine
+        self.destination = destination
+
+
+_lock = threading.Lock()
+_stockages = {}            # nom -> storage.Stockage (autres que le principal)
+_stores = {}
+_chargement_lock = threading.Lock()
+_chargement = None         # {nom: nb pièces ou exception}, une fois par processus
+_consolide = None          # (vues des magasins, vue consolidée)
+
+
+def noms():
+    """Magasin principal, puis les autres par ordre alphabétique."""
+    if not os.path.isdir(MAGASINS_DIR):
+        return [MAGASIN_PRINCIPAL]
+    autres = sorted(d for d in os.listdir(MAGASINS_DIR)
+                    if os.path.isdir(os.path.join(MAGASINS_DIR, d)) and d != MAGASIN_PRINCIPAL)
+    return [MAGASIN_PRINCIPAL] + autres
+
+
+def stockage(nom=None):
+    """Stockage du magasin (storage.principal pour le principal)."""
+    if nom is None or nom == MAGASIN_PRINCIPAL:
+        return storage.principal
+    with _lock:
+        stock = _stockages.get(nom)
+        if stock is None:
+            if not os.path.isdir(os.path.join(MAGASINS_DIR, nom)):
+                raise MagasinInconnu(nom)
+            stock = _stockages[nom] = storage.Stockage(os.path.join(MAGASINS_DIR, nom))
+        return stock
+
+
+def store(nom=None) -> StockStore:
+    """Stock partagé du magasin."""
+    if nom is None or nom == MAGASIN_PRINCIPAL:
+        return get_store()
+    stock = stockage(nom)
+    with _lock:
+        if nom not in _stores:
+            _stores[nom] = StockStore(stock)
+        return _stores[nom]
+
+
+def creer(nom):
+    """Nouveau magasin, vide : son stock arrive par import de classeur ou par transferts."""
+    nom = str(nom).strip()
+    if not NOM_MAGASIN.fullmatch(nom):
+        raise StockError("Nom de magasin invalide (lettres, chiffres, espaces, . ' - ; 60 caractères au plus).")
+    if nom in noms():
+        raise StockError(f"Le magasin '{nom}' existe déjà.")
+    os.makedirs(os.path.join(MAGASINS_DIR, nom))
+    stock = stockage(nom)
+    if not storage.use_sqlite():
+        # Classeur vide : le magasin peut recevoir des transferts avant tout import
+        vide = storage.build_workbook_bytes(pd.DataFrame(columns=storage.STOCK_COLUMNS),
+                                            pd.DataFrame(columns=storage.HISTORIQUE_COLUMNS))
+        with open(stock.excel_path, "wb") as f:
+            f.write(vide)
+    stock.init_storage()
+    return store(nom)
+
+
+# ── Chargement ──
+
+def _charger(nom):
+    stock = stockage(nom)
+    stock.init_storage()
+    if not stock.has_stock():
+        return 0
+    return len(store(nom).df)
+
+
+@timed("magasins.chargement")
+def charger(workers=CHARGEMENT_WORKERS):
+    """Prépare et charge tous les magasins en parallèle, une fois par processus.
+
+    Renvoie {magasin: nb pièces}, ou l'exception levée par un magasin
+    illisible (les autres sont chargés quand même).
+    """
+    global _chargement
+    with _chargement_lock:
+        if _chargement is None:
+            liste = noms()
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(liste))),
+                                    thread_name_prefix="chargement-magasin") as pool:
+                futurs = {nom: pool.submit(_charger, nom) for nom in liste}
+            _chargement = {nom: f.exception() or f.result() for nom, f in futurs.items()}
+        return _chargement
+
+
+def flush_pending():
+    """Écrit les modifications en attente de tous les magasins (backend Excel)."""
+    with _lock:
+        stockages = [storage.principal] + list(_stockages.values())
+    for stock in stockages:
+        stock.flush_pending()
+
+
+# ── Vues consolidées ──
+
+def version():
+    """Clé de cache des vues consolidées : version du stock de chaque magasin."""
+    return tuple((nom, store(nom).version) for nom in noms() if stockage(nom).has_stock())
+
+
+def vue_consolidee() -> pd.DataFrame:
+    """Inventaire de tous les magasins : vue d'inventaire + colonne Magasin."""
+    global _consolide
+    vues = [(nom, store(nom).vue()) for nom in noms() if stockage(nom).has_stock()]
+    cache = _consolide
+    if cache is not None and len(cache[0]) == len(vues) \
+            and all(a == b and v is w for (a, v), (b, w) in zip(cache[0], vues)):
+        return cache[1]
+    if vues:
+        df = pd.concat([vue.drop(columns="_cle").assign(Magasin=nom) for nom, vue in vues], ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=storage.STOCK_COLUMNS + ["Valeur_Totale_DH", "Alerte", "Magasin"])
+    df = df[["Magasin"] + [c for c in df.columns if c != "Magasin"]]
+    _consolide = (vues, df)
+    return df
+
+
+def stock_consolide(vue=None) -> pd.DataFrame:
+    """Une ligne par pièce : quantité dans chaque magasin, quantité et valeur totales."""
+    vue = vue_consolidee() if vue is None else vue
+    if vue.empty:
+        return pd.DataFrame(columns=["ID_QR", "Designation", "Quantite_Totale", "Valeur_Totale_DH"])
+    totaux = vue.groupby("ID_QR", sort=True).agg(
+        Designation=("Designation", "first"), Quantite_Totale=("Quantite", "sum"),
+        Valeur_Totale_DH=("Valeur_Totale_DH", "sum"))
+    par_magasin = vue.pivot_table(index="ID_QR", columns="Magasin", values="Quantite",
+                                  aggfunc="sum", fill_value=0)
+    par_magasin = par_magasin[[n for n in noms() if n in par_magasin.columns]]
+    return totaux.join(par_magasin).reset_index()
+
+
+def synthese(vue=None) -> pd.DataFrame:
+    """Par magasin : nombre de pièces, quantité, valeur du stock et pièces en alerte."""
+    vue = vue_consolidee() if vue is None else vue
+    return (vue.groupby("Magasin", sort=False)
+               .agg(Nb_Pieces=("ID_QR", "size"), Quantite_Totale=("Quantite", "sum"),
+                    Valeur_Totale_DH=("Valeur_Totale_DH", "sum"), Nb_Alertes=("Alerte", "sum"))
+               .reset_index())
+
+
+# ── Transferts ──
+
+@timed("magasins.transfert")
+def transferer(id_qr, qte, origine, destination, auteur=None):
+    """Déplace qte unités d'une pièce entre deux magasins.
+
+    Renvoie (quantité restant à l'origine, quantité à destination).
+    StockInsuffisant / PieceInconnue si l'origine ne peut pas fournir ;
+    TransfertInterrompu si la quantité n'a pu être ni reçue ni rendue.
+    """
+    id_qr = normalize_id(id_qr)
+    qte = int(qte)
+    if origine == destination:
+        raise StockError("Le magasin de destination doit être différent de l'origine.")
+    if qte <= 0:
+        raise StockError("La quantité à transférer doit être positive.")
+    source, cible = store(origine), store(destination)
+    row = source.get(id_qr)
+    if row is None:
+        raise PieceInconnue(id_qr)
+    restant = source.transfert(id_qr, -qte, {"Vers": destination}, auteur)
+    try:
+        if id_qr not in cible:
+            try:
+                cible.add_piece(id_qr, row["Designation"], 0, row["Prix_Unitaire_DH"], row["Seuil_Alerte"], auteur)
+            except PieceExistante:
+                # Créée entre-temps par un autre transfert
+                pass
+        recu = cible.transfert(id_qr, qte, {"De": origine}, auteur)
+    except Exception as erreur:
+        # La quantité revient au magasin d'origine
+        try:
+            source.transfert(id_qr, qte, {"Vers": destination, "Annule": True}, auteur)
+        except Exception as retour:
+            _log.error("Transfert de %d × %s de %s vers %s : réception refusée (%r), retour à l'origine "
+                       "refusé (%r) ; quantité à corriger à la main.", qte, id_qr, origine, destination,
+                       erreur, retour, exc_info=retour)
+            raise TransfertInterrompu(id_qr, qte, origine, destination) from retour
+        raise
+    return restant, recu
@@ -0,0 +1,200 @@
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# ─────────────────────────────────────────────
+# MESURES DE PERFORMANCE (en mémoire)
+# ─────────────────────────────────────────────
+# Chaque opération instrumentée (lecture/écriture Excel, décodage QR, PDF,
+# rendu de page...) garde :
+#   - les N dernières durées (tampon circulaire) pour les percentiles,
+#   - des compteurs cumulés : appels, temps total, octets lus/écrits,
+#     histogramme par seuils (format Prometheus).
+# Le coût par appel est de quelques microsecondes (un verrou, un append).
+# Si GMAO_METRICS_FILE est défini, les mesures y sont écrites au format
+# texte Prometheus toutes les METRICS_DUMP_INTERVAL_S secondes.
+
+BUFFER_SIZE = 2048
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_PATH = os.environ.get("GMAO_METRICS_FILE")
+METRICS_DUMP_INTERVAL_S = 60
+
+
+class _Operation:
+    __slots__ = ("durees", "appels", "total_s", "octets", "erreurs", "buckets")
+
+    def __init__(self):
+        self.durees = deque(maxlen=BUFFER_SIZE)
+        self.appels = 0
+        self.total_s = 0.0
+        self.octets = 0
+        self.erreurs = 0
+        self.buckets = [0] * len(BUCKETS)
+
+
+_lock = threading.Lock()
+_operations = {}
+
+
+def enregistrer(operation, duree, octets=0, erreur=False):
+    with _lock:
+        op = _operations.get(operation)
+        if op is None:
+            op = _operations[operation] = _Operation()
+        op.durees.append(duree)
+        op.appels += 1
+        op.total_s += duree
+        op.octets += octets
+        op.erreurs += erreur
+        for i, seuil in enumerate(BUCKETS):
+            if duree <= seuil:
+                op.buckets[i] += 1
+                break
+
+
+@contextmanager
+def mesure(operation, octets=0):
+    """Chronomètre un bloc. operation peut être un appelable évalué à la sortie."""
+    infos = {"octets": octets}
+    t0 = time.perf_counter()
+    erreur = False
+    try:
+        yield infos
+    except Exception:
+        erreur = True
+        raise
+    finally:
+        nom = operation() if callable(operation) else operation
+        enregistrer(nom, time.perf_counter() - t0, infos["octets"], erreur)
+
+
+def timed(operation, octets=None):
+    """Décorateur : chronomètre chaque appel. octets(args, kwargs, résultat) -> int."""
+    def decorateur(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                enregistrer(operation, time.perf_counter() - t0, 0, True)
+                raise
+            duree = time.perf_counter() - t0
+            n = 0
+            if octets is not None:
+                try:
+                    n = int(octets(args, kwargs, result) or 0)
+                except (OSError, TypeError, ValueError):
+                    n = 0
+            enregistrer(operation, duree, n)
+            return result
+        return wrapper
+    return decorateur
+
+
+def taille_fichier(position=0, nom="path", defaut=None):
+    """Pour timed(octets=...) : taille du fichier passé en argument."""
+    def octets(args, kwargs, result):
+        path = args[position] if len(args) > position else kwargs.get(nom, defaut)
+        return os.path.getsize(path) if path and os.path.exists(path) else 0
+    return octets
+
+
+def taille_resultat(args, kwargs, result):
+    """Pour timed(octets=...) : longueur du résultat (bytes)."""
+    return len(result) if result is not None else 0
+
+
+# ─────────────────────────────────────────────
+# LECTURE DES MESURES
+# ─────────────────────────────────────────────
+
+def snapshot() -> pd.DataFrame:
+    """Une ligne par opération : appels, percentiles (ms) sur le tampon, octets."""
+    with _lock:
+        copie = [(nom, np.fromiter(op.durees, dtype=float), op.appels, op.total_s, op.octets, op.erreurs)
+                 for nom, op in _operations.items()]
+    lignes = []
+    for nom, durees, appels, total_s, octets, erreurs in copie:
+        p50, p95, p99 = np.percentile(durees, [50, 95, 99]) * 1000 if len(durees) else (0.0, 0.0, 0.0)
+        lignes.append({
+            "Operation": nom, "Appels": appels, "Erreurs": erreurs,
+            "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2),
+            "max_ms": round(durees.max() * 1000, 2) if len(durees) else 0.0,
+            "Total_s": round(total_s, 3), "Octets": octets,
+        })
+    colonnes = ["Operation", "Appels", "Erreurs", "p50_ms", "p95_ms", "p99_ms", "max_ms", "Total_s", "Octets"]
+    return pd.DataFrame(lignes, columns=colonnes).sort_values("Total_s", ascending=False, ignore_index=True)
+
+
+def reset():
+    with _lock:
+        _operations.clear()
+
+
+def _label(valeur):
+    return str(valeur).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    """Toutes les mesures au format d'exposition texte Prometheus."""
+    with _lock:
+        copie = [(nom, list(op.buckets), op.appels, op.total_s, op.octets, op.erreurs)
+                 for nom, op in sorted(_operations.items())]
+    out = ["# HELP gmao_operation_duration_seconds Durée des opérations instrumentées.",
+           "# TYPE gmao_operation_duration_seconds histogram"]
+    for nom, buckets, appels, total_s, _, _ in copie:
+        label = _label(nom)
+        cumul = 0
+        for seuil, n in zip(BUCKETS, buckets):
+            cumul += n
+            out.append(f'gmao_operation_duration_seconds_bucket{{operation="{label}",le="{seuil}"}} {cumul}')
+        out.append(f'gmao_operation_duration_seconds_bucket{{operation="{label}",le="+Inf"}} {appels}')
+        out.append(f'gmao_operation_duration_seconds_sum{{operation="{label}"}} {total_s:.6f}')
+        out.append(f'gmao_operation_duration_seconds_count{{operation="{label}"}} {appels}')
+    out += ["# HELP gmao_operation_bytes_total Octets lus ou écrits par opération.",
+            "# TYPE gmao_operation_bytes_total counter"]
+    out += [f'gmao_operation_bytes_total{{operation="{_label(nom)}"}} {octets}' for nom, _, _, _, octets, _ in copie]
+    out += ["# HELP gmao_operation_errors_total Appels terminés par une exception.",
+            "# TYPE gmao_operation_errors_total counter"]
+    out += [f'gmao_operation_errors_total{{operation="{_label(nom)}"}} {erreurs}' for nom, *_, erreurs in copie]
+    return "\n".join(out) + "\n"
+
+
+def dump(path=None):
+    """Écrit le fichier de mesures (remplacement atomique). Renvoie le chemin."""
+    path = path or METRICS_PATH
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+    return path
+
+
+def _dump_loop():
+    while True:
+        time.sleep(METRICS_DUMP_INTERVAL_S)
+        try:
+            dump()
+        except OSError:
+            # Disque plein / dossier absent : on réessaiera au prochain tour
+            pass
+
+
+_dump_thread = None
+
+
+def start_dump():
+    """Écriture périodique si GMAO_METRICS_FILE est défini (une fois par processus)."""
+    global _dump_thread
+    with _lock:
+        if METRICS_PATH is None or _dump_thread is not None:
+            return
+        _dump_thread = threading.Thread(target=_dump_loop, name="metrics-dump", daemon=True)
+        _dump_thread.start()
@@ -0,0 +1,114 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from metrics import timed
+try:
+    import zxingcpp
+    QR_DECODE_AVAILABLE = True
+except ImportError:
+    QR_DECODE_AVAILABLE = False
+
+# ─────────────────────────────────────────────
+# DÉCODAGE DES QR CODES (caméra)
+# ─────────────────────────────────────────────
+# Passes successives, de la moins chère à la plus chère ; on s'arrête à la
+# première qui trouve un code :
+#   1. niveaux de gris réduits (JPEG décodé directement à petite échelle)
+#   2. pleine résolution, recherche multi-échelle et rotations
+#   3. binarisation globale (contre-jour, reflets)
+#   4. image renforcée (contraste + netteté) pour les photos floues
+# Les résultats sont mis en cache par empreinte de l'image : un rerun
+# Streamlit avec la même photo ne relance pas le décodage.
+
+# Formats imprimés sur les étiquettes des pièces
+DECODE_FORMATS = "QRCode,MicroQRCode,Code128"
+FIRST_PASS_MAX_SIDE = 960
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_formats = None
+
+
+def _decoder_formats():
+    global _formats
+    if _formats is None:
+        _formats = zxingcpp.barcode_formats_from_str(DECODE_FORMATS)
+    return _formats
+
+
+def _clean(text):
+    return text.strip().replace(" ", "")
+
+
+@timed("qr.zxing")
+def _read(gray: Image.Image, **options):
+    results = zxingcpp.read_barcodes(np.asarray(gray), formats=_decoder_formats(), **options)
+    codes = []
+    for r in results:
+        code = _clean(r.text)
+        if code and code not in codes:
+            codes.append(code)
+    return codes
+
+
+def _open_gray(data: bytes, max_side=None) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    if max_side:
+        # Pour un JPEG, draft() décode directement à 1/2, 1/4 ou 1/8 de la taille
+        img.draft("L", (max_side, max_side))
+    gray = img.convert("L")
+    if max_side and max(gray.size) > max_side:
+        gray.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    return gray
+
+
+def _passes(data: bytes):
+    yield "reduite", lambda: _read(_open_gray(data, FIRST_PASS_MAX_SIDE),
+                                   try_rotate=False, try_downscale=False)
+    full = {}
+
+    def full_gray():
+        if "img" not in full:
+            full["img"] = _open_gray(data)
+        return full["img"]
+
+    yield "pleine", lambda: _read(full_gray(), try_rotate=True, try_downscale=True)
+    yield "binarisee", lambda: _read(full_gray(), try_rotate=True, try_downscale=True,
+                                     binarizer=zxingcpp.Binarizer.GlobalHistogram)
+    yield "renforcee", lambda: _read(
+        ImageOps.autocontrast(full_gray(), cutoff=2).filter(ImageFilter.UnsharpMask(radius=3, percent=200)),
+        try_rotate=True, try_downscale=True)
+
+
+@timed("qr.decode", octets=lambda args, kwargs, result: len(args[0]))
+def decode_frame_detail(data: bytes):
+    """Décode tous les codes d'une photo. Renvoie (codes, nom de la passe ou None)."""
+    key = hashlib.blake2b(data, digest_size=16).digest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    result = ([], None)
+    for name, run in _passes(data):
+        codes = run()
+        if codes:
+            result = (codes, name)
+            break
+
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def decode_frame(data: bytes):
+    """Liste des codes lus sur la photo (vide si illisible)."""
+    return decode_frame_detail(data)[0]
@@ -0,0 +1,290 @@
+"""API HTTP de scan pour les douchettes (sans Streamlit).
+
+    python scan_api.py --port 8502
+
+    GET  /api/sante
+    GET  /api/magasins
+    GET  /api/pieces/{id_qr}
+    GET  /api/stock?q=roulement&alertes=1&tri=Quantite&page=1&taille=100
+    GET  /api/alertes
+    POST /api/sorties        {"id_qr": "PMP-01", "quantite": 1, "technicien": "..."}
+    POST /api/sorties/lot    {"technicien": "...", "items": [{"id_qr": "PMP-01", "quantite": 2}, ...]}
+
+Chaque route accepte un magasin (?magasin=... ou champ "magasin" du
+JSON) ; sans lui, c'est le magasin principal.
+
+Si GMAO_API_TOKEN est défini, chaque requête doit porter
+« Authorization: Bearer <jeton> ». L'API n'écoute que sur ce poste par
+défaut ; pour les douchettes du réseau (--host 0.0.0.0), le jeton est
+obligatoire.
+
+L'API est un second processus à côté de l'application : elle demande le
+backend SQLite (GMAO_STORAGE=sqlite, par défaut). Le classeur, le journal
+des sorties et la file d'écriture du backend Excel ne se partagent pas
+entre processus.
+"""
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import alerts
+import magasins
+import metrics
+import storage
+from stock_store import normalize_id, PanierRefuse, PieceInconnue, StockError, StockInsuffisant
+
+# ─────────────────────────────────────────────
+# CONFIGURATION
+# ─────────────────────────────────────────────
+# Le store est le même que celui de l'application : mêmes verrous par
+# pièce, même écriture du stock et de l'historique. Ses appels sont
+# bloquants (SQLite / Excel) et passent par un pool de threads pour ne pas
+# bloquer la boucle asyncio.
+
+API_TOKEN = os.environ.get("GMAO_API_TOKEN")
+API_HOST = "127.0.0.1"
+API_WORKERS = 16
+QTE_MAX = 10000
+TAILLE_PAGE_MAX = 1000
+
+
+def _piece_json(row):
+    return {
+        "id_qr": str(row["ID_QR"]),
+        "designation": str(row["Designation"]),
+        "quantite": int(row["Quantite"]),
+        "prix_unitaire_dh": float(row["Prix_Unitaire_DH"]),
+        "seuil_alerte": int(row["Seuil_Alerte"]),
+    }
+
+
+def _erreur(status, message, **extra):
+    return web.json_response({"erreur": message, **extra}, status=status)
+
+
+async def _run(request, fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app["executor"], fn, *args)
+
+
+async def _json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text='{"erreur": "JSON invalide."}', content_type="application/json")
+    if not isinstance(data, dict):
+        raise web.HTTPBadRequest(text='{"erreur": "Objet JSON attendu."}', content_type="application/json")
+    return data
+
+
+def _store(nom):
+    """Store du magasin demandé (principal par défaut). MagasinInconnu sinon."""
+    if nom and nom not in magasins.noms():
+        raise magasins.MagasinInconnu(nom)
+    return magasins.store(nom or None)
+
+
+def _technicien(data):
+    technicien = str(data.get("technicien", "")).strip()
+    if technicien not in storage.TECHNICIENS:
+        return None
+    return technicien
+
+
+def _quantite(valeur):
+    try:
+        qte = int(valeur)
+    except (TypeError, ValueError):
+        return None
+    return qte if 1 <= qte <= QTE_MAX else None
+
+
+# ─────────────────────────────────────────────
+# MIDDLEWARES
+# ─────────────────────────────────────────────
+
+@web.middleware
+async def auth_middleware(request, handler):
+    if API_TOKEN and request.path != "/api/sante":
+        fourni = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(fourni, API_TOKEN):
+            return _erreur(401, "Jeton d'accès invalide.")
+    return await handler(request)
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    route = request.match_info.route.resource
+    nom = f"api.{request.method} {route.canonical if route is not None else request.path}"
+    with metrics.mesure(nom):
+        return await handler(request)
+
+
+# ─────────────────────────────────────────────
+# ROUTES
+# ─────────────────────────────────────────────
+
+async def sante(request):
+    return web.json_response({"ok": True, "backend": storage.STORAGE_BACKEND})
+
+
+async def liste_magasins(request):
+    return web.json_response({"magasins": magasins.noms(), "principal": magasins.MAGASIN_PRINCIPAL})
+
+
+async def piece(request):
+    try:
+        store = _store(request.query.get("magasin"))
+    except magasins.MagasinInconnu as e:
+        return _erreur(404, str(e))
+    row = await _run(request, store.get, request.match_info["id_qr"])
+    if row is None:
+        return _erreur(404, str(PieceInconnue(normalize_id(request.match_info["id_qr"]))))
+    return web.json_response(_piece_json(row))
+
+
+async def stock(request):
+    q = request.query
+    tri = q.get("tri", "ID_QR")
+    if tri not in storage.STOCK_COLUMNS + ["Valeur_Totale_DH"]:
+        return _erreur(400, f"Tri inconnu : {tri}")
+    try:
+        page, taille = int(q.get("page", 1)), min(int(q.get("taille", 100)), TAILLE_PAGE_MAX)
+    except ValueError:
+        return _erreur(400, "page et taille doivent être des entiers.")
+    if page < 1 or taille < 1:
+        return _erreur(400, "page et taille doivent être au moins 1.")
+    try:
+        store = _store(q.get("magasin"))
+    except magasins.MagasinInconnu as e:
+        return _erreur(404, str(e))
+    df, total = await _run(request, lambda: store.page(
+        q.get("q", ""), tri, q.get("desc") == "1", q.get("alertes") == "1", page, taille))
+    return web.json_response({
+        "total": total, "page": page, "taille": taille,
+        "pieces": [dict(_piece_json(r), alerte=bool(r["Alerte"])) for _, r in df.iterrows()],
+    })
+
+
+async def liste_alertes(request):
+    nom = request.query.get("magasin")
+    if nom and nom not in magasins.noms():
+        return _erreur(404, str(magasins.MagasinInconnu(nom)))
+    df = await _run(request, lambda: alerts.surveillance(nom).ouvertes())
+    return web.json_response({"alertes": [
+        {"id_qr": str(r.ID_QR), "designation": str(r.Designation), "quantite": int(r.Quantite),
+         "seuil_alerte": int(r.Seuil_Alerte), "ouverte_le": r.Ouverte_le} for r in df.itertuples()]})
+
+
+async def sortie(request):
+    data = await _json(request)
+    id_qr = normalize_id(data.get("id_qr", ""))
+    qte = _quantite(data.get("quantite", 1))
+    technicien = _technicien(data)
+    if not id_qr or qte is None:
+        return _erreur(400, f"id_qr et quantite (1 à {QTE_MAX}) sont requis.")
+    if technicien is None:
+        return _erreur(400, "Technicien inconnu.")
+    try:
+        designation, restant = await _run(request, _store(data.get("magasin")).sortie, id_qr, qte, technicien)
+    except (PieceInconnue, magasins.MagasinInconnu) as e:
+        return _erreur(404, str(e))
+    except StockInsuffisant as e:
+        return _erreur(409, str(e), stock_actuel=int(e.stock_actuel))
+    except StockError as e:
+        return _erreur(409, str(e))
+    return web.json_response({"id_qr": id_qr, "designation": designation, "quantite": qte, "restant": int(restant)})
+
+
+async def sortie_lot(request):
+    data = await _json(request)
+    technicien = _technicien(data)
+    if technicien is None:
+        return _erreur(400, "Technicien inconnu.")
+    items = []
+    for ligne in data.get("items") or []:
+        id_qr = normalize_id(ligne.get("id_qr", "")) if isinstance(ligne, dict) else ""
+        qte = _quantite(ligne.get("quantite", 1)) if isinstance(ligne, dict) else None
+        if not id_qr or qte is None:
+            return _erreur(400, f"Ligne {len(items) + 1} invalide : id_qr et quantite (1 à {QTE_MAX}) requis.")
+        items.append((id_qr, qte))
+    if not items:
+        return _erreur(400, "Aucune ligne à sortir.")
+    try:
+        resultats = await _run(request, _store(data.get("magasin")).sortie_batch, items, technicien)
+    except magasins.MagasinInconnu as e:
+        return _erreur(404, str(e))
+    except PanierRefuse as e:
+        # Tout ou rien : rien n'a été retiré
+        return _erreur(409, str(e), refus=[
+            {"id_qr": err.id_qr, "erreur": str(err),
+             **({"stock_actuel": int(err.stock_actuel)} if isinstance(err, StockInsuffisant) else {})}
+            for err in e.erreurs])
+    return web.json_response({"sorties": [
+        {"id_qr": i, "designation": des, "quantite": qte, "restant": int(restant)}
+        for i, des, qte, restant in resultats]})
+
+
+# ─────────────────────────────────────────────
+# APPLICATION
+# ─────────────────────────────────────────────
+
+async def _fermer_executor(app):
+    app["executor"].shutdown(wait=True)
+    # Backend Excel : écrire les modifications encore en attente
+    magasins.flush_pending()
+
+
+def create_app(workers=API_WORKERS):
+    if not storage.use_sqlite():
+        raise RuntimeError("L'API de scan demande le backend SQLite : le classeur Excel "
+                           "ne se partage pas entre l'application et l'API.")
+    magasins.charger()
+    alerts.demarrer()
+    metrics.start_dump()
+    app = web.Application(middlewares=[auth_middleware, metrics_middleware], client_max_size=1024 ** 2)
+    app["executor"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan-api")
+    app.on_cleanup.append(_fermer_executor)
+    app.add_routes([
+        web.get("/api/sante", sante),
+        web.get("/api/magasins", liste_magasins),
+        web.get("/api/pieces/{id_qr}", piece),
+        web.get("/api/stock", stock),
+        web.get("/api/alertes", liste_alertes),
+        web.post("/api/sorties", sortie),
+        web.post("/api/sorties/lot", sortie_lot),
+    ])
+    return app
+
+
+def _locale(host):
+    """Vrai si host n'est joignable que depuis ce poste."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="threads pour les opérations de stock")
+    args = parser.parse_args(argv)
+    # Sorties et prix ouverts à tout le réseau : pas sans jeton
+    if not API_TOKEN and not _locale(args.host):
+        parser.error(f"--host {args.host} expose l'API au réseau : définir GMAO_API_TOKEN.")
+    if not storage.use_sqlite():
+        parser.error(f"backend {storage.STORAGE_BACKEND} : l'API de scan demande GMAO_STORAGE=sqlite.")
+    web.run_app(create_app(args.workers), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
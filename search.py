@@ -0,0 +1,186 @@
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# ─────────────────────────────────────────────
+# INDEX DE RECHERCHE (ID_QR + DÉSIGNATION)
+# ─────────────────────────────────────────────
+# Chaque pièce est découpée en trigrammes sur son ID et les mots de sa
+# désignation, sans accents ni majuscules ("$" marque le début et la fin
+# des mots). Un trigramme est codé par un entier ; l'index est une table
+# triée trigramme -> numéros de pièces (deux tableaux numpy, construits en
+# une passe vectorisée au chargement, textes normalisés par pyarrow,
+# installé avec Streamlit).
+#
+# Une recherche compte, pour chaque pièce, les trigrammes de la saisie
+# qu'elle contient (np.bincount sur les listes concernées) : une faute de
+# frappe ne coûte que quelques trigrammes, et un début de mot trouve déjà
+# la pièce (la saisie n'est pas fermée par "$"). Les meilleurs candidats
+# sont ensuite départagés : ID exact, ID qui commence par la saisie,
+# désignation qui la contient.
+#
+# Mises à jour pièce par pièce : une pièce ajoutée ou renommée va dans un
+# petit index d'appoint (dictionnaire), une pièce retirée est masquée.
+# La table est reconstruite quand l'appoint dépasse REINDEX_APPOINT.
+
+TOP_K = 20
+SCORE_MIN = 0.34             # part minimale des trigrammes de la saisie retrouvés
+CANDIDATS_PAR_RESULTAT = 10
+REINDEX_APPOINT = 2000
+
+_ALPHABET = "$0123456789abcdefghijklmnopqrstuvwxyz"
+_K = len(_ALPHABET)
+_CODES = np.full(256, -1, dtype=np.int64)
+_CODES[np.frombuffer(_ALPHABET.encode(), dtype=np.uint8)] = np.arange(_K)
+
+
+def normaliser(texte):
+    """Minuscules, sans accents, ponctuation remplacée par des espaces."""
+    texte = unicodedata.normalize("NFKD", str(texte or "")).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^0-9a-z]+", " ", texte.lower()).strip()
+
+
+def normaliser_tous(textes):
+    """normaliser() sur toute une liste, en une passe pyarrow."""
+    textes = pa.array([None if t is None else str(t) for t in textes], type=pa.string()).fill_null("")
+    textes = pc.replace_substring_regex(pc.utf8_normalize(textes, form="NFKD"), r"[^\x00-\x7f]", "")
+    textes = pc.replace_substring_regex(pc.ascii_lower(textes), r"[^0-9a-z]+", " ")
+    return pc.utf8_trim_whitespace(textes).to_pylist()
+
+
+def _mots_marques(texte):
+    return "$" + texte.replace(" ", "$ $") + "$" if texte else ""
+
+
+def _paires(textes):
+    """(codes de trigrammes, numéros de pièce) de tous les textes, sans doublons."""
+    marques = [_mots_marques(t) for t in textes]
+    if not marques:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    octets = np.frombuffer(" ".join(marques).encode("ascii"), dtype=np.uint8)
+    pieces = np.repeat(np.arange(len(marques)), [len(m) + 1 for m in marques])[:len(octets)]
+    c = _CODES[octets]
+    a, b, d = c[:-2], c[1:-1], c[2:]
+    valides = (a >= 0) & (b >= 0) & (d >= 0)
+    codes = (a * _K + b) * _K + d
+    cles = np.sort(codes[valides] * len(marques) + pieces[:-2][valides])
+    cles = cles[np.concatenate(([True], cles[1:] != cles[:-1]))]
+    return cles // len(marques), cles % len(marques)
+
+
+def _codes_saisie(mots):
+    """Trigrammes de la saisie (mots ouverts à droite), plus les préfixes de deux lettres."""
+    codes, prefixes = set(), set()
+    for mot in mots:
+        c = [_ALPHABET.index(x) for x in "$" + mot]
+        if len(c) == 2:
+            prefixes.add((c[0] * _K + c[1]) * _K)
+        codes.update((c[i] * _K + c[i + 1]) * _K + c[i + 2] for i in range(len(c) - 2))
+    return codes, prefixes
+
+
+class IndexRecherche:
+    def __init__(self, ids=(), designations=()):
+        self._lock = threading.Lock()
+        self._construire(list(map(str, ids)), list(designations))
+
+    def _construire(self, ids, designations):
+        self._ids = ids
+        self._designations = designations
+        self._id_norm = [i.replace(" ", "") for i in normaliser_tous(ids)]
+        self._textes = normaliser_tous(designations)
+        codes, pieces = _paires([f"{i} {t}".strip() for i, t in zip(self._id_norm, self._textes)])
+        # Table triée : les pièces du trigramme c sont pieces[debuts[c]:debuts[c + 1]]
+        self._debuts = np.searchsorted(codes, np.arange(_K ** 3 + 1))
+        self._pieces = pieces
+        self._actives = np.ones(len(ids), dtype=bool)
+        self._numeros = {i: n for n, i in enumerate(ids)}
+        self._appoint = {}          # trigramme -> [numéros ajoutés depuis la construction]
+        self._n_appoint = 0
+
+    def __len__(self):
+        return len(self._numeros)
+
+    # ── Mise à jour ──
+
+    def ajouter(self, id_qr, designation):
+        """Ajoute la pièce, ou remplace sa désignation si elle est déjà indexée."""
+        id_qr = str(id_qr)
+        with self._lock:
+            self._retirer(id_qr)
+            if self._n_appoint >= REINDEX_APPOINT:
+                self._reconstruire()
+            numero = len(self._ids)
+            self._ids.append(id_qr)
+            self._designations.append(designation)
+            self._id_norm.append(normaliser(id_qr).replace(" ", ""))
+            self._textes.append(normaliser(designation))
+            self._actives = np.append(self._actives, True)
+            self._numeros[id_qr] = numero
+            codes, _ = _paires([f"{self._id_norm[-1]} {self._textes[-1]}".strip()])
+            for code in codes.tolist():
+                self._appoint.setdefault(code, []).append(numero)
+            self._n_appoint += 1
+
+    def retirer(self, id_qr):
+        with self._lock:
+            self._retirer(str(id_qr))
+
+    def _retirer(self, id_qr):
+        numero = self._numeros.pop(id_qr, None)
+        if numero is not None:
+            self._actives[numero] = False
+
+    def _reconstruire(self):
+        gardes = np.flatnonzero(self._actives).tolist()
+        self._construire([self._ids[n] for n in gardes], [self._designations[n] for n in gardes])
+
+    # ── Recherche ──
+
+    def rechercher(self, saisie, k=TOP_K):
+        """Les k pièces les plus proches de la saisie : [(ID_QR, Designation), ...]."""
+        requete = normaliser(saisie)
+        if not requete:
+            return []
+        mots = requete.split()
+        codes, prefixes = _codes_saisie(mots + ["".join(mots)] if len(mots) > 1 else mots)
+        with self._lock:
+            listes = [self._pieces[self._debuts[c]:self._debuts[c + 1]] for c in codes]
+            listes += [self._pieces[self._debuts[p]:self._debuts[p + _K]] for p in prefixes]
+            listes += [np.asarray(self._appoint[c]) for c in codes if c in self._appoint]
+            listes += [np.asarray(v) for p in prefixes for c, v in self._appoint.items() if p <= c < p + _K]
+            if not listes:
+                return []
+            comptes = np.bincount(np.concatenate(listes), minlength=len(self._ids))
+            comptes[~self._actives] = 0
+            # Comptes = petits entiers : seuil lu sur leur histogramme plutôt qu'un tri
+            n_codes = len(codes) + len(prefixes)
+            n_max = k * CANDIDATS_PAR_RESULTAT
+            au_moins = np.cumsum(np.bincount(comptes)[::-1])[::-1]   # pièces ayant au moins c trigrammes
+            seuil = max(int(np.ceil(SCORE_MIN * n_codes)), 1, int(np.flatnonzero(au_moins >= n_max)[-1])
+                        if au_moins[0] >= n_max else 0)
+            if seuil >= len(au_moins):
+                return []
+            haut = np.flatnonzero(comptes > seuil)
+            candidats = np.concatenate((haut, np.flatnonzero(comptes == seuil)[:max(n_max - len(haut), 0)]))
+            pieces = [(self._ids[n], self._designations[n], self._id_norm[n], self._textes[n], comptes[n])
+                      for n in candidats.tolist()]
+        compact = requete.replace(" ", "")
+        resultats = []
+        for id_qr, designation, id_norm, texte, compte in pieces:
+            score = compte / n_codes
+            if score < SCORE_MIN:
+                continue
+            if id_norm == compact:
+                score += 3
+            elif id_norm.startswith(compact):
+                score += 2
+            if requete in texte:
+                score += 1 + texte.startswith(requete)
+            resultats.append((-score, len(texte), id_qr, designation))
+        resultats.sort()
+        return [(id_qr, designation) for _, _, id_qr, designation in resultats[:k]]
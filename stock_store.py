@@ -0,0 +1,665 @@
+import threading
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+import storage
+from search import IndexRecherche, TOP_K
+from stock_table import StockTable
+
+# ─────────────────────────────────────────────
+# STOCK PARTAGÉ (un par magasin et par processus serveur)
+# ─────────────────────────────────────────────
+# Toutes les sessions Streamlit lisent et modifient la même table (colonnes
+# compactes, voir stock_table) au lieu de recharger le stock chacune de
+# leur côté. Chaque ID_QR a son propre verrou : des sorties sur des pièces
+# différentes avancent en parallèle, deux sorties sur la même pièce sont
+# sérialisées. Le verrou global ne couvre que les opérations en mémoire,
+# jamais les écritures.
+#
+# Un index ID_QR normalisé -> position dans la table est construit au
+# chargement et tenu à jour à chaque ajout/suppression : aucune recherche
+# ne parcourt la colonne ID_QR.
+#
+# La vue d'inventaire (valeur, alerte, clé de recherche) est calculée en
+# une passe vectorisée par version du stock ; filtrage, tri et pagination
+# se font côté serveur et seule la page affichée est envoyée au navigateur.
+#
+# L'index de recherche (trigrammes ID + désignation, voir search) est
+# construit à la première recherche après un chargement, puis suit les
+# ajouts, renommages et suppressions.
+#
+# Chaque mutation ajoute ses mouvements au grand livre (storage) avec les
+# valeurs après coup, écrits seulement une fois la sauvegarde des lignes
+# réussie (dans la même transaction SQLite) ; si elle échoue, le cache est
+# remis dans son état d'avant et la pièce remarquée pour la sauvegarde
+# suivante.
+#
+# Un store par magasin (voir magasins) : chacun a son storage.Stockage
+# (fichiers, verrous, écrivain) ; get_store() est celui du magasin principal.
+#
+# Des abonnés (voir alerts) sont prévenus après chaque modification, avec
+# les seules pièces touchées : ils n'ont pas à reparcourir la table.
+
+
+def normalize_id(id_qr):
+    """Forme canonique d'un ID_QR (saisie, scan ou cellule Excel)."""
+    return str(id_qr).strip().replace(" ", "")
+
+
+class StockError(Exception):
+    """Opération de stock refusée."""
+
+
+class PieceInconnue(StockError):
+    def __init__(self, id_qr):
+        super().__init__(f"Pièce '{id_qr}' non trouvée dans la base de données.")
+        self.id_qr = id_qr
+
+
+class PieceExistante(StockError):
+    def __init__(self, id_qr):
+        super().__init__(f"L'ID {id_qr} existe déjà.")
+        self.id_qr = id_qr
+
+
+class StockInsuffisant(StockError):
+    def __init__(self, id_qr, stock_actuel):
+        super().__init__(f"Stock insuffisant ! Stock actuel : {stock_actuel}")
+        self.id_qr = id_qr
+        self.stock_actuel = stock_actuel
+
+
+class PanierRefuse(StockError):
+    """Sortie groupée refusée : aucune pièce du panier n'a été retirée."""
+
+    def __init__(self, erreurs):
+        super().__init__(" | ".join(
+            f"{e.id_qr} : {e}" if isinstance(e, StockInsuffisant) else str(e) for e in erreurs))
+        self.erreurs = erreurs
+
+
+class StockStore:
+    def __init__(self, stockage=storage.principal):
+        self._stockage = stockage     # storage.Stockage du magasin
+        self._lock = threading.RLock()
+        self._locks_guard = threading.Lock()
+        self._item_locks = {}
+        self._table = None
+        self._index = {}
+        self._version = None
+        self._generation = 0      # modifications en mémoire (le classeur peut être écrit plus tard)
+        self._stale = False
+        self._ecrites = set()     # SQLite : versions écrites ici, en avance sur _version
+        self._en_cours = 0        # SQLite : écritures validées ou en cours, pas encore reportées
+        self._vue = None          # (version, vue d'inventaire)
+        self._cles = None         # (DataFrame, clés de recherche) : ne suivent pas les quantités
+        self._selection = None    # (clé, version, étiquettes filtrées et triées)
+        self._recherche = None    # IndexRecherche, construit à la première recherche
+        self._abonnes = []        # callback(store, ids, cause), voir abonner
+        # Backend Excel : le classeur est écrit plus tard par le thread d'écriture
+        self._stockage.add_persist_listener(self._note_write)
+
+    # ── Verrous ──
+
+    def _item_lock(self, id_qr):
+        with self._locks_guard:
+            lock = self._item_locks.get(id_qr)
+            if lock is None:
+                lock = self._item_locks[id_qr] = threading.Lock()
+            return lock
+
+    # ── Abonnés ──
+
+    def abonner(self, callback):
+        """callback(store, ids, cause) après chaque modification du stock.
+
+        ids : pièces touchées (ID normalisés), ou None si tout le stock a pu
+        changer (rechargement). cause : "sortie", "entree", "transfert",
+        "modification", "ajout", "suppression" ou "rechargement". L'appel
+        peut avoir lieu sous le verrou du store : l'abonné doit seulement
+        noter les pièces et les traiter ailleurs.
+        """
+        self._abonnes.append(callback)
+
+    def _signaler(self, ids, cause):
+        for callback in self._abonnes:
+            callback(self, ids, cause)
+
+    # ── Chargement / invalidation ──
+
+    def reload(self):
+        with self._lock:
+            version = self._stockage.stock_version()
+            self._table = StockTable.from_frame(self._stockage.load_stock())
+            self._indexer()
+            self._recherche = None
+            self._version = version
+            self._ecrites = {v for v in self._ecrites if v > version}
+            self._avancer()
+            self._generation += 1
+            self._stale = False
+            self._signaler(None, "rechargement")
+            return self._table.frame()
+
+    def _indexer(self):
+        self._index = {normalize_id(i): position for position, i in enumerate(self._table.ids)}
+
+    def _ensure_fresh(self):
+        # Relecture seulement si les données persistées ont changé ailleurs
+        if self._table is None or self._stale:
+            self.reload()
+            return
+        version = self._stockage.stock_version()
+        if version == self._version:
+            return
+        if storage.use_sqlite():
+            # Versions manquantes : écritures de ce processus pas encore
+            # reportées (le cache les recevra), sinon écriture d'ailleurs
+            if version > self._version:
+                inconnues = version - self._version - sum(1 for v in self._ecrites if v <= version)
+                if inconnues <= self._en_cours:
+                    return
+            self.reload()
+        elif self._stockage.is_own_write(version):
+            # Écriture différée ou compactage de ce processus : le cache
+            # contient déjà ces modifications
+            self._version = version
+        else:
+            self.reload()
+
+    def _note_write(self, versions):
+        """Enregistre une écriture faite par ce processus (version avant, après)."""
+        if versions is None:
+            return
+        before, after = versions
+        if storage.use_sqlite():
+            self._note_version(after)
+            return
+        with self._lock:
+            if before == self._version:
+                self._version = after
+            elif after == self._version:
+                # Déjà relu après cette écriture
+                return
+            else:
+                # Quelqu'un d'autre a écrit entre-temps : relire au prochain accès
+                self._stale = True
+
+    def _note_version(self, version):
+        """SQLite : version écrite par ce processus.
+
+        Le compteur de la base est incrémenté à chaque transaction, mais deux
+        threads peuvent valider dans un ordre et reporter dans l'autre : la
+        version du cache avance tant que les versions suivantes sont connues.
+        """
+        with self._lock:
+            if self._version is None or version <= self._version:
+                return
+            self._ecrites.add(version)
+            self._avancer()
+
+    def _avancer(self):
+        while self._version is not None and self._version + 1 in self._ecrites:
+            self._version += 1
+            self._ecrites.remove(self._version)
+
+    @contextmanager
+    def _ecriture(self):
+        """Écriture SQLite de ce processus, de la transaction au report dans le cache."""
+        with self._lock:
+            self._en_cours += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._en_cours -= 1
+
+    def _apply_quantites(self, quantites, version):
+        """Reporte dans le cache des quantités déjà écrites en base (SQLite)."""
+        with self._lock:
+            try:
+                positions = [self._index[i] for i in quantites]
+                self._table.definir_quantites(positions, list(quantites.values()))
+                self._generation += 1
+            except (KeyError, AttributeError):
+                # Cache absent ou pièce ajoutée par un autre processus
+                self._stale = True
+        self._note_version(version)
+
+    def _lignes(self, ids):
+        """Lignes des pièces à persister (pour storage.flush_stock)."""
+        with self._lock:
+            return self._table.lignes([self._index[i] for i in ids if i in self._index])
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Stock courant, vue en lecture seule sans copie (modifier via le store)."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._table.frame()
+
+    @property
+    def version(self):
+        """Clé de cache : version persistée + modifications en mémoire."""
+        return self._version, self._generation
+
+    def _position(self, id_qr):
+        try:
+            return self._index[id_qr]
+        except KeyError:
+            raise PieceInconnue(id_qr) from None
+
+    def _inserer(self, id_qr, designation, quantite, prix, seuil):
+        """Ajoute la pièce au cache (sous self._lock). Renvoie sa ligne (dict sans ID_QR)."""
+        idx = self._index[id_qr] = self._table.ajouter(id_qr, designation, quantite, prix, seuil)
+        self._generation += 1
+        ligne = {col: self._table.valeur(idx, col) for col in storage.STOCK_COLUMNS[1:]}
+        if self._recherche is not None:
+            self._recherche.ajouter(id_qr, ligne["Designation"])
+        return ligne
+
+    def _retirer(self, id_qr):
+        """Retire la pièce du cache (sous self._lock)."""
+        idx = self._position(id_qr)
+        # La dernière ligne prend la place de la pièce retirée
+        deplacee = self._table.supprimer(idx)
+        del self._index[id_qr]
+        if deplacee is not None:
+            self._index[normalize_id(deplacee)] = idx
+        if self._recherche is not None:
+            self._recherche.retirer(id_qr)
+        self._generation += 1
+
+    def __contains__(self, id_qr):
+        with self._lock:
+            self._ensure_fresh()
+            return normalize_id(id_qr) in self._index
+
+    def get(self, id_qr):
+        """Ligne de la pièce (Series) ou None."""
+        with self._lock:
+            self._ensure_fresh()
+            position = self._index.get(normalize_id(id_qr))
+            return None if position is None else self._table.ligne(position)
+
+    def seuils(self, ids):
+        """{ID_QR: (Designation, Quantite, Seuil_Alerte)} des pièces demandées encore présentes."""
+        with self._lock:
+            self._ensure_fresh()
+            valeur = self._table.valeur
+            return {i: (valeur(p, "Designation"), valeur(p, "Quantite"), valeur(p, "Seuil_Alerte"))
+                    for i, p in ((i, self._index.get(i)) for i in ids) if p is not None}
+
+    def rechercher(self, saisie, k=TOP_K):
+        """Pièces les plus proches d'une saisie (ID ou désignation) : [(ID_QR, Designation), ...]."""
+        with self._lock:
+            self._ensure_fresh()
+            if self._recherche is None:
+                df = self._table.frame()
+                self._recherche = IndexRecherche(df["ID_QR"].tolist(), df["Designation"].tolist())
+            index = self._recherche
+        # Hors du verrou du store : l'index a le sien
+        return index.rechercher(saisie, k)
+
+    # ── Vue d'inventaire ──
+
+    def vue(self) -> pd.DataFrame:
+        """Stock + Valeur_Totale_DH + Alerte, recalculé seulement si la version change."""
+        with self._lock:
+            self._ensure_fresh()
+            if self._vue is None or self._vue[0] != self.version:
+                df = self._table.frame()
+                vue = df.assign(Valeur_Totale_DH=df["Quantite"] * df["Prix_Unitaire_DH"],
+                                Alerte=df["Quantite"] <= df["Seuil_Alerte"])
+                if self._cles is None or self._cles[0] is not df:
+                    self._cles = (df, (df["ID_QR"].astype(str) + " " + df["Designation"].astype(str)).str.lower())
+                vue["_cle"] = self._cles[1]
+                self._vue = (self.version, vue)
+            return self._vue[1]
+
+    def page(self, recherche="", tri="ID_QR", decroissant=False, alertes_seules=False, page=1, taille=100):
+        """Une page de la vue filtrée/triée. Renvoie (page, nb lignes filtrées)."""
+        vue = self.vue()
+        cle = (recherche.strip().lower(), tri, decroissant, alertes_seules)
+        with self._lock:
+            if self._selection is None or self._selection[:2] != (cle, self._vue[0]):
+                masque = pd.Series(True, index=vue.index)
+                if cle[0]:
+                    masque &= vue["_cle"].str.contains(cle[0], regex=False)
+                if alertes_seules:
+                    masque &= vue["Alerte"]
+                ordre = vue.loc[masque, tri].sort_values(ascending=not decroissant, kind="stable").index
+                self._selection = (cle, self._vue[0], ordre)
+            ordre = self._selection[2]
+        debut = (max(page, 1) - 1) * taille
+        return vue.loc[ordre[debut:debut + taille]].drop(columns="_cle"), len(ordre)
+
+    # ── Mutations ──
+
+    def sortie(self, id_qr, qte, technicien, date_str=None):
+        """Retire qte unités et trace la sortie. Renvoie (designation, restant)."""
+        id_qr = normalize_id(id_qr)
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._item_lock(id_qr):
+            if storage.use_sqlite():
+                with self._ecriture():
+                    res = self._stockage.sortie_db(id_qr, qte, date_str, technicien)
+                    if res is None:
+                        raise PieceInconnue(id_qr)
+                    if res[0] is None:
+                        raise StockInsuffisant(id_qr, res[1])
+                    restant, designation, version = res
+                    self._apply_quantites({id_qr: restant}, version)
+                self._signaler([id_qr], "sortie")
+                return designation, restant
+
+            with self._lock:
+                self._ensure_fresh()
+                idx = self._position(id_qr)
+                stock_actuel = self._table.valeur(idx, "Quantite")
+                designation = self._table.valeur(idx, "Designation")
+                if stock_actuel < qte:
+                    raise StockInsuffisant(id_qr, stock_actuel)
+                self._table.modifier(idx, "Quantite", stock_actuel - qte)
+                self._generation += 1
+            self._stockage.mark_dirty(id_qr)
+            try:
+                self._note_write(self._stockage.flush_stock(self._lignes))
+            except Exception:
+                with self._lock:
+                    self._table.ajouter_quantites([self._position(id_qr)], [qte])
+                    self._generation += 1
+                raise
+            self._stockage.append_sortie(date_str, id_qr, designation, qte, technicien)
+            self._stockage.ecrire_mouvements([storage.mouvement("sortie", id_qr, -qte, {"Quantite": stock_actuel - qte},
+                                                                technicien, date_str)])
+            self._signaler([id_qr], "sortie")
+            return designation, stock_actuel - qte
+
+    def sortie_batch(self, items, technicien, date_str=None):
+        """Sortie groupée (panier), tout ou rien.
+
+        items : [(id_qr, qte), ...] ; un même ID peut apparaître plusieurs
+        fois. Toutes les quantités sont vérifiées avant d'écrire quoi que ce
+        soit ; le stock et l'historique sont écrits en une fois. Renvoie
+        [(id_qr, designation, qte, restant), ...].
+        """
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        panier = {}
+        for id_qr, qte in items:
+            id_qr = normalize_id(id_qr)
+            panier[id_qr] = panier.get(id_qr, 0) + int(qte)
+        ids = sorted(panier)
+
+        # Verrous pris dans un ordre fixe : pas d'interblocage entre paniers
+        with ExitStack() as stack:
+            for id_qr in ids:
+                stack.enter_context(self._item_lock(id_qr))
+
+            if storage.use_sqlite():
+                with self._ecriture():
+                    resultats, refus, version = self._stockage.sortie_batch_db(
+                        [(i, panier[i]) for i in ids], date_str, technicien)
+                    if refus:
+                        raise PanierRefuse([PieceInconnue(i) if q is None else StockInsuffisant(i, q)
+                                            for i, q in refus])
+                    self._apply_quantites({i: restant for i, _, restant in resultats}, version)
+                self._signaler(ids, "sortie")
+                return [(i, des, panier[i], restant) for i, des, restant in resultats]
+
+            with self._lock:
+                self._ensure_fresh()
+                erreurs, lignes = [], []
+                for id_qr in ids:
+                    label = self._index.get(id_qr)
+                    if label is None:
+                        erreurs.append(PieceInconnue(id_qr))
+                        continue
+                    stock_actuel = self._table.valeur(label, "Quantite")
+                    if stock_actuel < panier[id_qr]:
+                        erreurs.append(StockInsuffisant(id_qr, stock_actuel))
+                    lignes.append((id_qr, label, self._table.valeur(label, "Designation"), stock_actuel))
+                if erreurs:
+                    raise PanierRefuse(erreurs)
+                self._table.definir_quantites([label for _, label, _, _ in lignes],
+                                              [stock_actuel - panier[i] for i, _, _, stock_actuel in lignes])
+                self._generation += 1
+            for id_qr in ids:
+                self._stockage.mark_dirty(id_qr)
+            try:
+                self._note_write(self._stockage.flush_stock(self._lignes))
+            except Exception:
+                with self._lock:
+                    self._table.ajouter_quantites([label for _, label, _, _ in lignes],
+                                                  [panier[i] for i, _, _, _ in lignes])
+                    self._generation += 1
+                raise
+            self._stockage.append_sorties([(date_str, id_qr, des, panier[id_qr], technicien)
+                                    for id_qr, _, des, _ in lignes])
+            self._stockage.ecrire_mouvements([
+                storage.mouvement("sortie", id_qr, -panier[id_qr], {"Quantite": stock_actuel - panier[id_qr]},
+                                  technicien, date_str)
+                for id_qr, _, _, stock_actuel in lignes])
+            self._signaler(ids, "sortie")
+            return [(id_qr, des, panier[id_qr], stock_actuel - panier[id_qr])
+                    for id_qr, _, des, stock_actuel in lignes]
+
+    def entree(self, id_qr, qte, auteur=None):
+        """Ajoute qte unités. Renvoie la ligne à jour."""
+        id_qr = normalize_id(id_qr)
+        with self._item_lock(id_qr):
+            if storage.use_sqlite():
+                with self._ecriture():
+                    res = self._stockage.entree_db(id_qr, qte, auteur)
+                    if res is None:
+                        raise PieceInconnue(id_qr)
+                    quantite, version = res
+                    self._apply_quantites({id_qr: quantite}, version)
+                self._signaler([id_qr], "entree")
+                return self.get(id_qr)
+            with self._lock:
+                self._ensure_fresh()
+                idx = self._position(id_qr)
+                self._table.ajouter_quantites([idx], [qte])
+                self._generation += 1
+                row = self._table.ligne(idx)
+            self._stockage.mark_dirty(id_qr)
+            try:
+                self._note_write(self._stockage.flush_stock(self._lignes))
+            except Exception:
+                with self._lock:
+                    self._table.ajouter_quantites([self._position(id_qr)], [-qte])
+                    self._generation += 1
+                raise
+            self._stockage.ecrire_mouvements([storage.mouvement(
+                "entree", id_qr, qte, {"Quantite": int(row["Quantite"])}, auteur)])
+            self._signaler([id_qr], "entree")
+            return row
+
+    def preparer_reception(self, lignes: pd.DataFrame):
+        """Rapproche un bon de livraison (ID_QR, Quantite) du stock.
+
+        Renvoie (reception, inconnus) : reception a une ligne par pièce connue
+        (quantités cumulées) avec Designation, Prix_Unitaire_DH et Total_DH ;
+        inconnus liste les ID absents du stock.
+        """
+        lignes = lignes.assign(ID_QR=lignes["ID_QR"].map(normalize_id))
+        lignes = lignes.groupby("ID_QR", as_index=False, sort=False)["Quantite"].sum()
+        with self._lock:
+            self._ensure_fresh()
+            positions = lignes["ID_QR"].map(self._index)
+            connus = positions.notna()
+            infos = self._table.frame()[["Designation", "Prix_Unitaire_DH"]] \
+                .iloc[positions[connus].astype(int)].to_numpy()
+        reception = lignes[connus].reset_index(drop=True)
+        reception["Designation"] = infos[:, 0] if len(infos) else []
+        reception["Prix_Unitaire_DH"] = infos[:, 1].astype(float) if len(infos) else []
+        reception["Total_DH"] = reception["Quantite"] * reception["Prix_Unitaire_DH"]
+        return reception, list(lignes.loc[~connus, "ID_QR"])
+
+    def entree_batch(self, reception: pd.DataFrame, auteur=None):
+        """Ajoute toutes les quantités d'une réception (ID_QR, Quantite) en une écriture."""
+        ids = list(reception["ID_QR"])
+        qtes = [int(q) for q in reception["Quantite"]]
+        with ExitStack() as stack:
+            for id_qr in sorted(set(ids)):
+                stack.enter_context(self._item_lock(id_qr))
+            if storage.use_sqlite():
+                with self._ecriture():
+                    quantites, version = self._stockage.entree_batch_db(list(zip(ids, qtes)), auteur)
+                    self._apply_quantites(quantites, version)
+                self._signaler(list(quantites), "entree")
+                return
+            with self._lock:
+                self._ensure_fresh()
+                self._table.ajouter_quantites([self._position(i) for i in ids], qtes)
+                self._generation += 1
+                recues = {}
+                for id_qr, qte in zip(ids, qtes):
+                    recues[id_qr] = recues.get(id_qr, 0) + qte
+                mouvements = [storage.mouvement(
+                    "entree", id_qr, qte, {"Quantite": self._table.valeur(self._index[id_qr], "Quantite")}, auteur)
+                    for id_qr, qte in recues.items()]
+            for id_qr in ids:
+                self._stockage.mark_dirty(id_qr)
+            try:
+                self._note_write(self._stockage.flush_stock(self._lignes))
+            except Exception:
+                with self._lock:
+                    self._table.ajouter_quantites([self._position(i) for i in ids], [-q for q in qtes])
+                    self._generation += 1
+                raise
+            self._stockage.ecrire_mouvements(mouvements)
+            self._signaler(list(recues), "entree")
+
+    def transfert(self, id_qr, variation, valeurs, auteur=None):
+        """Quantité reçue d'un autre magasin (variation > 0) ou envoyée (< 0).
+
+        Pas de ligne d'historique des sorties : le mouvement "transfert" du
+        grand livre porte l'autre magasin (valeurs). Renvoie la quantité
+        après coup.
+        """
+        id_qr = normalize_id(id_qr)
+        with self._item_lock(id_qr):
+            if storage.use_sqlite():
+                with self._ecriture():
+                    res = self._stockage.transfert_db(id_qr, variation, valeurs, auteur)
+                    if res is None:
+                        raise PieceInconnue(id_qr)
+                    if res[0] is None:
+                        raise StockInsuffisant(id_qr, res[1])
+                    quantite, version = res
+                    self._apply_quantites({id_qr: quantite}, version)
+                self._signaler([id_qr], "transfert")
+                return quantite
+
+            with self._lock:
+                self._ensure_fresh()
+                idx = self._position(id_qr)
+                stock_actuel = self._table.valeur(idx, "Quantite")
+                if stock_actuel + variation < 0:
+                    raise StockInsuffisant(id_qr, stock_actuel)
+                self._table.ajouter_quantites([idx], [variation])
+                self._generation += 1
+            self._stockage.mark_dirty(id_qr)
+            try:
+                self._note_write(self._stockage.flush_stock(self._lignes))
+            except Exception:
+                with self._lock:
+                    self._table.ajouter_quantites([self._position(id_qr)], [-variation])
+                    self._generation += 1
+                raise
+            self._stockage.ecrire_mouvements([storage.mouvement(
+                "transfert", id_qr, variation, {"Quantite": stock_actuel + variation, **valeurs}, auteur)])
+            self._signaler([id_qr], "transfert")
+            return stock_actuel + variation
+
+    def update_piece(self, id_qr, auteur=None, **values):
+        """Modifie les colonnes données (Designation, Quantite, ...) d'une pièce."""
+        id_qr = normalize_id(id_qr)
+        with self._item_lock(id_qr):
+            with self._lock:
+                self._ensure_fresh()
+                idx = self._position(id_qr)
+                avant = {col: self._table.valeur(idx, col) for col in values}
+                for col, val in values.items():
+                    self._table.modifier(idx, col, val)
+                self._generation += 1
+                apres = {col: self._table.valeur(idx, col) for col in values}
+                modifiees = {col: v for col, v in apres.items() if v != avant[col]}
+                if "Designation" in modifiees and self._recherche is not None:
+                    self._recherche.ajouter(id_qr, modifiees["Designation"])
+                mouvements = []
+                if modifiees:
+                    variation = modifiees["Quantite"] - avant["Quantite"] if "Quantite" in modifiees else None
+                    mouvements.append(storage.mouvement("modification", id_qr, variation, modifiees, auteur))
+            self._stockage.mark_dirty(id_qr)
+            try:
+                with self._ecriture():
+                    self._note_write(self._stockage.flush_stock(self._lignes, mouvements))
+            except Exception:
+                with self._lock:
+                    idx = self._position(id_qr)
+                    for col, val in avant.items():
+                        self._table.modifier(idx, col, val)
+                    self._generation += 1
+                    if "Designation" in modifiees and self._recherche is not None:
+                        self._recherche.ajouter(id_qr, avant["Designation"])
+                self._stockage.mark_dirty(id_qr)
+                raise
+            self._signaler([id_qr], "modification")
+
+    def add_piece(self, id_qr, designation, quantite, prix, seuil, auteur=None):
+        id_qr = normalize_id(id_qr)
+        with self._item_lock(id_qr):
+            with self._lock:
+                self._ensure_fresh()
+                if id_qr in self._index:
+                    raise PieceExistante(id_qr)
+                ligne = self._inserer(id_qr, designation, quantite, prix, seuil)
+            self._stockage.mark_dirty(id_qr)
+            try:
+                with self._ecriture():
+                    self._note_write(self._stockage.flush_stock(
+                        self._lignes, [storage.mouvement("ajout", id_qr, ligne["Quantite"], ligne, auteur)]))
+            except Exception:
+                with self._lock:
+                    self._retirer(id_qr)
+                self._stockage.mark_deleted(id_qr)
+                raise
+            self._signaler([id_qr], "ajout")
+
+    def delete_piece(self, id_qr, auteur=None):
+        id_qr = normalize_id(id_qr)
+        with self._item_lock(id_qr):
+            with self._lock:
+                self._ensure_fresh()
+                ligne = {col: self._table.valeur(self._position(id_qr), col)
+                         for col in storage.STOCK_COLUMNS[1:]}
+                self._retirer(id_qr)
+            self._stockage.mark_deleted(id_qr)
+            try:
+                with self._ecriture():
+                    self._note_write(self._stockage.flush_stock(
+                        self._lignes, [storage.mouvement("suppression", id_qr, -ligne["Quantite"], None, auteur)]))
+            except Exception:
+                with self._lock:
+                    self._inserer(id_qr, *ligne.values())
+                self._stockage.mark_dirty(id_qr)
+                raise
+            self._signaler([id_qr], "suppression")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> StockStore:
+    """Store du magasin principal (partagé par toutes les sessions)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StockStore()
+        return _store
@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+
+# ─────────────────────────────────────────────
+# TABLE DE STOCK EN COLONNES COMPACTES
+# ─────────────────────────────────────────────
+# Colonnes numériques : tableaux numpy dont la capacité double quand ils
+# sont pleins (ajout en O(1) amorti), modifiés sur place :
+#   Quantite int32, Seuil_Alerte int32, Prix_Unitaire_DH float64 (en
+#   float32, les centimes se perdent au-delà de ~100 000 DH).
+# Chaînes : ID_QR et libellés de désignation dans un tableau de chaînes
+# compact (Arrow, installé avec Streamlit) ; les ajouts récents attendent
+# dans une liste et sont fusionnés à la construction de la vue. Chaque
+# ligne porte le code int32 de sa désignation (libellés factorisés au
+# chargement).
+# frame() renvoie un DataFrame en lecture seule qui partage la mémoire des
+# colonnes : une sortie y est visible sans copie, et il n'est reconstruit
+# qu'après un ajout, une suppression ou un changement de désignation.
+# Une suppression met la dernière ligne à la place de la ligne retirée :
+# pas de décalage des colonnes ni de réindexation complète, mais l'ordre
+# des lignes n'est plus celui du chargement. Si une vue partage encore les
+# colonnes numériques, elles sont d'abord copiées (copie à l'écriture, de
+# même pour un ajout qui reprend la place libérée) : une vue déjà
+# distribuée ne montre jamais les nombres d'une autre pièce.
+
+CAPACITE_MIN = 1024
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+_NUMERIQUES = {"Quantite": "_quantite", "Prix_Unitaire_DH": "_prix", "Seuil_Alerte": "_seuil"}
+_COLONNES = pd.Index(["ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH", "Seuil_Alerte"])
+
+
+def _entier(col, valeur):
+    valeur = int(valeur)
+    if not INT32_MIN <= valeur <= INT32_MAX:
+        raise ValueError(f"{col} hors limites : {valeur}")
+    return valeur
+
+
+class _Chaines:
+    """Tableau de chaînes compact + ajouts récents (liste Python) + retouches."""
+
+    def __init__(self, base=None):
+        self._base = pd.array([] if base is None else base, dtype="str")
+        self._n_base = len(self._base)   # lignes de _base encore utilisées
+        self._ajouts = []
+        self._retouches = {}             # position dans _base -> nouvelle valeur
+
+    def __len__(self):
+        return self._n_base + len(self._ajouts)
+
+    def __getitem__(self, i):
+        if i >= self._n_base:
+            return self._ajouts[i - self._n_base]
+        if i in self._retouches:
+            return self._retouches[i]
+        return self._base[i]
+
+    def __setitem__(self, i, valeur):
+        if i >= self._n_base:
+            self._ajouts[i - self._n_base] = valeur
+        else:
+            self._retouches[i] = valeur
+
+    def append(self, valeur):
+        self._ajouts.append(valeur)
+
+    def pop(self):
+        """Retire et renvoie la dernière valeur."""
+        if self._ajouts:
+            return self._ajouts.pop()
+        valeur = self[self._n_base - 1]
+        self._n_base -= 1
+        self._retouches.pop(self._n_base, None)
+        return valeur
+
+    def tableau(self):
+        if self._ajouts or self._retouches or self._n_base < len(self._base):
+            base = pd.Series(self._base[:self._n_base], copy=False)
+            if self._retouches:
+                base = base.copy()
+                base.iloc[list(self._retouches)] = list(self._retouches.values())
+            self._base = pd.concat([base, pd.Series(self._ajouts, dtype="str")], ignore_index=True).array
+            self._n_base = len(self._base)
+            self._ajouts = []
+            self._retouches = {}
+        return self._base
+
+
+class StockTable:
+    def __init__(self, capacite=CAPACITE_MIN):
+        self._n = 0
+        self._ids = _Chaines()
+        self._libelles = _Chaines()   # code -> désignation
+        self._codes_libelles = None   # désignation -> code, construit au premier besoin
+        self._codes = np.empty(capacite, dtype=np.int32)
+        self._quantite = np.empty(capacite, dtype=np.int32)
+        self._prix = np.empty(capacite, dtype=np.float64)
+        self._seuil = np.empty(capacite, dtype=np.int32)
+        self._frame = None
+        self._partagees = 0           # lignes des colonnes numériques vues par une frame() distribuée
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        """Table construite depuis un DataFrame au format STOCK_COLUMNS."""
+        n = len(df)
+        table = cls(max(CAPACITE_MIN, n + n // 4))
+        codes, libelles = pd.factorize(df["Designation"].fillna("").astype("str"))
+        table._ids = _Chaines(df["ID_QR"].astype("str").array)
+        table._libelles = _Chaines(libelles.array)
+        table._codes[:n] = codes
+        table._quantite[:n] = df["Quantite"].to_numpy(dtype=np.int64)
+        table._prix[:n] = df["Prix_Unitaire_DH"].to_numpy(dtype=np.float64)
+        table._seuil[:n] = df["Seuil_Alerte"].fillna(0).to_numpy(dtype=np.int64)
+        table._n = n
+        return table
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def ids(self):
+        """ID_QR de chaque ligne, dans l'ordre des positions."""
+        return self._ids.tableau()
+
+    def _agrandir(self):
+        capacite = 2 * len(self._codes)
+        for nom in ("_codes", "_quantite", "_prix", "_seuil"):
+            ancien = getattr(self, nom)
+            nouveau = np.empty(capacite, dtype=ancien.dtype)
+            nouveau[:self._n] = ancien[:self._n]
+            setattr(self, nom, nouveau)
+        self._partagees = 0
+
+    def _detacher(self):
+        """Copie les colonnes numériques si une vue distribuée les partage."""
+        if self._partagees:
+            for nom in _NUMERIQUES.values():
+                setattr(self, nom, getattr(self, nom).copy())
+            self._partagees = 0
+
+    def _code(self, designation):
+        """Code de la désignation ; un libellé déjà connu garde son code."""
+        libelle = "" if designation is None else str(designation)
+        if self._codes_libelles is None:
+            self._codes_libelles = {l: c for c, l in enumerate(self._libelles.tableau())}
+        code = self._codes_libelles.get(libelle)
+        if code is None:
+            code = self._codes_libelles[libelle] = len(self._libelles)
+            self._libelles.append(libelle)
+        return code
+
+    # ── Lecture ──
+
+    def valeur(self, position, col):
+        if col == "ID_QR":
+            return self._ids[position]
+        if col == "Designation":
+            return self._libelles[self._codes[position]]
+        return getattr(self, _NUMERIQUES[col])[position].item()
+
+    def ligne(self, position) -> pd.Series:
+        """Une ligne (copie), comme df.loc[position]."""
+        return pd.Series([self._ids[position], self._libelles[self._codes[position]],
+                          int(self._quantite[position]), float(self._prix[position]),
+                          int(self._seuil[position])], index=_COLONNES, dtype=object, name=position)
+
+    def lignes(self, positions) -> pd.DataFrame:
+        """Quelques lignes (copie), sans construire la vue complète."""
+        return pd.DataFrame([self.ligne(p).tolist() for p in positions], columns=_COLONNES)
+
+    def frame(self) -> pd.DataFrame:
+        """Vue DataFrame en lecture seule, partagée tant que la structure ne change pas."""
+        if self._frame is None:
+            n = self._n
+            self._frame = pd.DataFrame({
+                "ID_QR": pd.Series(self._ids.tableau(), copy=False),
+                "Designation": pd.Series(self._libelles.tableau().take(self._codes[:n]), copy=False),
+                "Quantite": self._quantite[:n],
+                "Prix_Unitaire_DH": self._prix[:n],
+                "Seuil_Alerte": self._seuil[:n],
+            }, copy=False)
+            self._partagees = n
+        return self._frame
+
+    # ── Modification ──
+
+    def modifier(self, position, col, valeur):
+        if col == "Designation":
+            if self.valeur(position, col) != valeur:
+                self._codes[position] = self._code(valeur)
+                self._frame = None
+        elif col == "Prix_Unitaire_DH":
+            self._prix[position] = float(valeur)
+        elif col in _NUMERIQUES:
+            getattr(self, _NUMERIQUES[col])[position] = _entier(col, valeur)
+        else:
+            raise KeyError(col)
+
+    def ajouter_quantites(self, positions, deltas):
+        """Quantite[positions] += deltas (une même position peut revenir plusieurs fois)."""
+        uniques, inverse = np.unique(np.asarray(positions, dtype=np.intp), return_inverse=True)
+        nouvelles = self._quantite[uniques].astype(np.int64)
+        np.add.at(nouvelles, inverse, np.asarray(deltas, dtype=np.int64))
+        if len(nouvelles) and (nouvelles.max() > INT32_MAX or nouvelles.min() < INT32_MIN):
+            raise ValueError("Quantite hors limites.")
+        self._quantite[uniques] = nouvelles
+
+    def definir_quantites(self, positions, quantites):
+        self._quantite[np.asarray(positions, dtype=np.intp)] = [_entier("Quantite", q) for q in quantites]
+
+    def ajouter(self, id_qr, designation, quantite, prix, seuil):
+        """Nouvelle ligne en fin de table. Renvoie sa position."""
+        valeurs = (_entier("Quantite", quantite), float(prix), _entier("Seuil_Alerte", seuil or 0))
+        if self._n == len(self._codes):
+            self._agrandir()
+        position = self._n
+        if position < self._partagees:
+            # Place libérée par une suppression, encore visible dans une vue
+            self._detacher()
+        self._ids.append(str(id_qr))
+        self._codes[position] = self._code(designation)
+        self._quantite[position], self._prix[position], self._seuil[position] = valeurs
+        self._n += 1
+        self._frame = None
+        return position
+
+    def supprimer(self, position):
+        """Retire une ligne : la dernière prend sa place.
+
+        O(1), plus une copie des colonnes numériques si une vue les partage.
+        Renvoie l'ID_QR de la ligne déplacée, None si c'était la dernière.
+        """
+        dernier = self._n - 1
+        id_dernier = self._ids.pop()
+        deplacee = None
+        if position != dernier:
+            self._detacher()
+            self._ids[position] = id_dernier
+            for nom in ("_codes", "_quantite", "_prix", "_seuil"):
+                tableau = getattr(self, nom)
+                tableau[position] = tableau[dernier]
+            deplacee = id_dernier
+        self._n -= 1
+        self._frame = None
+        return deplacee
@@ -0,0 +1,2343 @@
+import atexit
+import gzip
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+import zipfile
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.packaging.custom import IntProperty, StringProperty
+from openpyxl.utils.exceptions import InvalidFileException
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
+
+import exports
+from metrics import timed, taille_fichier, taille_resultat
+from verrous import VerrouFichier, ecrire_compteur, lire_compteur
+
+# ─────────────────────────────────────────────
+# CONFIGURATION
+# ─────────────────────────────────────────────
+
+# Fichiers du magasin, relatifs à son dossier (voir Stockage) : le magasin
+# principal les range dans le dossier courant.
+EXCEL_PATH = "stock_campus_emi.xlsx"
+DB_PATH = "stock_campus_emi.db"
+JOURNAL_PATH = "historique_journal.jsonl"
+
+# Compactage du journal vers Historique_Sorties : par lots ou périodiquement
+JOURNAL_BATCH_SIZE = 50
+JOURNAL_COMPACT_INTERVAL_S = 300
+
+# Backend Excel : les modifications du stock sont d'abord journalisées
+# (fsync) puis écrites dans le classeur par un thread, regroupées par lots
+PENDING_PATH = "stock_en_attente.jsonl"
+WRITE_BEHIND = os.environ.get("GMAO_WRITE_BEHIND", "1") != "0"
+WRITE_BEHIND_DELAY_S = 0.5
+WRITE_BEHIND_RETRY_S = 5
+
+# Grand livre des mouvements (backend Excel : fichiers à côté du classeur)
+# et point de stock complet tous les POINT_STOCK_MOUVEMENTS mouvements
+MOUVEMENTS_PATH = "mouvements_stock.jsonl"
+POINTS_STOCK_DIR = "points_stock"
+POINT_STOCK_MOUVEMENTS = 1000
+
+# Archives de l'historique : les mois clos quittent le classeur (ou la table)
+# pour des fichiers compressés ; seuls les HISTORIQUE_MOIS_VIVANTS derniers
+# mois complets et le mois en cours restent dans le stockage vivant
+ARCHIVES_DIR = "archives_historique"
+ARCHIVES_CATALOGUE = os.path.join(ARCHIVES_DIR, "catalogue.json")
+ARCHIVAGE = os.environ.get("GMAO_ARCHIVAGE", "1") != "0"
+HISTORIQUE_MOIS_VIVANTS = int(os.environ.get("GMAO_HISTORIQUE_MOIS", "3"))
+ARCHIVAGE_INTERVAL_S = 6 * 3600
+ARCHIVES_CACHE_FICHIERS = 24
+
+# "sqlite" : base SQLite (WAL) comme source de vérité, Excel en import/export
+# "excel"  : le classeur reste la base vivante (ancien fonctionnement)
+STORAGE_BACKEND = os.environ.get("GMAO_STORAGE", "sqlite").lower()
+
+# Techniciens autorisés à faire des sorties (formulaire et API de scan)
+TECHNICIENS = [
+    "HEDDIOUI HANANE",
+    "BELALLAM EL MEHDI",
+    "TAAMY TAYEB",
+    "ELBAJJAR ANDERAHIM",
+    "EL BAGARI JOUAD",
+    "MALKI RABIE",
+    "LGHZAL ABDELLAH",
+    "BELYAMANE YOUSSEF",
+    "ELHABCHI HOUSSINE",
+    "LAHBI TEHAMI",
+    "MOUHAH AZIZ",
+    "CHERKAOUI ALAA-EDDIN",
+    "LAHMAIRI AYOUB",
+    "OULAD LAMKASSE NOUR EDDINE",
+    "EL JLAYDI AYOUB",
+]
+
+STOCK_COLUMNS = ["ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH", "Seuil_Alerte"]
+HISTORIQUE_COLUMNS = ["Date", "ID_QR", "Designation", "Quantite_Sortie", "Technicien"]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Import des classeurs : colonnes obligatoires, taille des paquets de lignes
+# et nombre maximal d'anomalies détaillées
+STOCK_REQUIRED_COLUMNS = ["ID_QR", "Designation", "Quantite", "Prix_Unitaire_DH"]
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_MAX_ERREURS = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stock (
+    id_qr            TEXT PRIMARY KEY,
+    designation      TEXT,
+    quantite         INTEGER NOT NULL DEFAULT 0,
+    prix_unitaire_dh REAL    NOT NULL DEFAULT 0,
+    seuil_alerte     INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS historique_sorties (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    date            TEXT NOT NULL,
+    id_qr           TEXT,
+    designation     TEXT,
+    quantite_sortie INTEGER,
+    technicien      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_historique_date  ON historique_sorties(date);
+CREATE INDEX IF NOT EXISTS idx_historique_id_qr ON historique_sorties(id_qr);
+CREATE TABLE IF NOT EXISTS mouvements (
+    seq       INTEGER PRIMARY KEY AUTOINCREMENT,
+    date      TEXT NOT NULL,
+    type      TEXT NOT NULL,
+    id_qr     TEXT,
+    variation INTEGER,
+    valeurs   TEXT,
+    auteur    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mouvements_date  ON mouvements(date);
+CREATE INDEX IF NOT EXISTS idx_mouvements_id_qr ON mouvements(id_qr);
+CREATE TABLE IF NOT EXISTS points_stock (
+    seq   INTEGER PRIMARY KEY,
+    date  TEXT NOT NULL,
+    stock BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    cle    TEXT PRIMARY KEY,
+    valeur TEXT
+);
+CREATE TABLE IF NOT EXISTS alertes (
+    id_qr       TEXT PRIMARY KEY,
+    designation TEXT,
+    quantite    INTEGER,
+    seuil       INTEGER,
+    ouverte_le  TEXT NOT NULL
+);
+"""
+
+
+# Toute lecture-modification-écriture du classeur passe par son verrou,
+# partagé avec les autres processus (voir verrous) : aucun ne lit un
+# classeur à moitié sauvegardé. Ordre de prise : verrou du classeur, puis
+# celui du journal ou des modifications en attente.
+_verrous = {}
+_verrous_lock = threading.Lock()
+
+
+def _verrou(path):
+    """Verrou du fichier path (fichier path.lock), un seul par processus.
+
+    Les fonctions du module et le Stockage du magasin prennent le même :
+    un second flock du même processus sur le fichier attendrait le premier.
+    """
+    cle = os.path.normpath(path)
+    with _verrous_lock:
+        if cle not in _verrous:
+            _verrous[cle] = VerrouFichier(path + ".lock")
+        return _verrous[cle]
+
+
+def _thin_border():
+    return Border(left=Side(style="thin"), right=Side(style="thin"),
+                  top=Side(style="thin"), bottom=Side(style="thin"))
+
+
+# ─────────────────────────────────────────────
+# FONCTIONS EXCEL
+# ─────────────────────────────────────────────
+
+def _open_read_only(path):
+    try:
+        return load_workbook(path, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        raise ValueError(f"Fichier Excel illisible : {e}") from None
+
+
+def read_stock_header(path=EXCEL_PATH):
+    """En-tête de la feuille Stock, lu sur la première ligne sans charger le classeur."""
+    wb = _open_read_only(path)
+    try:
+        if "Stock" not in wb.sheetnames:
+            raise ValueError("Feuille 'Stock' introuvable.")
+        first = next(wb["Stock"].iter_rows(min_row=1, max_row=1, values_only=True), ())
+    finally:
+        wb.close()
+    header = ["" if c is None else str(c).strip() for c in first]
+    missing = [c for c in STOCK_REQUIRED_COLUMNS if c not in header]
+    if missing:
+        raise ValueError(f"Colonnes manquantes : {', '.join(missing)}")
+    return header
+
+
+def _excel_id(value):
+    # Même normalisation que la saisie/scan : sans espaces ni suffixe ".0"
+    if value is None:
+        return ""
+    return re.sub(r"\.0$", "", str(value).replace(" ", ""))
+
+
+def _excel_number(value, cast):
+    """(valeur, ok) : cellule vide -> 0, texte non numérique -> 0 et ok=False."""
+    if value is None or value == "":
+        return cast(0), True
+    try:
+        return cast(float(value.strip().replace(",", ".")) if isinstance(value, str) else value), True
+    except (TypeError, ValueError):
+        return cast(0), False
+
+
+def iter_stock_chunks(path=EXCEL_PATH, chunk_rows=IMPORT_CHUNK_ROWS, erreurs=None):
+    """Lignes de la feuille Stock, lues en flux par paquets de DataFrames.
+
+    Les anomalies sont ajoutées à erreurs avec le numéro de ligne Excel ; les
+    doublons d'ID_QR sont ignorés (la première ligne l'emporte).
+    """
+    erreurs = [] if erreurs is None else erreurs
+    n_erreurs = 0
+
+    def signaler(message):
+        nonlocal n_erreurs
+        n_erreurs += 1
+        if n_erreurs <= IMPORT_MAX_ERREURS:
+            erreurs.append(message)
+
+    wb = _open_read_only(path)
+    try:
+        rows = wb["Stock"].iter_rows(values_only=True)
+        header = ["" if c is None else str(c).strip() for c in next(rows, ())]
+        pos = {c: header.index(c) for c in STOCK_COLUMNS if c in header}
+        if "ID_QR" not in pos:
+            return
+
+        def cell(values, col):
+            i = pos.get(col)
+            return values[i] if i is not None and i < len(values) else None
+
+        vus = {}
+        chunk = []
+        for ligne, values in enumerate(rows, start=2):
+            id_qr = _excel_id(cell(values, "ID_QR"))
+            if id_qr in ("", "TOTAL", "nan", "None"):
+                if id_qr == "" and any(v is not None for v in values):
+                    signaler(f"Ligne {ligne} : ID_QR vide, ligne ignorée.")
+                continue
+            if id_qr in vus:
+                signaler(f"Ligne {ligne} : {id_qr} déjà présent ligne {vus[id_qr]}, ligne ignorée.")
+                continue
+            vus[id_qr] = ligne
+            record = [id_qr, cell(values, "Designation") or ""]
+            for col, cast in (("Quantite", int), ("Prix_Unitaire_DH", float), ("Seuil_Alerte", int)):
+                valeur, ok = _excel_number(cell(values, col), cast)
+                if not ok:
+                    signaler(f"Ligne {ligne} : {col} invalide ({cell(values, col)!r}), remplacé par 0.")
+                record.append(valeur)
+            chunk.append(record)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=STOCK_COLUMNS)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=STOCK_COLUMNS)
+    finally:
+        wb.close()
+        if n_erreurs > IMPORT_MAX_ERREURS:
+            erreurs.append(f"… et {n_erreurs - IMPORT_MAX_ERREURS} autre(s) ligne(s) en anomalie.")
+
+
+@timed("excel.load_stock", octets=taille_fichier(0, "path", EXCEL_PATH))
+def load_stock_from_excel(path=EXCEL_PATH):
+    # Sous le verrou des écritures : jamais de lecture d'un classeur à moitié sauvegardé
+    with _verrou(path):
+        chunks = list(iter_stock_chunks(path))
+    if not chunks:
+        return pd.DataFrame({"ID_QR": pd.Series(dtype=str), "Designation": pd.Series(dtype=object),
+                             "Quantite": pd.Series(dtype=int), "Prix_Unitaire_DH": pd.Series(dtype=float),
+                             "Seuil_Alerte": pd.Series(dtype=int)})
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _write_stock_row(ws, r_idx, row, border, alt_fill):
+    seuil = int(getattr(row, "Seuil_Alerte", 0) or 0)
+    values = [str(row.ID_QR), row.Designation, int(row.Quantite),
+              float(row.Prix_Unitaire_DH), f"=C{r_idx}*D{r_idx}", seuil]
+    for c_idx, val in enumerate(values, 1):
+        cell = ws.cell(r_idx, c_idx, val)
+        cell.border = border
+        cell.font = Font(name="Arial", size=10)
+        cell.alignment = Alignment(horizontal="center" if c_idx != 2 else "left")
+        cell.fill = alt_fill if r_idx % 2 == 0 else PatternFill()
+
+
+def _write_total_row(ws, total_row, border):
+    ws.cell(total_row, 1, "TOTAL").font = Font(bold=True, name="Arial")
+    ws.cell(total_row, 1).border = border
+    total_cell = ws.cell(total_row, 5, f"=SUM(E2:E{total_row-1})")
+    total_cell.font = Font(bold=True, name="Arial", color="2E4057")
+    total_cell.border = border
+    total_cell.alignment = Alignment(horizontal="center")
+    for c in [2, 3, 4, 6]:
+        ws.cell(total_row, c).border = border
+
+
+def _clear_row(ws, r_idx):
+    for c_idx in range(1, 7):
+        cell = ws.cell(r_idx, c_idx)
+        cell.value = None
+        cell.style = "Normal"
+
+
+def _write_stock_rows(ws, df: pd.DataFrame):
+    border = _thin_border()
+    alt_fill = PatternFill("solid", start_color="EAF0FB")
+
+    # Réécrire ligne par ligne (colonnes essentielles uniquement)
+    for r_idx, row in enumerate(df.itertuples(index=False), start=2):
+        _write_stock_row(ws, r_idx, row, border, alt_fill)
+
+    _write_total_row(ws, len(df) + 2, border)
+
+
+def _stock_row_map(ws):
+    """ID_QR -> numéro de ligne Excel, et numéro de la ligne TOTAL (lecture colonne A)."""
+    rows, total_row = {}, None
+    for r_idx, (val,) in enumerate(ws.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+        if val is None:
+            continue
+        # Clé lue comme au chargement : 12345.0 ou "P 01" retrouvent leur ligne
+        key = _excel_id(val)
+        if key == "TOTAL":
+            total_row = r_idx
+            break
+        # Doublon : le chargement garde la première ligne, l'écriture aussi
+        rows.setdefault(key, r_idx)
+    if total_row is None:
+        total_row = max(rows.values(), default=1) + 1
+    return rows, total_row
+
+
+def _save_stock_delta(ws, df: pd.DataFrame, changed, deleted):
+    border = _thin_border()
+    alt_fill = PatternFill("solid", start_color="EAF0FB")
+    rows, total_row = _stock_row_map(ws)
+    last_row = total_row - 1
+    by_id = df.set_index(df["ID_QR"].astype(str))
+    n_before = len(rows)
+
+    # Suppression : la dernière ligne prend la place de la ligne supprimée
+    for id_qr in deleted:
+        r_idx = rows.pop(str(id_qr), None)
+        if r_idx is None:
+            continue
+        if r_idx != last_row:
+            moved_id = next(k for k, v in rows.items() if v == last_row)
+            rows[moved_id] = r_idx
+            if moved_id in by_id.index:
+                if moved_id not in changed:
+                    changed = set(changed) | {moved_id}
+            else:
+                # Pièce absente de df (lot d'écritures différées) : recopiée depuis la feuille
+                ids_val, des, qte, prix, _, seuil = (ws.cell(last_row, c).value for c in range(1, 7))
+                _write_stock_row(ws, r_idx, SimpleNamespace(
+                    ID_QR=ids_val, Designation=des, Quantite=qte or 0,
+                    Prix_Unitaire_DH=prix or 0.0, Seuil_Alerte=seuil or 0), border, alt_fill)
+        _clear_row(ws, last_row)
+        last_row -= 1
+
+    # Modification sur place, ajout en fin de tableau
+    for id_qr in changed:
+        id_qr = str(id_qr)
+        if id_qr not in by_id.index:
+            continue
+        r_idx = rows.get(id_qr)
+        if r_idx is None:
+            last_row += 1
+            r_idx = rows[id_qr] = last_row
+        row = next(by_id.loc[[id_qr]].itertuples(index=False))
+        _write_stock_row(ws, r_idx, row, border, alt_fill)
+
+    # Ligne TOTAL uniquement si le nombre de lignes a changé
+    if len(rows) != n_before:
+        if total_row > last_row + 1:
+            _clear_row(ws, total_row)
+        _write_total_row(ws, last_row + 1, border)
+
+
+@timed("excel.save_stock", octets=taille_fichier(1, "path", EXCEL_PATH))
+def save_stock_to_excel(df: pd.DataFrame, path=EXCEL_PATH, changed=None, deleted=()):
+    """Sauvegarde la feuille Stock.
+
+    Sans ``changed``, toute la feuille est réécrite ; sinon seules les lignes
+    des ID_QR modifiés/ajoutés (``changed``) ou supprimés (``deleted``) sont
+    touchées.
+    """
+    with _verrou(path):
+        wb = load_workbook(path)
+        ws = wb["Stock"]
+
+        if changed is not None:
+            _save_stock_delta(ws, df, set(changed), set(deleted))
+            wb.save(path)
+            return
+
+        # Effacer les anciennes données
+        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
+            for cell in row:
+                cell.value = None
+
+        _write_stock_rows(ws, df)
+        wb.save(path)
+
+
+def _write_header(ws, headers, widths):
+    header_fill = PatternFill("solid", start_color="2E4057")
+    header_font = Font(bold=True, color="FFFFFF", name="Arial", size=11)
+    border = _thin_border()
+    for col, (h, w) in enumerate(zip(headers, widths), 1):
+        cell = ws.cell(row=1, column=col, value=h)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal="center")
+        cell.border = border
+        ws.column_dimensions[get_column_letter(col)].width = w
+
+
+def _add_historique_sheet(wb, index=None):
+    ws2 = wb.create_sheet("Historique_Sorties", index)
+    _write_header(ws2, HISTORIQUE_COLUMNS, [22, 12, 35, 18, 25])
+    return ws2
+
+
+def ensure_historique_sheet(path=EXCEL_PATH):
+    # Lecture seule : on ne charge le classeur complet que si la feuille manque
+    with _verrou(path):
+        wb = load_workbook(path, read_only=True)
+        sheetnames = wb.sheetnames
+        wb.close()
+        if "Historique_Sorties" not in sheetnames:
+            wb = load_workbook(path)
+            _add_historique_sheet(wb)
+            wb.save(path)
+
+
+def _write_sortie_row(ws, row_idx, values):
+    border = _thin_border()
+    for c_idx, val in enumerate(values, 1):
+        cell = ws.cell(row_idx, c_idx, val)
+        cell.border = border
+        cell.font = Font(name="Arial", size=10)
+        if row_idx % 2 == 0:
+            cell.fill = PatternFill("solid", start_color="EAF0FB")
+
+
+@timed("excel.append_sortie", octets=taille_fichier(5, "path", EXCEL_PATH))
+def append_sortie_to_excel(date_str, id_qr, designation, qte, technicien, path=EXCEL_PATH):
+    with _verrou(path):
+        wb = load_workbook(path)
+        ws = wb["Historique_Sorties"]
+        _write_sortie_row(ws, ws.max_row + 1, [date_str, id_qr, designation, qte, technicien])
+        wb.save(path)
+
+
+@timed("excel.load_historique", octets=taille_fichier(0, "path", EXCEL_PATH))
+def load_historique_from_excel(path=EXCEL_PATH):
+    with _verrou(path):
+        return pd.read_excel(path, sheet_name="Historique_Sorties", engine="openpyxl")
+
+
+# Noms de colonnes acceptés dans un bon de livraison fournisseur
+BON_LIVRAISON_COLUMNS = {
+    "ID_QR": ["id_qr", "id", "reference", "référence", "ref"],
+    "Quantite": ["quantite", "quantité", "qte", "qté", "quantite_recue", "quantité reçue"],
+}
+
+
+@timed("excel.read_bon_livraison", octets=lambda args, kwargs, result: len(args[0]))
+def read_bon_livraison(data: bytes, filename: str):
+    """Lit un bon de livraison CSV/XLSX. Renvoie (lignes ID_QR/Quantite, erreurs)."""
+    if filename.lower().endswith(".csv"):
+        df = pd.read_csv(io.BytesIO(data), sep=None, engine="python", dtype=str)
+    else:
+        df = pd.read_excel(io.BytesIO(data), engine="openpyxl", dtype=str)
+    noms = {str(c).strip().lower(): c for c in df.columns}
+    colonnes = {}
+    for cible, alias in BON_LIVRAISON_COLUMNS.items():
+        trouve = next((noms[a] for a in [cible.lower()] + alias if a in noms), None)
+        if trouve is None:
+            return pd.DataFrame(columns=["ID_QR", "Quantite"]), [f"Colonne '{cible}' introuvable."]
+        colonnes[trouve] = cible
+    df = df[list(colonnes)].rename(columns=colonnes)
+    df["Ligne"] = df.index + 2
+    df["ID_QR"] = df["ID_QR"].fillna("").astype(str).str.replace(" ", "").str.replace(r"\.0$", "", regex=True)
+    df["Quantite"] = pd.to_numeric(df["Quantite"], errors="coerce")
+    bad = (df["ID_QR"] == "") | df["Quantite"].isna() | (df["Quantite"] <= 0)
+    erreurs = [f"Ligne {r.Ligne} ignorée : ID ou quantité invalide." for r in df[bad].itertuples()]
+    ok = df[~bad]
+    return ok.assign(Quantite=ok["Quantite"].astype(int))[["ID_QR", "Quantite"]].reset_index(drop=True), erreurs
+
+
+def _stock_rows_flux(ws, df: pd.DataFrame):
+    """Lignes de la feuille Stock pour un classeur write_only (même mise en forme)."""
+    # Styles préparés une fois : (colonne, ligne paire) -> style
+    styles = {(c_idx, pair): exports.style(ws, exports.TEXTE_FONT, exports.ALTERNE_FILL if pair else None,
+                                           exports.CENTRE if c_idx != 2 else exports.GAUCHE, exports.BORDURE)
+              for c_idx in range(1, 7) for pair in (False, True)}
+    n = 1
+    for n, row in enumerate(df.itertuples(index=False), start=2):
+        seuil = int(getattr(row, "Seuil_Alerte", 0) or 0)
+        values = [str(row.ID_QR), row.Designation, int(row.Quantite),
+                  float(row.Prix_Unitaire_DH), f"=C{n}*D{n}", seuil]
+        yield [exports.cellule(ws, val, style=styles[c_idx, n % 2 == 0]) for c_idx, val in enumerate(values, 1)]
+    total = n + 1
+    yield [exports.cellule(ws, "TOTAL", Font(bold=True, name="Arial"), border=exports.BORDURE),
+           exports.cellule(ws, None, border=exports.BORDURE),
+           exports.cellule(ws, None, border=exports.BORDURE),
+           exports.cellule(ws, None, border=exports.BORDURE),
+           exports.cellule(ws, f"=SUM(E2:E{total - 1})", Font(bold=True, name="Arial", color="2E4057"),
+                           alignment=exports.CENTRE, border=exports.BORDURE),
+           exports.cellule(ws, None, border=exports.BORDURE)]
+
+
+def _sortie_rows_flux(ws, df_hist: pd.DataFrame):
+    styles = {pair: exports.style(ws, exports.TEXTE_FONT, exports.ALTERNE_FILL if pair else None,
+                                  border=exports.BORDURE) for pair in (False, True)}
+    valeurs = df_hist[HISTORIQUE_COLUMNS].astype(object)
+    valeurs = valeurs.where(df_hist[HISTORIQUE_COLUMNS].notna(), None)
+    for r_idx, row in enumerate(valeurs.itertuples(index=False, name=None), start=2):
+        yield [exports.cellule(ws, val, style=styles[r_idx % 2 == 0]) for val in row]
+
+
+@timed("excel.export_classeur", octets=taille_resultat)
+def build_workbook_bytes(df_stock: pd.DataFrame, df_hist: pd.DataFrame) -> bytes:
+    """Produit un classeur Stock + Historique_Sorties à partir des données (écrit en flux)."""
+    return exports.classeur([
+        ("Stock", STOCK_COLUMNS[:4] + ["Valeur_Totale_DH", "Seuil_Alerte"], [12, 35, 12, 18, 18, 14],
+         lambda ws: _stock_rows_flux(ws, df_stock)),
+        ("Historique_Sorties", HISTORIQUE_COLUMNS, [22, 12, 35, 18, 25],
+         lambda ws: _sortie_rows_flux(ws, df_hist)),
+    ])
+
+
+# ─────────────────────────────────────────────
+# JOURNAL DES SORTIES (backend Excel)
+# ─────────────────────────────────────────────
+# Chaque sortie est ajoutée en une ligne JSON (fsync) ; le compactage
+# recopie les lignes en attente dans Historique_Sorties en une seule
+# sauvegarde du classeur. Le dernier numéro compacté est stocké dans les
+# propriétés du classeur, ce qui rend le compactage rejouable sans doublon.
+# Le verrou du journal est partagé entre processus, et son fichier porte le
+# dernier numéro attribué : deux processus ne donnent jamais le même
+# numéro, et le compactage ne perd pas les lignes ajoutées par un autre.
+
+
+def _read_journal_entries(journal_path):
+    if not os.path.exists(journal_path):
+        return []
+    entries = []
+    with open(journal_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Dernière ligne tronquée par un arrêt brutal
+                continue
+    return entries
+
+
+def _rewrite_jsonl(path, entries):
+    """Remplace un fichier JSONL (fichier temporaire + fsync + renommage)."""
+    # Nom unique : deux processus ne partagent jamais le fichier temporaire
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                               dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _compacted_seq(path=EXCEL_PATH):
+    if not os.path.exists(path):
+        return 0
+    wb = load_workbook(path, read_only=True)
+    props = wb.custom_doc_props
+    seq = props["journal_seq"].value if "journal_seq" in props.names else 0
+    wb.close()
+    return seq
+
+
+# ─────────────────────────────────────────────
+# FONCTIONS SQLITE
+# ─────────────────────────────────────────────
+
+_local = threading.local()
+
+
+def _stock_params(df: pd.DataFrame):
+    return [(str(r.ID_QR), r.Designation, int(r.Quantite), float(r.Prix_Unitaire_DH),
+             int(r.Seuil_Alerte or 0)) for r in df[STOCK_COLUMNS].itertuples(index=False)]
+
+
+def _date_key(value):
+    """Date au format trié de la table (AAAA-MM-JJ HH:MM:SS)."""
+    ts = pd.to_datetime(value, errors="coerce")
+    return str(value) if pd.isna(ts) else ts.strftime(DATE_FORMAT)
+
+
+def _history_filters(start=None, end=None, technicien=None, id_qr=None):
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("date >= ?")
+        params.append(_date_key(start))
+    if end is not None:
+        clauses.append("date < ?")
+        params.append(_date_key(end))
+    if technicien:
+        clauses.append("technicien = ?")
+        params.append(technicien)
+    if id_qr:
+        clauses.append("id_qr = ?")
+        params.append(str(id_qr))
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+
+# ─────────────────────────────────────────────
+# GRAND LIVRE DES MOUVEMENTS
+# ─────────────────────────────────────────────
+# Chaque modification du stock (sortie, entrée, transfert, ajout,
+# modification, suppression, import) est un mouvement numéroté qui porte les valeurs de
+# la ligne après coup (Quantite, ou colonnes modifiées) : rejouer deux fois
+# le même mouvement ne change rien. Un point de stock est l'état complet
+# après un mouvement (JSON compressé). Tous les POINT_STOCK_MOUVEMENTS
+# mouvements, un thread calcule un nouveau point à partir du précédent et
+# des mouvements qui suivent, sans toucher au stock vivant. Le stock à une
+# date = dernier point avant cette date + les mouvements suivants jusqu'à
+# cette date.
+#
+# SQLite : tables mouvements et points_stock, écrites dans la même
+# transaction que le stock. Excel : MOUVEMENTS_PATH (JSONL, fsync) et un
+# fichier par point dans POINTS_STOCK_DIR, nommé seq_date_position (position
+# du mouvement suivant dans MOUVEMENTS_PATH : la relecture part de là).
+
+MOUVEMENT_COLUMNS = ["Date", "Type", "ID_QR", "Variation", "Valeurs", "Auteur"]
+
+
+def mouvement(type_, id_qr, variation=None, valeurs=None, auteur=None, date_str=None):
+    """Un mouvement du grand livre (dict), daté de maintenant par défaut."""
+    return {"Date": date_str or time.strftime(DATE_FORMAT), "Type": type_, "ID_QR": str(id_qr),
+            "Variation": None if variation is None else int(variation), "Valeurs": valeurs, "Auteur": auteur}
+
+
+def _encoder_point(rows):
+    return gzip.compress(json.dumps(rows, ensure_ascii=False).encode("utf-8"), compresslevel=6)
+
+
+def _decoder_point(data):
+    return json.loads(gzip.decompress(data))
+
+
+def _lignes_point(df: pd.DataFrame):
+    return [[str(r.ID_QR), None if pd.isna(r.Designation) else str(r.Designation), int(r.Quantite),
+             float(r.Prix_Unitaire_DH), int(r.Seuil_Alerte or 0)]
+            for r in df[STOCK_COLUMNS].itertuples(index=False)]
+
+
+# ── SQLite ──
+
+
+def _point_import_db(conn):
+    """Mouvement "import" + point du stock importé (transaction en cours)."""
+    date_str = time.strftime(DATE_FORMAT)
+    seq = conn.execute("INSERT INTO mouvements (date, type) VALUES (?, 'import')", (date_str,)).lastrowid
+    rows = conn.execute("SELECT id_qr, designation, quantite, prix_unitaire_dh, seuil_alerte "
+                        "FROM stock ORDER BY rowid").fetchall()
+    conn.execute("INSERT OR REPLACE INTO points_stock (seq, date, stock) VALUES (?, ?, ?)",
+                 (seq, date_str, _encoder_point([list(r) for r in rows])))
+
+
+# ── Excel (fichiers) ──
+
+def _reparer_fin_jsonl(path):
+    """Coupe une dernière ligne tronquée (arrêt brutal) avant d'ajouter à la suite."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        taille = f.tell()
+        f.seek(max(0, taille - 65536))
+        fin = f.read()
+        if fin and not fin.endswith(b"\n"):
+            f.truncate(taille - len(fin) + fin.rfind(b"\n") + 1)
+
+
+def _dernier_seq_jsonl(path):
+    """Numéro de la dernière ligne complète (lecture de la fin du fichier seulement)."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 65536))
+        lignes = f.read().splitlines()
+    for ligne in reversed(lignes):
+        try:
+            return json.loads(ligne)["seq"]
+        except (ValueError, KeyError):
+            continue
+    return 0
+
+
+def _taille_fichier(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _taille_classeur(args, kwargs, result):
+    """Taille du classeur du Stockage appelé (args[0]), pour timed."""
+    return _taille_fichier(args[0].excel_path)
+
+
+# ─────────────────────────────────────────────
+# ARCHIVES DE L'HISTORIQUE
+# ─────────────────────────────────────────────
+# Les sorties des mois clos (avant les HISTORIQUE_MOIS_VIVANTS derniers
+# mois complets) quittent Historique_Sorties, ou la table
+# historique_sorties, pour des fichiers CSV compressés (gzip) dans
+# ARCHIVES_DIR, un par mois : chaque load_workbook ne paie plus que les
+# mois récents.
+#
+# Le catalogue (catalogue.json) décrit chaque fichier : mois, première et
+# dernière date, nombre de lignes. Une requête sur une plage de dates ne
+# lit que les archives qui la recoupent. Un fichier n'est jamais réécrit
+# (des sorties anciennes arrivées plus tard, par import, vont dans un
+# fichier suivant du même mois) : une fois lu, il reste en cache.
+#
+# Ordre d'écriture : fichiers, puis catalogue (point de validation), puis
+# retrait des lignes du stockage vivant, qui note la coupure atteinte. Une
+# rotation interrompue entre les deux est terminée au passage suivant sans
+# rien archiver deux fois. Les sorties étant datées du jour, le classeur
+# marqué ne reçoit rien d'antérieur à sa coupure : une période entièrement
+# archivée ne le relit pas (un classeur importé, sans marque, est relu
+# jusqu'à la rotation suivante). Le classeur téléchargé reste le classeur
+# vivant ; les rapports par période lisent les archives.
+
+
+
+def coupure_archives(maintenant=None):
+    """Début du plus ancien mois gardé dans le stockage vivant (format DATE_FORMAT)."""
+    mois = pd.Timestamp(maintenant or pd.Timestamp.now()).to_period("M") - HISTORIQUE_MOIS_VIVANTS
+    return mois.start_time.strftime(DATE_FORMAT)
+
+
+def _ecrire_fichier(path, data: bytes):
+    """Remplace un fichier (fichier temporaire + fsync + renommage)."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _date_keys(dates: pd.Series) -> pd.Series:
+    """Dates au format trié de l'historique (NaN si illisible)."""
+    texte = dates.astype(str)
+    ts = pd.to_datetime(texte, format=DATE_FORMAT, errors="coerce")
+    autres = ts.isna() & dates.notna()
+    if autres.any():
+        ts[autres] = pd.to_datetime(texte[autres], format="mixed", errors="coerce")
+    return ts.dt.strftime(DATE_FORMAT)
+
+
+def _avec_archives(archives, df):
+    if archives.empty:
+        return df
+    if df.empty:
+        return archives
+    return pd.concat([archives, df], ignore_index=True)
+
+
+def _coupure_classeur(path=EXCEL_PATH):
+    wb = load_workbook(path, read_only=True)
+    props = wb.custom_doc_props
+    marque = props["archive_coupure"].value if "archive_coupure" in props.names else ""
+    wb.close()
+    return marque
+
+
+# ─────────────────────────────────────────────
+# API COMMUNE (selon STORAGE_BACKEND)
+# ─────────────────────────────────────────────
+
+def use_sqlite():
+    return STORAGE_BACKEND == "sqlite"
+
+
+# ─────────────────────────────────────────────
+# ÉCRITURE DIFFÉRÉE DU STOCK (backend Excel)
+# ─────────────────────────────────────────────
+# Une modification est acquittée dès qu'elle est dans PENDING_PATH (état
+# complet de la ligne, ou suppression, avec fsync). Le thread d'écriture
+# attend WRITE_BEHIND_DELAY_S pour regrouper les rafales, puis fait une
+# seule sauvegarde du classeur pour toutes les pièces en attente (le
+# dernier état de chaque pièce l'emporte). Au démarrage, les entrées
+# restées dans le fichier sont rejouées ; à l'arrêt, tout est écrit.
+# Comme pour le journal des sorties, le verrou est partagé entre processus
+# et son fichier porte le dernier numéro attribué : une sauvegarde ne
+# retire du fichier que les entrées qu'elle a écrites (ou remplacées).
+
+
+def _ligne_pending(row):
+    return {"ID_QR": str(row.ID_QR), "Designation": row.Designation, "Quantite": int(row.Quantite),
+            "Prix_Unitaire_DH": float(row.Prix_Unitaire_DH), "Seuil_Alerte": int(row.Seuil_Alerte)}
+
+
+def _apply_pending(df, pending):
+    """Stock lu dans le classeur + modifications en attente."""
+    if not pending:
+        return df
+    ids = df["ID_QR"].astype(str)
+    maj = pd.DataFrame([l for l in pending.values() if l is not None], columns=STOCK_COLUMNS)
+    if len(maj):
+        par_id = maj.set_index("ID_QR")
+        present = ids.isin(par_id.index)
+        for col in STOCK_COLUMNS[1:]:
+            df.loc[present, col] = ids[present].map(par_id[col]).to_numpy()
+        df = pd.concat([df, maj[~maj["ID_QR"].isin(ids)]], ignore_index=True)
+    supprimes = [i for i, l in pending.items() if l is None]
+    if supprimes:
+        df = df[~df["ID_QR"].astype(str).isin(supprimes)].reset_index(drop=True)
+    return df
+
+
+def _filter_historique(df, start=None, end=None, technicien=None, id_qr=None):
+    """Filtrage en mémoire (backend Excel)."""
+    df = df.dropna(how="all")
+    dates = pd.to_datetime(df["Date"], errors="coerce")
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= dates >= pd.Timestamp(start)
+    if end is not None:
+        mask &= dates < pd.Timestamp(end)
+    if technicien:
+        mask &= df["Technicien"] == technicien
+    if id_qr:
+        mask &= df["ID_QR"].astype(str) == str(id_qr)
+    return df[mask].reset_index(drop=True)
+
+
+def _since(df, start):
+    df = df[["Date", "ID_QR", "Quantite_Sortie"]]
+    if start is not None:
+        df = df[pd.to_datetime(df["Date"], errors="coerce") >= pd.Timestamp(start)]
+    return df.reset_index(drop=True)
+
+
+def _rollup(df, by):
+    df = df.assign(Quantite_Sortie=pd.to_numeric(df["Quantite_Sortie"], errors="coerce").fillna(0))
+    agg = {"Nb_Sorties": ("Quantite_Sortie", "size"), "Quantite_Totale": ("Quantite_Sortie", "sum")}
+    if by == "ID_QR":
+        agg["Designation"] = ("Designation", "max")
+    return (df.groupby(by, as_index=False).agg(**agg)
+              .sort_values("Quantite_Totale", ascending=False, ignore_index=True))
+
+
+def _remplacer_feuille_stock(df: pd.DataFrame, path=EXCEL_PATH):
+    """Nouvelle feuille Stock dans le classeur vivant.
+
+    Historique_Sorties et les propriétés du classeur (journal_seq,
+    archive_coupure) restent en place.
+    """
+    wb = load_workbook(path)
+    index = 0
+    if "Stock" in wb.sheetnames:
+        index = wb.sheetnames.index("Stock")
+        wb.remove(wb["Stock"])
+    ws = wb.create_sheet("Stock", index)
+    wb.active = index
+    _write_header(ws, STOCK_COLUMNS[:4] + ["Valeur_Totale_DH", "Seuil_Alerte"], [12, 35, 12, 18, 18, 14])
+    _write_stock_rows(ws, df)
+    wb.save(path)
+
+
+# ─────────────────────────────────────────────
+# STOCKAGE D'UN MAGASIN
+# ─────────────────────────────────────────────
+# Un Stockage porte tout l'état d'un magasin : ses fichiers (rangés dans son
+# dossier), ses verrous, files d'attente, caches et threads ; l'activité
+# d'un magasin ne bloque jamais les autres. Le backend, l'écriture différée
+# et l'archivage sont ceux du module (STORAGE_BACKEND, WRITE_BEHIND,
+# ARCHIVAGE). Le magasin principal (dossier courant) est `principal`, dont
+# les méthodes publiques restent des fonctions du module.
+
+
+class Stockage:
+    """Stockage d'un magasin dont les fichiers sont dans dossier ("" : dossier courant)."""
+
+    def __init__(self, dossier=""):
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        self.dossier = dossier
+        self.excel_path = os.path.join(dossier, EXCEL_PATH)
+        self.db_path = os.path.join(dossier, DB_PATH)
+        self.journal_path = os.path.join(dossier, JOURNAL_PATH)
+        self.pending_path = os.path.join(dossier, PENDING_PATH)
+        self.mouvements_path = os.path.join(dossier, MOUVEMENTS_PATH)
+        self.points_stock_dir = os.path.join(dossier, POINTS_STOCK_DIR)
+        self.archives_dir = os.path.join(dossier, ARCHIVES_DIR)
+        self.archives_catalogue = os.path.join(dossier, ARCHIVES_CATALOGUE)
+        self._excel_lock = _verrou(self.excel_path)
+        self._initialised = False
+
+        # Journal des sorties
+        self._journal_lock = _verrou(self.journal_path)
+        self._journal_state = {"seq": None, "pending": 0, "last_compact": 0.0}
+        self._compaction_thread = None
+
+        # Grand livre des mouvements
+        self._ledger_lock = threading.Lock()     # ajouts à mouvements_path
+        self._ledger_state = {"seq": None, "depuis_point": 0}
+        self._points_lock = threading.Lock()
+        self._points_event = threading.Event()
+        self._points_thread = None
+
+        # Archives : _archives_lock est tenu pendant une rotation et pendant les
+        # lectures qui assemblent archives et stockage vivant (pris avant
+        # _excel_lock)
+        self._archives_lock = threading.RLock()
+        self._archives_cache = OrderedDict()     # fichier -> DataFrame, du moins au plus récent
+        self._catalogue_cache = None             # ((mtime, taille) du catalogue, catalogue)
+        self._coupure_cache = None               # (version du classeur, coupure notée dedans)
+        self._archivage_thread = None
+
+        # Lignes modifiées depuis la dernière sauvegarde
+        self._dirty_lock = threading.Lock()
+        self._dirty_ids = set()
+        self._deleted_ids = set()
+        self._flush_lock = threading.Lock()
+
+        # Écriture différée
+        self._pending_lock = _verrou(self.pending_path)
+        self._pending = {}              # ID_QR -> ligne (dict), None si supprimée
+        self._pending_seq = {}          # ID_QR -> numéro de sa dernière entrée dans pending_path
+        self._pending_state = {"seq": 0, "derniere": None, "erreur": None}
+        self._writer_lock = threading.Lock()
+        self._writer_event = threading.Event()
+        self._writer_thread = None
+        self._persist_listeners = []
+        self._versions_ecrites = deque(maxlen=16)   # mtimes produits par ce processus
+
+    # ── JOURNAL DES SORTIES (backend Excel) ──
+
+    def _init_journal_state(self):
+        """Numérotation du journal, lue une fois.
+
+        Le classeur est lu sous _excel_lock (l'écrivain peut être en train de
+        le sauvegarder), pris avant _journal_lock : ne pas appeler sous ce dernier.
+        """
+        if self._journal_state["seq"] is not None:
+            return
+        with self._excel_lock:
+            compacte = _compacted_seq(self.excel_path)
+            with self._journal_lock as verrou:
+                self._init_journal_seq(compacte, lire_compteur(verrou))
+
+    def _init_journal_seq(self, compacte, compteur):
+        if self._journal_state["seq"] is None:
+            entries = _read_journal_entries(self.journal_path)
+            # Les numéros continuent après ceux déjà compactés dans le classeur
+            # (le compteur du verrou a pu être perdu par un arrêt brutal)
+            self._journal_state["seq"] = max(max((e["seq"] for e in entries), default=0), compacte, compteur)
+            self._journal_state["pending"] = len(entries)
+            self._journal_state["last_compact"] = time.time()
+
+    @timed("journal.append")
+    def append_sorties_to_journal(self, rows):
+        """Ajoute plusieurs sorties (Date, ID_QR, Designation, Qte, Technicien), un seul fsync."""
+        self._init_journal_state()
+        with self._journal_lock as verrou:
+            # Numéro relu sous le verrou : un autre processus a pu en attribuer depuis
+            seq = max(self._journal_state["seq"], lire_compteur(verrou))
+            lines = []
+            for date_str, id_qr, designation, qte, technicien in rows:
+                seq += 1
+                entry = {"seq": seq, "Date": date_str, "ID_QR": str(id_qr),
+                         "Designation": designation, "Quantite_Sortie": int(qte),
+                         "Technicien": technicien}
+                lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            ecrire_compteur(verrou, seq)
+            self._journal_state["seq"] = seq
+            self._journal_state["pending"] += len(lines)
+            return self._journal_state["pending"]
+
+    def append_sortie_to_journal(self, date_str, id_qr, designation, qte, technicien):
+        return self.append_sorties_to_journal([(date_str, id_qr, designation, qte, technicien)])
+
+    def load_journal(self):
+        entries = _read_journal_entries(self.journal_path)
+        return pd.DataFrame(entries, columns=HISTORIQUE_COLUMNS)
+
+    @timed("excel.compact_journal", octets=_taille_classeur)
+    def compact_journal(self):
+        """Recopie le journal dans Historique_Sorties (une sauvegarde) et le vide.
+
+        Le verrou du journal n'est pas gardé pendant la sauvegarde : les sorties
+        continuent d'y être ajoutées et restent dans le journal après compactage.
+        """
+        versions = None
+        with self._excel_lock:
+            with self._journal_lock:
+                entries = _read_journal_entries(self.journal_path)
+            if entries and not os.path.exists(self.excel_path):
+                return 0
+            done = 0
+            if entries:
+                wb = load_workbook(self.excel_path)
+                if "Historique_Sorties" in wb.sheetnames:
+                    ws = wb["Historique_Sorties"]
+                else:
+                    ws = _add_historique_sheet(wb)
+                props = wb.custom_doc_props
+                done = props["journal_seq"].value if "journal_seq" in props.names else 0
+                todo = [e for e in entries if e["seq"] > done]
+                if todo:
+                    before = self.stock_version()
+                    next_row = ws.max_row + 1
+                    for r_idx, e in enumerate(todo, start=next_row):
+                        _write_sortie_row(ws, r_idx, [e[c] for c in HISTORIQUE_COLUMNS])
+                    done = todo[-1]["seq"]
+                    if "journal_seq" in props.names:
+                        props["journal_seq"].value = done
+                    else:
+                        props.append(IntProperty(name="journal_seq", value=done))
+                    wb.save(self.excel_path)
+                    # La feuille Stock n'a pas changé : le cache reste valable
+                    versions = (before, self.stock_version())
+                    self._versions_ecrites.append(versions[1])
+            # Sous le verrou du classeur : un lecteur voit la feuille et le
+            # journal tous deux avant, ou tous deux après le compactage
+            with self._journal_lock:
+                restants = [e for e in _read_journal_entries(self.journal_path) if e["seq"] > done]
+                _rewrite_jsonl(self.journal_path, restants)
+                self._journal_state["pending"] = len(restants)
+                self._journal_state["last_compact"] = time.time()
+        if versions is not None:
+            self._notify_persist(versions)
+        return len(entries)
+
+    def compact_journal_if_due(self):
+        self._init_journal_state()
+        with self._journal_lock:
+            pending = self._journal_state["pending"]
+            age = time.time() - self._journal_state["last_compact"]
+        if pending >= JOURNAL_BATCH_SIZE or (pending and age >= JOURNAL_COMPACT_INTERVAL_S):
+            self.compact_journal()
+
+    def _compaction_loop(self):
+        while True:
+            time.sleep(JOURNAL_COMPACT_INTERVAL_S)
+            try:
+                self.compact_journal_if_due()
+            except Exception:
+                # Le journal reste intact, nouvel essai au prochain passage
+                pass
+
+    def start_journal_compaction(self):
+        """Lance (une fois par processus) le compactage périodique du journal."""
+        if self._compaction_thread is None:
+            self._compaction_thread = threading.Thread(target=self._compaction_loop, daemon=True)
+            self._compaction_thread.start()
+
+    # ── FONCTIONS SQLITE ──
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Connexion SQLite (une par thread et par fichier), en mode WAL."""
+        conns = getattr(_local, "conns", None)
+        if conns is None:
+            conns = _local.conns = {}
+        conn = conns.get(self.db_path)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            conns[self.db_path] = conn
+        return conn
+
+    def _bump_stock_version(self, conn):
+        """Incrémente le numéro de version du stock (dans la transaction en cours)."""
+        self._pending_state["derniere"] = time.time()
+        conn.execute("INSERT OR IGNORE INTO meta (cle, valeur) VALUES ('stock_version', '0')")
+        (version,) = conn.execute(
+            "UPDATE meta SET valeur = CAST(valeur AS INTEGER) + 1 "
+            "WHERE cle = 'stock_version' RETURNING CAST(valeur AS INTEGER)").fetchone()
+        return version
+
+    def stock_version_db(self):
+        conn = self.get_connection()
+        row = conn.execute("SELECT CAST(valeur AS INTEGER) FROM meta WHERE cle = 'stock_version'").fetchone()
+        return row[0] if row else 0
+
+    @timed("sqlite.load_stock")
+    def load_stock_from_db(self):
+        conn = self.get_connection()
+        df = pd.read_sql_query(
+            "SELECT id_qr, designation, quantite, prix_unitaire_dh, seuil_alerte "
+            "FROM stock ORDER BY rowid", conn)
+        df.columns = STOCK_COLUMNS
+        df["Quantite"] = df["Quantite"].astype(int)
+        df["Prix_Unitaire_DH"] = df["Prix_Unitaire_DH"].astype(float)
+        df["Seuil_Alerte"] = df["Seuil_Alerte"].astype(int)
+        return df
+
+    @timed("sqlite.write_stock")
+    def write_stock_changes_db(self, df_rows: pd.DataFrame, deleted=(), mouvements=()):
+        """Upsert des lignes de df_rows et suppression de deleted, en une transaction.
+
+        Les mouvements du grand livre sont écrits dans la même transaction.
+        Renvoie (version avant, version après), lues dans cette transaction.
+        """
+        conn = self.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT CAST(valeur AS INTEGER) FROM meta WHERE cle = 'stock_version'").fetchone()
+            before = row[0] if row else 0
+            conn.executemany(
+                "INSERT INTO stock (id_qr, designation, quantite, prix_unitaire_dh, seuil_alerte) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id_qr) DO UPDATE SET designation = excluded.designation, "
+                "quantite = excluded.quantite, prix_unitaire_dh = excluded.prix_unitaire_dh, "
+                "seuil_alerte = excluded.seuil_alerte",
+                _stock_params(df_rows))
+            conn.executemany("DELETE FROM stock WHERE id_qr = ?", [(str(i),) for i in deleted])
+            self._inserer_mouvements(conn, mouvements)
+            after = self._bump_stock_version(conn)
+            conn.commit()
+            return before, after
+        except Exception:
+            conn.rollback()
+            raise
+
+    def replace_stock_db(self, df: pd.DataFrame):
+        return self.replace_stock_db_chunks([df])[1]
+
+    def replace_stock_db_chunks(self, chunks):
+        """Remplace le stock par des paquets de lignes, en une seule transaction.
+
+        Le remplacement est un mouvement "import" du grand livre, avec un point
+        de stock au même numéro. Renvoie (nb lignes, version).
+        """
+        conn = self.get_connection()
+        n = 0
+        with conn:
+            conn.execute("DELETE FROM stock")
+            for df in chunks:
+                conn.executemany(
+                    "INSERT INTO stock (id_qr, designation, quantite, prix_unitaire_dh, seuil_alerte) "
+                    "VALUES (?, ?, ?, ?, ?)", _stock_params(df))
+                n += len(df)
+            _point_import_db(conn)
+            return n, self._bump_stock_version(conn)
+
+    @timed("sqlite.entree")
+    def entree_db(self, id_qr, qte, auteur=None):
+        """Incrément atomique de la quantité. Renvoie (quantite, version) ou None."""
+        conn = self.get_connection()
+        with conn:
+            row = conn.execute("UPDATE stock SET quantite = quantite + ? WHERE id_qr = ? "
+                               "RETURNING quantite", (int(qte), str(id_qr))).fetchone()
+            if row is None:
+                return None
+            self._inserer_mouvements(conn, [mouvement("entree", id_qr, qte, {"Quantite": row[0]}, auteur)])
+            return row[0], self._bump_stock_version(conn)
+
+    @timed("sqlite.entree_batch")
+    def entree_batch_db(self, items, auteur=None):
+        """Incréments de plusieurs pièces en une transaction.
+
+        items : [(id_qr, qte), ...]. Renvoie ({id_qr: quantite}, version).
+        """
+        conn = self.get_connection()
+        quantites = {}
+        with conn:
+            for id_qr, qte in items:
+                row = conn.execute("UPDATE stock SET quantite = quantite + ? WHERE id_qr = ? "
+                                   "RETURNING quantite", (int(qte), str(id_qr))).fetchone()
+                if row is not None:
+                    quantites[id_qr] = row[0]
+                    self._inserer_mouvements(conn, [mouvement("entree", id_qr, qte, {"Quantite": row[0]}, auteur)])
+            return quantites, self._bump_stock_version(conn)
+
+    @timed("sqlite.transfert")
+    def transfert_db(self, id_qr, variation, valeurs, auteur=None):
+        """Variation de quantité d'un transfert entre magasins (sans ligne d'historique).
+
+        valeurs : informations du mouvement (magasin d'origine ou de
+        destination). Mêmes retours que sortie_db, sans la désignation :
+        (quantite, version), (None, quantite_actuelle) ou None.
+        """
+        conn = self.get_connection()
+        with conn:
+            row = conn.execute(
+                "UPDATE stock SET quantite = quantite + ? WHERE id_qr = ? AND quantite + ? >= 0 "
+                "RETURNING quantite", (int(variation), str(id_qr), int(variation))).fetchone()
+            if row is None:
+                current = conn.execute("SELECT quantite FROM stock WHERE id_qr = ?",
+                                       (str(id_qr),)).fetchone()
+                return None if current is None else (None, current[0])
+            self._inserer_mouvements(conn, [mouvement("transfert", id_qr, int(variation),
+                                                 {"Quantite": row[0], **valeurs}, auteur)])
+            return row[0], self._bump_stock_version(conn)
+
+    @timed("sqlite.sortie")
+    def sortie_db(self, id_qr, qte, date_str, technicien):
+        """Décrément atomique (compare-and-swap sur la quantité) + ligne d'historique.
+
+        Renvoie (quantite_restante, designation, version) si la sortie est faite,
+        (None, quantite_actuelle, None) si le stock est insuffisant et None si la
+        pièce est inconnue.
+        """
+        conn = self.get_connection()
+        with conn:
+            row = conn.execute(
+                "UPDATE stock SET quantite = quantite - ? WHERE id_qr = ? AND quantite >= ? "
+                "RETURNING quantite, designation", (int(qte), str(id_qr), int(qte))).fetchone()
+            if row is None:
+                current = conn.execute("SELECT quantite FROM stock WHERE id_qr = ?",
+                                       (str(id_qr),)).fetchone()
+                return None if current is None else (None, current[0], None)
+            conn.execute(
+                "INSERT INTO historique_sorties (date, id_qr, designation, quantite_sortie, technicien) "
+                "VALUES (?, ?, ?, ?, ?)", (date_str, str(id_qr), row[1], int(qte), technicien))
+            self._inserer_mouvements(conn, [mouvement("sortie", id_qr, -int(qte), {"Quantite": row[0]},
+                                                      technicien, date_str)])
+            return row[0], row[1], self._bump_stock_version(conn)
+
+    @timed("sqlite.sortie_batch")
+    def sortie_batch_db(self, items, date_str, technicien):
+        """Sorties de plusieurs pièces en une transaction, tout ou rien.
+
+        items : [(id_qr, qte), ...] avec des ID distincts. Renvoie
+        (resultats, refus, version) : resultats = [(id_qr, designation, restant)]
+        si tout est passé, sinon refus = [(id_qr, quantite_actuelle ou None)] et
+        rien n'est écrit.
+        """
+        conn = self.get_connection()
+        resultats, refus = [], []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for id_qr, qte in items:
+                row = conn.execute(
+                    "UPDATE stock SET quantite = quantite - ? WHERE id_qr = ? AND quantite >= ? "
+                    "RETURNING quantite, designation", (int(qte), str(id_qr), int(qte))).fetchone()
+                if row is None:
+                    current = conn.execute("SELECT quantite FROM stock WHERE id_qr = ?",
+                                           (str(id_qr),)).fetchone()
+                    refus.append((id_qr, None if current is None else current[0]))
+                else:
+                    resultats.append((id_qr, row[1], row[0]))
+            if refus:
+                conn.rollback()
+                return [], refus, None
+            conn.executemany(
+                "INSERT INTO historique_sorties (date, id_qr, designation, quantite_sortie, technicien) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(date_str, str(id_qr), des, int(qte), technicien)
+                 for (id_qr, qte), (_, des, _) in zip(items, resultats)])
+            self._inserer_mouvements(conn, [
+                mouvement("sortie", id_qr, -int(qte), {"Quantite": restant}, technicien, date_str)
+                for (id_qr, qte), (_, _, restant) in zip(items, resultats)])
+            version = self._bump_stock_version(conn)
+            conn.commit()
+            return resultats, [], version
+        except Exception:
+            conn.rollback()
+            raise
+
+    def append_sortie_to_db(self, date_str, id_qr, designation, qte, technicien):
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO historique_sorties (date, id_qr, designation, quantite_sortie, technicien) "
+                "VALUES (?, ?, ?, ?, ?)", (date_str, str(id_qr), designation, int(qte), technicien))
+
+    def load_historique_from_db(self):
+        conn = self.get_connection()
+        df = pd.read_sql_query(
+            "SELECT date, id_qr, designation, quantite_sortie, technicien "
+            "FROM historique_sorties ORDER BY id", conn)
+        df.columns = HISTORIQUE_COLUMNS
+        return df
+
+    @timed("sqlite.query_historique")
+    def query_historique_db(self, start=None, end=None, technicien=None, id_qr=None):
+        """Sorties de [start, end) ; seule la plage demandée est lue (index sur la date)."""
+        where, params = _history_filters(start, end, technicien, id_qr)
+        df = pd.read_sql_query(
+            "SELECT date, id_qr, designation, quantite_sortie, technicien "
+            f"FROM historique_sorties{where} ORDER BY date, id", self.get_connection(), params=params)
+        df.columns = HISTORIQUE_COLUMNS
+        return df
+
+    def rollup_historique_db(self, by, start=None, end=None):
+        """Nombre de sorties et quantité totale par technicien ou par pièce."""
+        col = {"Technicien": "technicien", "ID_QR": "id_qr"}[by]
+        extra = ", MAX(designation)" if col == "id_qr" else ""
+        where, params = _history_filters(start, end)
+        df = pd.read_sql_query(
+            f"SELECT {col}, COUNT(*), SUM(quantite_sortie){extra} FROM historique_sorties{where} "
+            f"GROUP BY {col} ORDER BY SUM(quantite_sortie) DESC", self.get_connection(), params=params)
+        df.columns = [by, "Nb_Sorties", "Quantite_Totale"] + (["Designation"] if extra else [])
+        return df
+
+    def historique_depuis_db(self, curseur=0, start=None):
+        """Sorties d'id > curseur (et de date >= start). Renvoie (df, curseur, complet)."""
+        conn = self.get_connection()
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM historique_sorties").fetchone()[0]
+        # Historique remplacé entre-temps : on repart du début
+        complet = curseur == 0 or max_id < curseur
+        if complet:
+            curseur = 0
+        where, params = _history_filters(start)
+        where = (where + " AND" if where else " WHERE") + " id > ?"
+        df = pd.read_sql_query(
+            f"SELECT date, id_qr, quantite_sortie FROM historique_sorties{where} ORDER BY id",
+            conn, params=params + [curseur])
+        df.columns = ["Date", "ID_QR", "Quantite_Sortie"]
+        return df, max(max_id, curseur), complet
+
+    def replace_historique_db(self, df_hist: pd.DataFrame):
+        df_hist = df_hist.dropna(how="all")
+        rows = [(_date_key(r.Date), str(r.ID_QR), r.Designation,
+                 int(r.Quantite_Sortie) if pd.notna(r.Quantite_Sortie) else 0, r.Technicien)
+                for r in df_hist.reindex(columns=HISTORIQUE_COLUMNS).itertuples(index=False)]
+        conn = self.get_connection()
+        with conn:
+            conn.execute("DELETE FROM historique_sorties")
+            conn.executemany(
+                "INSERT INTO historique_sorties (date, id_qr, designation, quantite_sortie, technicien) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def import_excel_to_db(self):
+        """Remplace le contenu de la base par celui du classeur (Stock + historique)."""
+        self.replace_stock_db_chunks(iter_stock_chunks(self.excel_path))
+        try:
+            df_hist = load_historique_from_excel(self.excel_path)
+        except ValueError:
+            # Feuille Historique_Sorties absente
+            df_hist = pd.DataFrame(columns=HISTORIQUE_COLUMNS)
+        self.replace_historique_db(df_hist)
+        self._set_source_excel()
+
+    def _set_source_excel(self):
+        conn = self.get_connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (cle, valeur) VALUES ('source_excel', ?)",
+                         (os.path.abspath(self.excel_path),))
+
+    def migrate_excel_if_needed(self):
+        """Migration automatique au premier démarrage : base vide + classeur présent."""
+        conn = self.get_connection()
+        migrated = conn.execute("SELECT 1 FROM meta WHERE cle = 'source_excel'").fetchone()
+        if migrated or not os.path.exists(self.excel_path):
+            return False
+        if conn.execute("SELECT COUNT(*) FROM stock").fetchone()[0]:
+            return False
+        self.import_excel_to_db()
+        return True
+
+    # ── GRAND LIVRE DES MOUVEMENTS ──
+
+    def _mouvements_ajoutes(self, n):
+        # Compteur indicatif (par processus) : le thread des points relit la base
+        self._ledger_state["depuis_point"] += n
+        if self._ledger_state["depuis_point"] >= POINT_STOCK_MOUVEMENTS:
+            self._points_event.set()
+
+    def _inserer_mouvements(self, conn, mouvements):
+        """Écrit les mouvements dans la transaction en cours."""
+        if not mouvements:
+            return
+        conn.executemany(
+            "INSERT INTO mouvements (date, type, id_qr, variation, valeurs, auteur) VALUES (?, ?, ?, ?, ?, ?)",
+            [(m["Date"], m["Type"], m["ID_QR"], m["Variation"],
+              None if m["Valeurs"] is None else json.dumps(m["Valeurs"], ensure_ascii=False), m["Auteur"])
+             for m in mouvements])
+        self._mouvements_ajoutes(len(mouvements))
+
+    def _points_db(self):
+        return [(seq, date, None) for seq, date in
+                self.get_connection().execute("SELECT seq, date FROM points_stock ORDER BY seq")]
+
+    def _lire_point_db(self, seq):
+        return _decoder_point(self.get_connection().execute(
+            "SELECT stock FROM points_stock WHERE seq = ?", (seq,)).fetchone()[0])
+
+    def _mouvements_db(self, apres):
+        """Mouvements de numéro > apres, dans l'ordre : (mouvement, None)."""
+        cur = self.get_connection().execute(
+            "SELECT seq, date, type, id_qr, variation, valeurs, auteur FROM mouvements WHERE seq > ? ORDER BY seq",
+            (apres,))
+        for seq, date, type_, id_qr, variation, valeurs, auteur in cur:
+            yield {"seq": seq, "Date": date, "Type": type_, "ID_QR": id_qr, "Variation": variation,
+                   "Valeurs": None if valeurs is None else json.loads(valeurs), "Auteur": auteur}, None
+
+    def _ecrire_point_db(self, seq, date_str, rows, position=None):
+        conn = self.get_connection()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO points_stock (seq, date, stock) VALUES (?, ?, ?)",
+                         (seq, date_str, _encoder_point(rows)))
+
+    def _init_grand_livre_db(self):
+        """Premier point : le stock actuel, après le dernier mouvement."""
+        conn = self.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM points_stock LIMIT 1").fetchone() is None:
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM mouvements").fetchone()[0]
+                rows = conn.execute("SELECT id_qr, designation, quantite, prix_unitaire_dh, seuil_alerte "
+                                    "FROM stock ORDER BY rowid").fetchall()
+                conn.execute("INSERT INTO points_stock (seq, date, stock) VALUES (?, ?, ?)",
+                             (seq, time.strftime(DATE_FORMAT), _encoder_point([list(r) for r in rows])))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _init_ledger_state(self):
+        if self._ledger_state["seq"] is None:
+            seq = 0
+            if os.path.exists(self.mouvements_path):
+                _reparer_fin_jsonl(self.mouvements_path)
+                seq = _dernier_seq_jsonl(self.mouvements_path)
+            self._ledger_state["seq"] = max([seq] + [p[0] for p in self._points_excel()])
+
+    def _append_mouvements_excel(self, mouvements):
+        if not mouvements:
+            return
+        with self._ledger_lock:
+            self._init_ledger_state()
+            lines = []
+            for m in mouvements:
+                self._ledger_state["seq"] += 1
+                lines.append(json.dumps({"seq": self._ledger_state["seq"], **m}, ensure_ascii=False) + "\n")
+            with open(self.mouvements_path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+        self._mouvements_ajoutes(len(mouvements))
+
+    def _points_excel(self):
+        """[(seq, date, position dans mouvements_path)] dans l'ordre des numéros."""
+        if not os.path.isdir(self.points_stock_dir):
+            return []
+        points = []
+        for nom in os.listdir(self.points_stock_dir):
+            m = re.fullmatch(r"(\d+)_(\d{14})_(\d+)\.json\.gz", nom)
+            if m:
+                d = m.group(2)
+                points.append((int(m.group(1)), f"{d[:4]}-{d[4:6]}-{d[6:8]} {d[8:10]}:{d[10:12]}:{d[12:]}",
+                               int(m.group(3))))
+        return sorted(points)
+
+    def _lire_point_excel(self, seq):
+        for nom in os.listdir(self.points_stock_dir):
+            if nom.startswith(f"{seq:010d}_"):
+                with open(os.path.join(self.points_stock_dir, nom), "rb") as f:
+                    return _decoder_point(f.read())
+        raise FileNotFoundError(f"Point de stock {seq} introuvable.")
+
+    def _mouvements_excel(self, apres, position=0):
+        """Mouvements de numéro > apres lus depuis position : (mouvement, position suivante)."""
+        if not os.path.exists(self.mouvements_path):
+            return
+        with open(self.mouvements_path, "rb") as f:
+            f.seek(position or 0)
+            position = f.tell()
+            for ligne in f:
+                if not ligne.endswith(b"\n"):
+                    # Ligne en cours d'écriture
+                    return
+                position += len(ligne)
+                try:
+                    m = json.loads(ligne)
+                except ValueError:
+                    continue
+                if m["seq"] > apres:
+                    yield m, position
+
+    def _ecrire_point_excel(self, seq, date_str, rows, position):
+        os.makedirs(self.points_stock_dir, exist_ok=True)
+        nom = f"{seq:010d}_{re.sub(r'[^0-9]', '', date_str)}_{position}.json.gz"
+        chemin = os.path.join(self.points_stock_dir, nom)
+        tmp = chemin + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_encoder_point(rows))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, chemin)
+
+    def _init_grand_livre_excel(self):
+        with self._ledger_lock:
+            self._init_ledger_state()
+            if not self._points_excel():
+                self._ecrire_point_excel(self._ledger_state["seq"], time.strftime(DATE_FORMAT),
+                                         _lignes_point(self.load_stock()), _taille_fichier(self.mouvements_path))
+
+    def _point_import_excel(self):
+        """Mouvement "import" + point du classeur qui vient d'être installé."""
+        rows = _lignes_point(self.load_stock())
+        with self._ledger_lock:
+            self._init_ledger_state()
+            self._ledger_state["seq"] += 1
+            m = mouvement("import", "")
+            ligne = (json.dumps({"seq": self._ledger_state["seq"], **m}, ensure_ascii=False) + "\n").encode("utf-8")
+            # Le point existe avant son mouvement : qui lit le mouvement trouve le point
+            self._ecrire_point_excel(self._ledger_state["seq"], m["Date"], rows,
+                                     _taille_fichier(self.mouvements_path) + len(ligne))
+            with open(self.mouvements_path, "ab") as f:
+                f.write(ligne)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _points(self):
+        return self._points_db() if use_sqlite() else self._points_excel()
+
+    def _lire_point(self, seq):
+        return self._lire_point_db(seq) if use_sqlite() else self._lire_point_excel(seq)
+
+    def _mouvements_apres(self, point):
+        seq, _, position = point
+        return self._mouvements_db(seq) if use_sqlite() else self._mouvements_excel(seq, position)
+
+    def _rejouer(self, stock, m):
+        """Applique un mouvement à stock (dict ID_QR -> ligne)."""
+        if m["Type"] == "import":
+            stock.clear()
+            stock.update((r[0], r) for r in self._lire_point(m["seq"]))
+        elif m["Type"] == "suppression":
+            stock.pop(m["ID_QR"], None)
+        elif m["Valeurs"]:
+            ligne = stock.get(m["ID_QR"])
+            if ligne is None:
+                ligne = stock[m["ID_QR"]] = [m["ID_QR"], None, 0, 0.0, 0]
+            for col, valeur in m["Valeurs"].items():
+                # Les autres clés (magasin d'un transfert...) ne sont que des informations
+                if col in STOCK_COLUMNS:
+                    ligne[STOCK_COLUMNS.index(col)] = valeur
+
+    def ecrire_mouvements(self, mouvements):
+        """Écrit tout de suite des mouvements déjà appliqués au stock."""
+        if use_sqlite():
+            conn = self.get_connection()
+            with conn:
+                self._inserer_mouvements(conn, mouvements)
+        else:
+            self._append_mouvements_excel(mouvements)
+
+    def init_grand_livre(self):
+        """Point de départ du grand livre (stock actuel) s'il n'y en a pas encore."""
+        if use_sqlite():
+            self._init_grand_livre_db()
+            dernier = self.get_connection().execute("SELECT COALESCE(MAX(seq), 0) FROM mouvements").fetchone()[0]
+        elif os.path.exists(self.excel_path):
+            self._init_grand_livre_excel()
+            dernier = self._ledger_state["seq"]
+        else:
+            return
+        # Mouvements écrits depuis le dernier point lors des démarrages précédents
+        self._mouvements_ajoutes(dernier - self._points()[-1][0])
+
+    @timed("grand_livre.point")
+    def creer_point_stock(self):
+        """Point après le dernier mouvement, calculé depuis le point précédent.
+
+        Renvoie le numéro du nouveau point, ou None s'il n'y avait rien à ajouter.
+        """
+        with self._points_lock:
+            points = self._points()
+            if not points:
+                return None
+            stock = {r[0]: r for r in self._lire_point(points[-1][0])}
+            dernier, position = None, None
+            for m, position in self._mouvements_apres(points[-1]):
+                self._rejouer(stock, m)
+                dernier = m
+            self._ledger_state["depuis_point"] = 0
+            if dernier is None:
+                return None
+            if use_sqlite():
+                self._ecrire_point_db(dernier["seq"], dernier["Date"], list(stock.values()))
+            else:
+                self._ecrire_point_excel(dernier["seq"], dernier["Date"], list(stock.values()), position)
+            return dernier["seq"]
+
+    def _points_loop(self):
+        while True:
+            self._points_event.wait()
+            self._points_event.clear()
+            try:
+                self.creer_point_stock()
+            except Exception:
+                # Le grand livre est intact : nouvel essai au prochain lot de mouvements
+                time.sleep(WRITE_BEHIND_RETRY_S)
+
+    def start_points_stock(self):
+        """Thread de calcul des points de stock (une fois par processus)."""
+        with self._points_lock:
+            if self._points_thread is None:
+                self._points_thread = threading.Thread(target=self._points_loop, name="points-stock", daemon=True)
+                self._points_thread.start()
+
+    @timed("grand_livre.stock_a_date")
+    def stock_a_date(self, date):
+        """Stock tel qu'il était à `date`, reconstitué depuis le point précédent.
+
+        Renvoie (df au format STOCK_COLUMNS, date du point de départ, nombre de
+        mouvements rejoués). ValueError si le grand livre commence après `date`.
+        """
+        limite = _date_key(date)
+        points = self._points()
+        avant = [p for p in points if p[1] <= limite]
+        if not avant:
+            debut = f" (il commence le {points[0][1]})" if points else ""
+            raise ValueError(f"Aucun mouvement enregistré à cette date{debut}.")
+        point = avant[-1]
+        stock = {r[0]: r for r in self._lire_point(point[0])}
+        n = 0
+        for m, _ in self._mouvements_apres(point):
+            # Les mouvements sont dans l'ordre : le premier après la date arrête la relecture
+            if m["Date"] > limite:
+                break
+            self._rejouer(stock, m)
+            n += 1
+        df = pd.DataFrame(list(stock.values()), columns=STOCK_COLUMNS)
+        return df.astype({"Quantite": int, "Prix_Unitaire_DH": float, "Seuil_Alerte": int}), point[1], n
+
+    def query_mouvements(self, start=None, end=None, id_qr=None):
+        """Mouvements de [start, end), dans l'ordre (Valeurs en JSON)."""
+        if use_sqlite():
+            where, params = _history_filters(start, end, id_qr=id_qr)
+            df = pd.read_sql_query(
+                f"SELECT date, type, id_qr, variation, valeurs, auteur FROM mouvements{where} ORDER BY seq",
+                self.get_connection(), params=params)
+            df.columns = MOUVEMENT_COLUMNS
+            return df.astype({"Variation": "Int64"})
+        # Lecture à partir du dernier point avant start
+        debut = None if start is None else _date_key(start)
+        fin = None if end is None else _date_key(end)
+        avant = [p for p in self._points_excel() if debut is not None and p[1] <= debut]
+        seq, _, position = avant[-1] if avant else (0, None, 0)
+        lignes = []
+        for m, _ in self._mouvements_excel(seq, position):
+            if fin is not None and m["Date"] >= fin:
+                break
+            if (debut is None or m["Date"] >= debut) and (not id_qr or m["ID_QR"] == str(id_qr)):
+                lignes.append({**m, "Valeurs": None if m["Valeurs"] is None else
+                               json.dumps(m["Valeurs"], ensure_ascii=False)})
+        return pd.DataFrame(lignes, columns=MOUVEMENT_COLUMNS).astype({"Variation": "Int64"})
+
+    # ── ARCHIVES DE L'HISTORIQUE ──
+
+    def catalogue_archives(self):
+        """{"coupure": ..., "archives": [{fichier, mois, debut, fin, lignes, quantite}, ...]}."""
+        try:
+            st = os.stat(self.archives_catalogue)
+        except FileNotFoundError:
+            return {"coupure": "", "archives": []}
+        signature = (st.st_mtime_ns, st.st_size)
+        cache = self._catalogue_cache
+        if cache is None or cache[0] != signature:
+            with open(self.archives_catalogue, encoding="utf-8") as f:
+                cache = self._catalogue_cache = (signature, json.load(f))
+        return cache[1]
+
+    def _archiver_lignes(self, df: pd.DataFrame, coupure):
+        """Écrit les lignes (Date au format trié) dans de nouveaux fichiers, puis le catalogue."""
+        os.makedirs(self.archives_dir, exist_ok=True)
+        catalogue = self.catalogue_archives()
+        archives = list(catalogue["archives"])
+        fichiers = {a["fichier"] for a in archives}
+        df = df.sort_values("Date", kind="stable")
+        for mois, lignes in df.groupby(df["Date"].str[:7], sort=True):
+            fichier, k = f"historique_{mois}.csv.gz", 1
+            while fichier in fichiers:
+                k += 1
+                fichier = f"historique_{mois}.{k}.csv.gz"
+            _ecrire_fichier(os.path.join(self.archives_dir, fichier),
+                            gzip.compress(lignes.to_csv(index=False).encode("utf-8"), compresslevel=6))
+            fichiers.add(fichier)
+            archives.append({"fichier": fichier, "mois": mois, "debut": lignes["Date"].iloc[0],
+                             "fin": lignes["Date"].iloc[-1], "lignes": len(lignes),
+                             "quantite": int(pd.to_numeric(lignes["Quantite_Sortie"], errors="coerce").fillna(0).sum())})
+        archives.sort(key=lambda a: (a["debut"], a["fichier"]))
+        _ecrire_fichier(self.archives_catalogue, json.dumps(
+            {"coupure": max(catalogue["coupure"], coupure), "archives": archives},
+            ensure_ascii=False, indent=1).encode("utf-8"))
+
+    def _lire_archive(self, fichier):
+        with self._archives_lock:
+            df = self._archives_cache.get(fichier)
+            if df is None:
+                df = pd.read_csv(os.path.join(self.archives_dir, fichier), compression="gzip",
+                                 dtype={"Date": str, "ID_QR": str, "Designation": str, "Technicien": str})
+                self._archives_cache[fichier] = df
+                while len(self._archives_cache) > ARCHIVES_CACHE_FICHIERS:
+                    self._archives_cache.popitem(last=False)
+            else:
+                self._archives_cache.move_to_end(fichier)
+            return df
+
+    @timed("historique.archives")
+    def historique_archive(self, start=None, end=None, technicien=None, id_qr=None):
+        """Sorties archivées de [start, end) ; seules les archives qui recoupent la plage sont lues."""
+        debut = None if start is None else _date_key(start)
+        fin = None if end is None else _date_key(end)
+        morceaux = []
+        for a in self.catalogue_archives()["archives"]:
+            if (debut is not None and a["fin"] < debut) or (fin is not None and a["debut"] >= fin):
+                continue
+            df = self._lire_archive(a["fichier"])
+            mask = pd.Series(True, index=df.index)
+            if debut is not None and a["debut"] < debut:
+                mask &= df["Date"] >= debut
+            if fin is not None and a["fin"] >= fin:
+                mask &= df["Date"] < fin
+            if technicien:
+                mask &= df["Technicien"] == technicien
+            if id_qr:
+                mask &= df["ID_QR"] == str(id_qr)
+            morceaux.append(df[mask])
+        if not morceaux:
+            return pd.DataFrame(columns=HISTORIQUE_COLUMNS)
+        df = pd.concat(morceaux, ignore_index=True)
+        # Fichiers suivants d'un même mois : remis dans l'ordre des dates
+        return df.sort_values("Date", kind="stable", ignore_index=True) if len(morceaux) > 1 else df
+
+    def _archiver_db(self, coupure):
+        conn = self.get_connection()
+        # Verrou d'écriture de la base pendant toute la rotation : un autre
+        # processus qui archive en même temps attend, puis ne trouve plus rien
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT valeur FROM meta WHERE cle = 'archive_coupure'").fetchone()
+            marque = row[0] if row else ""
+            catalogue = self.catalogue_archives()
+            if marque < catalogue["coupure"]:
+                # Rotation interrompue après le catalogue : ces lignes sont déjà archivées
+                conn.execute("DELETE FROM historique_sorties WHERE date < ?", (catalogue["coupure"],))
+            df = pd.read_sql_query(
+                "SELECT date, id_qr, designation, quantite_sortie, technicien FROM historique_sorties "
+                "WHERE date < ? ORDER BY date, id", conn, params=[coupure])
+            df.columns = HISTORIQUE_COLUMNS
+            if len(df):
+                self._archiver_lignes(df, coupure)
+                conn.execute("DELETE FROM historique_sorties WHERE date < ?", (coupure,))
+            conn.execute("INSERT OR REPLACE INTO meta (cle, valeur) VALUES ('archive_coupure', ?)",
+                         (max(marque, catalogue["coupure"], coupure),))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return len(df)
+
+    def _vivant_depuis(self):
+        """Coupure notée dans le classeur vivant : il ne contient aucune sortie antérieure."""
+        with self._excel_lock:
+            version = self.stock_version()
+            cache = self._coupure_cache
+            if cache is None or cache[0] != version:
+                marque = _coupure_classeur(self.excel_path) if os.path.exists(self.excel_path) else ""
+                cache = self._coupure_cache = (version, marque)
+        return cache[1]
+
+    def _historique_vivant(self, start=None, end=None, technicien=None, id_qr=None):
+        """Backend Excel : sorties du classeur et du journal, sauf si la plage est entièrement archivée."""
+        if end is not None and _date_key(end) <= self._vivant_depuis():
+            return pd.DataFrame(columns=HISTORIQUE_COLUMNS)
+        return _filter_historique(self.load_historique(), start, end, technicien, id_qr)
+
+    def _archiver_excel(self, coupure):
+        versions = None
+        with self._excel_lock:
+            catalogue = self.catalogue_archives()
+            # Coupure déjà atteinte : pas de chargement complet du classeur
+            if _coupure_classeur(self.excel_path) >= max(coupure, catalogue["coupure"]):
+                return 0
+            wb = load_workbook(self.excel_path)
+            props = wb.custom_doc_props
+            marque = props["archive_coupure"].value if "archive_coupure" in props.names else ""
+            if "Historique_Sorties" in wb.sheetnames:
+                ws = wb["Historique_Sorties"]
+                lignes = [r for r in ws.iter_rows(min_row=2, max_col=len(HISTORIQUE_COLUMNS), values_only=True)
+                          if any(v is not None for v in r)]
+            else:
+                ws, lignes = None, []
+            df = pd.DataFrame(lignes, columns=HISTORIQUE_COLUMNS)
+            cles = _date_keys(df["Date"])
+            anciennes = (cles < coupure).fillna(False).to_numpy(dtype=bool)
+            a_archiver = anciennes.copy()
+            if marque < catalogue["coupure"]:
+                # Rotation interrompue après le catalogue : ces lignes sont déjà archivées
+                a_archiver &= ~(cles < catalogue["coupure"]).fillna(False).to_numpy(dtype=bool)
+            if a_archiver.any():
+                self._archiver_lignes(df[a_archiver].assign(Date=cles[a_archiver]), coupure)
+            if anciennes.any():
+                index = wb.sheetnames.index("Historique_Sorties")
+                wb.remove(ws)
+                ws = _add_historique_sheet(wb, index)
+                gardees = (ligne for ligne, ancienne in zip(lignes, anciennes) if not ancienne)
+                for r_idx, ligne in enumerate(gardees, start=2):
+                    _write_sortie_row(ws, r_idx, list(ligne))
+            marque = max(marque, catalogue["coupure"], coupure)
+            if "archive_coupure" in props.names:
+                props["archive_coupure"].value = marque
+            else:
+                props.append(StringProperty(name="archive_coupure", value=marque))
+            before = self.stock_version()
+            wb.save(self.excel_path)
+            # La feuille Stock n'a pas changé : le cache reste valable
+            versions = (before, self.stock_version())
+            self._versions_ecrites.append(versions[1])
+        self._notify_persist(versions)
+        return int(a_archiver.sum())
+
+    @timed("historique.archivage")
+    def archiver_historique(self, maintenant=None):
+        """Archive les sorties des mois clos. Renvoie le nombre de lignes archivées."""
+        coupure = coupure_archives(maintenant)
+        with self._archives_lock:
+            if use_sqlite():
+                return self._archiver_db(coupure)
+            if os.path.exists(self.excel_path):
+                return self._archiver_excel(coupure)
+            return 0
+
+    def _archivage_loop(self):
+        while True:
+            try:
+                self.archiver_historique()
+            except Exception:
+                # Rien n'est retiré du stockage vivant avant le catalogue : nouvel essai au prochain passage
+                pass
+            time.sleep(ARCHIVAGE_INTERVAL_S)
+
+    def start_archivage(self):
+        """Rotation de l'historique au démarrage puis toutes les ARCHIVAGE_INTERVAL_S (une fois par processus)."""
+        with self._archives_lock:
+            if self._archivage_thread is None:
+                self._archivage_thread = threading.Thread(target=self._archivage_loop, name="archivage-historique",
+                                                          daemon=True)
+                self._archivage_thread.start()
+
+    # ── API COMMUNE (selon STORAGE_BACKEND) ──
+
+    def init_storage(self):
+        """Préparation du stockage, une seule fois par processus (pas à chaque rerun)."""
+        if self._initialised:
+            return
+        self._initialised = True
+        if use_sqlite():
+            self.migrate_excel_if_needed()
+        elif os.path.exists(self.excel_path):
+            # Reprise des écritures et d'un compactage interrompus, puis compactage périodique
+            self.recover_pending()
+            self.compact_journal()
+            self.start_journal_compaction()
+        self.init_grand_livre()
+        self.start_points_stock()
+        if ARCHIVAGE:
+            self.start_archivage()
+
+    def has_stock(self):
+        if use_sqlite():
+            conn = self.get_connection()
+            return conn.execute("SELECT 1 FROM stock LIMIT 1").fetchone() is not None
+        return os.path.exists(self.excel_path)
+
+    def load_stock(self):
+        if use_sqlite():
+            return self.load_stock_from_db()
+        # Classeur + modifications pas encore écrites, lus sous le même verrou que
+        # l'écrivain : jamais un état intermédiaire
+        with self._excel_lock:
+            df = load_stock_from_excel(self.excel_path)
+            with self._pending_lock:
+                pending = dict(self._pending)
+        return _apply_pending(df, pending)
+
+    def mark_dirty(self, id_qr):
+        with self._dirty_lock:
+            self._deleted_ids.discard(str(id_qr))
+            self._dirty_ids.add(str(id_qr))
+
+    def mark_deleted(self, id_qr):
+        with self._dirty_lock:
+            self._dirty_ids.discard(str(id_qr))
+            self._deleted_ids.add(str(id_qr))
+
+    def stock_version(self):
+        """Version des données persistées : compteur SQLite ou mtime du classeur."""
+        if use_sqlite():
+            return self.stock_version_db()
+        try:
+            return os.stat(self.excel_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def flush_stock(self, df, mouvements=()):
+        """Écrit uniquement les lignes marquées depuis la dernière sauvegarde.
+
+        df est le stock à jour, ou une fonction ids -> DataFrame des lignes de
+        ces pièces (sans construire tout le stock). Les mouvements de l'appelant
+        sont écrits avec les lignes (même transaction SQLite, juste après le
+        classeur sinon) ; si l'écriture échoue, ils ne sont pas gardés : c'est à
+        l'appelant d'annuler sa modification. Renvoie (version_avant,
+        version_après), ou None si rien n'a été écrit (rien à écrire, ou
+        écriture différée sur le backend Excel).
+        """
+        mouvements = list(mouvements)
+        with self._flush_lock:
+            with self._dirty_lock:
+                changed, deleted = set(self._dirty_ids), set(self._deleted_ids)
+                self._dirty_ids.clear()
+                self._deleted_ids.clear()
+            if not changed and not deleted and not mouvements:
+                return None
+            try:
+                rows = df(changed) if callable(df) else df[df["ID_QR"].astype(str).isin(changed)]
+                if use_sqlite():
+                    return self.write_stock_changes_db(rows, deleted, mouvements=mouvements)
+                versions = None
+                if WRITE_BEHIND:
+                    self._queue_stock_changes(rows, deleted)
+                else:
+                    with self._excel_lock:
+                        before = self.stock_version()
+                        # Les lignes déplacées par une suppression sont relues dans la feuille
+                        save_stock_to_excel(rows, self.excel_path, changed=changed, deleted=deleted)
+                        versions = before, self.stock_version()
+            except Exception:
+                # Lignes réessayées à la prochaine sauvegarde
+                with self._dirty_lock:
+                    self._dirty_ids.update(changed - self._deleted_ids)
+                    self._deleted_ids.update(deleted - self._dirty_ids)
+                raise
+            # Après le stock : un mouvement écrit deux fois se rejoue sans effet
+            self._append_mouvements_excel(mouvements)
+            return versions
+
+    def save_piece(self, df: pd.DataFrame, id_qr):
+        """Persiste une seule pièce (ajout ou modification) ; df est le stock à jour."""
+        self.mark_dirty(id_qr)
+        return self.flush_stock(df)
+
+    def delete_piece(self, df: pd.DataFrame, id_qr):
+        """Supprime une pièce ; df est le stock après suppression."""
+        self.mark_deleted(id_qr)
+        return self.flush_stock(df)
+
+    # ── ÉCRITURE DIFFÉRÉE DU STOCK (backend Excel) ──
+
+    def _append_pending_file(self, entries):
+        with open(self.pending_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _queue_stock_changes(self, rows, deleted):
+        with self._pending_lock as verrou:
+            seq = max(self._pending_state["seq"], lire_compteur(verrou))
+            entries = []
+            for row in rows.itertuples(index=False):
+                seq += 1
+                entries.append({"seq": seq, "id": str(row.ID_QR), "ligne": _ligne_pending(row)})
+            for id_qr in deleted:
+                seq += 1
+                entries.append({"seq": seq, "id": str(id_qr), "ligne": None})
+            self._append_pending_file(entries)
+            ecrire_compteur(verrou, seq)
+            self._pending_state["seq"] = seq
+            for e in entries:
+                self._pending[e["id"]] = e["ligne"]
+                self._pending_seq[e["id"]] = e["seq"]
+        self.start_writer()
+        self._writer_event.set()
+
+    def add_persist_listener(self, callback):
+        """callback((version_avant, version_après)) après chaque écriture différée.
+
+        Une méthode est gardée par référence faible (le store peut disparaître).
+        """
+        if hasattr(callback, "__self__"):
+            self._persist_listeners.append(weakref.WeakMethod(callback))
+        else:
+            self._persist_listeners.append(lambda: callback)
+
+    def is_own_write(self, version):
+        """Vrai si cette version du classeur vient d'une écriture de ce processus."""
+        return version in self._versions_ecrites
+
+    def _notify_persist(self, versions):
+        for ref in list(self._persist_listeners):
+            callback = ref()
+            if callback is not None:
+                callback(versions)
+
+    @timed("excel.flush_pending")
+    def flush_pending(self):
+        """Écrit maintenant toutes les modifications en attente (une sauvegarde).
+
+        Renvoie (version_avant, version_après), ou None si rien n'attendait.
+        """
+        with self._writer_lock:
+            with self._pending_lock:
+                lot, seqs = dict(self._pending), dict(self._pending_seq)
+            if not lot:
+                return None
+            maj = [l for l in lot.values() if l is not None]
+            df = pd.DataFrame(maj, columns=STOCK_COLUMNS)
+            with self._excel_lock:
+                before = self.stock_version()
+                save_stock_to_excel(df, self.excel_path, changed={l["ID_QR"] for l in maj},
+                                    deleted={i for i, l in lot.items() if l is None})
+                after = self.stock_version()
+                self._versions_ecrites.append(after)
+                # Toujours sous le verrou du classeur : load_stock voit soit
+                # l'ancien fichier + tout le lot, soit le nouveau fichier
+                with self._pending_lock:
+                    for id_qr, ligne in lot.items():
+                        if id_qr in self._pending and self._pending[id_qr] is ligne:
+                            del self._pending[id_qr]
+                            del self._pending_seq[id_qr]
+                    # Entrées plus récentes que le lot, ou d'autres pièces (autre processus) : gardées
+                    restants = [e for e in _read_journal_entries(self.pending_path) if e["seq"] > seqs.get(e["id"], 0)]
+                    _rewrite_jsonl(self.pending_path, restants)
+                    self._pending_state["derniere"] = time.time()
+                    self._pending_state["erreur"] = None
+        self._notify_persist((before, after))
+        return before, after
+
+    def _writer_loop(self):
+        while True:
+            self._writer_event.wait()
+            # Les modifications arrivées pendant ce délai partent dans le même lot
+            time.sleep(WRITE_BEHIND_DELAY_S)
+            self._writer_event.clear()
+            try:
+                self.flush_pending()
+                self.compact_journal_if_due()
+            except Exception as e:
+                # Le fichier d'attente est intact : nouvel essai plus tard
+                self._pending_state["erreur"] = str(e)
+                time.sleep(WRITE_BEHIND_RETRY_S)
+                self._writer_event.set()
+
+    def _compact_journal_soon(self):
+        # Les sorties sont déjà dans le journal (fsync) : le compactage vers le
+        # classeur se fait hors du chemin de la requête
+        if WRITE_BEHIND:
+            self.start_writer()
+            self._writer_event.set()
+        else:
+            self.compact_journal_if_due()
+
+    def start_writer(self):
+        """Thread d'écriture différée (une fois par processus)."""
+        # Déjà lancé : ne pas attendre _writer_lock, tenu pendant toute une sauvegarde
+        if self._writer_thread is not None:
+            return
+        with self._writer_lock:
+            if self._writer_thread is not None:
+                return
+            self._writer_thread = threading.Thread(target=self._writer_loop, name="stock-writer", daemon=True)
+            self._writer_thread.start()
+        atexit.register(self._flush_at_exit)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush_pending()
+        except Exception:
+            # Les modifications restent dans le fichier d'attente, rejouées au démarrage
+            pass
+
+    def recover_pending(self):
+        """Rejoue les modifications non écrites lors d'un arrêt brutal."""
+        entries = _read_journal_entries(self.pending_path)
+        if not entries:
+            return 0
+        with self._pending_lock:
+            for e in entries:
+                self._pending[e["id"]] = e["ligne"]
+                self._pending_seq[e["id"]] = e["seq"]
+            self._pending_state["seq"] = max(self._pending_state["seq"], max(e["seq"] for e in entries))
+        self.flush_pending()
+        return len(entries)
+
+    def persistence_status(self):
+        """Modifications en attente, heure de la dernière écriture, dernière erreur."""
+        with self._pending_lock:
+            return {"en_attente": len(self._pending), "derniere": self._pending_state["derniere"],
+                    "erreur": self._pending_state["erreur"]}
+
+    def append_sortie(self, date_str, id_qr, designation, qte, technicien):
+        if use_sqlite():
+            self.append_sortie_to_db(date_str, id_qr, designation, qte, technicien)
+        else:
+            self.append_sortie_to_journal(date_str, id_qr, designation, qte, technicien)
+            self._compact_journal_soon()
+
+    def append_sorties(self, rows):
+        """Plusieurs lignes d'historique en une seule écriture."""
+        if use_sqlite():
+            conn = self.get_connection()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO historique_sorties (date, id_qr, designation, quantite_sortie, technicien) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(d, str(i), des, int(q), t) for d, i, des, q, t in rows])
+        else:
+            self.append_sorties_to_journal(rows)
+            self._compact_journal_soon()
+
+    def load_historique(self):
+        if use_sqlite():
+            return self.load_historique_from_db()
+        # Feuille + sorties du journal pas encore compactées
+        with self._excel_lock:
+            try:
+                df_sheet = load_historique_from_excel(self.excel_path)
+            except ValueError:
+                df_sheet = pd.DataFrame(columns=HISTORIQUE_COLUMNS)
+            with self._journal_lock:
+                df_journal = self.load_journal()
+        if df_journal.empty:
+            return df_sheet
+        if df_sheet.dropna(how="all").empty:
+            return df_journal
+        return pd.concat([df_sheet, df_journal], ignore_index=True)
+
+    def historique_depuis(self, curseur=0, start=None):
+        """Sorties ajoutées depuis curseur (l'historique ne fait que s'allonger).
+
+        curseur vaut 0 au premier appel, puis la valeur renvoyée. Renvoie
+        (df Date/ID_QR/Quantite_Sortie, nouveau curseur, complet) ; complet=True
+        si df reprend tout l'historique depuis start, archives comprises
+        (premier appel, remplacement ou rotation des archives).
+        """
+        with self._archives_lock:
+            nb_archives = len(self.catalogue_archives()["archives"])
+            vivant = curseur[1] if curseur and curseur[0] == nb_archives else 0
+            df, vivant, complet = self._historique_vivant_depuis(vivant, start)
+            if complet:
+                df = _avec_archives(_since(self.historique_archive(start), None), df)
+        return df, (nb_archives, vivant), complet
+
+    def _historique_vivant_depuis(self, curseur=0, start=None):
+        if use_sqlite():
+            return self.historique_depuis_db(curseur, start)
+        # Excel : curseur = (lignes de la feuille, seq compacté dans la feuille,
+        # dernier seq vu). Les sorties récentes sont numérotées dans le journal ;
+        # la feuille n'est relue que si une compaction a emporté des sorties pas
+        # encore vues.
+        if curseur:
+            with self._journal_lock as verrou:
+                entries = _read_journal_entries(self.journal_path)
+                n_sheet, seq_feuille, seq_vu = curseur
+                if entries:
+                    suite = entries[0]["seq"] <= seq_vu + 1
+                else:
+                    # Dernier numéro attribué, par ce processus ou un autre
+                    suite = max(self._journal_state["seq"] or 0, lire_compteur(verrou)) <= seq_vu
+            if suite:
+                nouveaux = [e for e in entries if e["seq"] > seq_vu]
+                seq_vu = max([seq_vu] + [e["seq"] for e in nouveaux])
+                return (_since(pd.DataFrame(nouveaux, columns=HISTORIQUE_COLUMNS), start),
+                        (n_sheet, seq_feuille, seq_vu), False)
+        with self._excel_lock:
+            try:
+                df_sheet = load_historique_from_excel(self.excel_path).dropna(how="all")
+            except ValueError:
+                df_sheet = pd.DataFrame(columns=HISTORIQUE_COLUMNS)
+            seq_compacte = _compacted_seq(self.excel_path)
+            with self._journal_lock:
+                entries = _read_journal_entries(self.journal_path)
+        complet = not curseur or len(df_sheet) < curseur[0] or seq_compacte < curseur[1]
+        if complet:
+            seq_vu = 0
+            parts = [df_sheet]
+        else:
+            n_sheet, seq_feuille, seq_vu = curseur
+            # Lignes compactées depuis la dernière lecture, moins celles déjà vues dans le journal
+            parts = [df_sheet.iloc[n_sheet + max(0, seq_vu - seq_feuille):]]
+        seq_vu = max(seq_vu, seq_compacte)
+        nouveaux = [e for e in entries if e["seq"] > seq_vu]
+        parts.append(pd.DataFrame(nouveaux, columns=HISTORIQUE_COLUMNS))
+        seq_vu = max([seq_vu] + [e["seq"] for e in nouveaux])
+        df = pd.concat([p for p in parts if len(p)], ignore_index=True) if any(len(p) for p in parts) \
+            else pd.DataFrame(columns=HISTORIQUE_COLUMNS)
+        return _since(df, start), (len(df_sheet), seq_compacte, seq_vu), complet
+
+    def query_historique(self, start=None, end=None, technicien=None, id_qr=None):
+        """Sorties de [start, end), archives comprises si la plage remonte avant la coupure."""
+        with self._archives_lock:
+            archives = self.historique_archive(start, end, technicien, id_qr)
+            if use_sqlite():
+                df = self.query_historique_db(start, end, technicien, id_qr)
+            else:
+                df = self._historique_vivant(start, end, technicien, id_qr)
+        return _avec_archives(archives, df)
+
+    def rollup_historique(self, by, start=None, end=None):
+        """by : "Technicien" ou "ID_QR"."""
+        with self._archives_lock:
+            archives = self.historique_archive(start, end)
+            if not use_sqlite():
+                return _rollup(_avec_archives(archives, self._historique_vivant(start, end)), by)
+            df = self.rollup_historique_db(by, start, end)
+        if archives.empty:
+            return df
+        # Totaux SQL du stockage vivant + totaux des archives
+        agg = {"Nb_Sorties": "sum", "Quantite_Totale": "sum"}
+        if by == "ID_QR":
+            agg["Designation"] = "max"
+        return (pd.concat([df, _rollup(archives, by)], ignore_index=True)
+                  .groupby(by, as_index=False).agg(agg)
+                  .sort_values("Quantite_Totale", ascending=False, ignore_index=True))
+
+    @timed("excel.import_classeur", octets=_taille_classeur)
+    def import_uploaded_workbook(self, upload_path):
+        """Valide puis installe un classeur déposé par l'admin.
+
+        Seule la feuille Stock est lue (en flux) : l'historique en place est
+        conservé. Renvoie (nb pièces, anomalies) ; ValueError si l'en-tête est
+        invalide, auquel cas rien n'est remplacé.
+        """
+        read_stock_header(upload_path)
+        erreurs = []
+        if use_sqlite():
+            n, _ = self.replace_stock_db_chunks(iter_stock_chunks(upload_path, erreurs=erreurs))
+            with self._excel_lock:
+                os.replace(upload_path, self.excel_path)
+            self._set_source_excel()
+            return n, erreurs
+        chunks = list(iter_stock_chunks(upload_path, erreurs=erreurs))
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=STOCK_COLUMNS)
+        # Modifications et sorties en attente vont dans l'ancien classeur avant remplacement
+        self.flush_pending()
+        self.compact_journal()
+        with self._excel_lock:
+            if os.path.exists(self.excel_path):
+                _remplacer_feuille_stock(df, self.excel_path)
+                os.remove(upload_path)
+            else:
+                os.replace(upload_path, self.excel_path)
+        self._point_import_excel()
+        return len(df), erreurs
+
+    def export_workbook_bytes(self) -> bytes:
+        """Classeur Excel du stock courant, produit à la demande."""
+        if use_sqlite():
+            return build_workbook_bytes(self.load_stock_from_db(), self.load_historique_from_db())
+        self.flush_pending()
+        self.compact_journal()
+        with open(self.excel_path, "rb") as f:
+            return f.read()
+
+
+# Magasin principal (dossier courant) ; ses méthodes publiques sont aussi
+# les fonctions du module.
+principal = Stockage()
+
+append_sorties_to_journal = principal.append_sorties_to_journal
+append_sortie_to_journal = principal.append_sortie_to_journal
+load_journal = principal.load_journal
+compact_journal = principal.compact_journal
+compact_journal_if_due = principal.compact_journal_if_due
+start_journal_compaction = principal.start_journal_compaction
+get_connection = principal.get_connection
+stock_version_db = principal.stock_version_db
+load_stock_from_db = principal.load_stock_from_db
+write_stock_changes_db = principal.write_stock_changes_db
+replace_stock_db = principal.replace_stock_db
+replace_stock_db_chunks = principal.replace_stock_db_chunks
+entree_db = principal.entree_db
+entree_batch_db = principal.entree_batch_db
+transfert_db = principal.transfert_db
+sortie_db = principal.sortie_db
+sortie_batch_db = principal.sortie_batch_db
+append_sortie_to_db = principal.append_sortie_to_db
+load_historique_from_db = principal.load_historique_from_db
+query_historique_db = principal.query_historique_db
+rollup_historique_db = principal.rollup_historique_db
+historique_depuis_db = principal.historique_depuis_db
+replace_historique_db = principal.replace_historique_db
+import_excel_to_db = principal.import_excel_to_db
+migrate_excel_if_needed = principal.migrate_excel_if_needed
+ecrire_mouvements = principal.ecrire_mouvements
+init_grand_livre = principal.init_grand_livre
+creer_point_stock = principal.creer_point_stock
+start_points_stock = principal.start_points_stock
+stock_a_date = principal.stock_a_date
+query_mouvements = principal.query_mouvements
+catalogue_archives = principal.catalogue_archives
+historique_archive = principal.historique_archive
+archiver_historique = principal.archiver_historique
+start_archivage = principal.start_archivage
+init_storage = principal.init_storage
+has_stock = principal.has_stock
+load_stock = principal.load_stock
+mark_dirty = principal.mark_dirty
+mark_deleted = principal.mark_deleted
+stock_version = principal.stock_version
+flush_stock = principal.flush_stock
+save_piece = principal.save_piece
+delete_piece = principal.delete_piece
+add_persist_listener = principal.add_persist_listener
+is_own_write = principal.is_own_write
+flush_pending = principal.flush_pending
+start_writer = principal.start_writer
+recover_pending = principal.recover_pending
+persistence_status = principal.persistence_status
+append_sortie = principal.append_sortie
+append_sorties = principal.append_sorties
+load_historique = principal.load_historique
+historique_depuis = principal.historique_depuis
+query_historique = principal.query_historique
+rollup_historique = principal.rollup_historique
+import_uploaded_workbook = principal.import_uploaded_workbook
+export_workbook_bytes = principal.export_workbook_bytes
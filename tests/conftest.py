@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# Modules de l'application à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+
+@pytest.fixture(params=["sqlite", "excel"])
+def backend(request, monkeypatch):
+    """Chaque test tourne sur les deux backends ; pas d'archivage en arrière-plan."""
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", request.param)
+    monkeypatch.setattr(storage, "ARCHIVAGE", False)
+    return request.param
+
+
+def creer_classeur(path, quantites):
+    """Classeur au format de l'application : {ID_QR: quantité}, historique vide."""
+    df = pd.DataFrame({"ID_QR": list(quantites), "Designation": [f"Pièce {i}" for i in quantites],
+                       "Quantite": list(quantites.values()), "Prix_Unitaire_DH": 10.0, "Seuil_Alerte": 0})
+    with open(path, "wb") as f:
+        f.write(storage.build_workbook_bytes(df, pd.DataFrame(columns=storage.HISTORIQUE_COLUMNS)))
+
+
+@pytest.fixture
+def nouveau_stockage(backend, tmp_path):
+    """Fabrique de magasins neufs (dossier temporaire) ; les écritures en attente sont vidées à la fin."""
+    crees = []
+
+    def fabrique(quantites, nom="magasin"):
+        stockage = storage.Stockage(str(tmp_path / nom))
+        creer_classeur(stockage.excel_path, quantites)
+        stockage.init_storage()
+        crees.append(stockage)
+        return stockage
+
+    yield fabrique
+    for stockage in crees:
+        stockage.flush_pending()
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import scan_api
+import storage
+from conftest import creer_classeur
+
+JETON = "jeton-de-test"
+TECHNICIEN = storage.TECHNICIENS[0]
+AUTH = {"Authorization": f"Bearer {JETON}"}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def magasin_principal(tmp_path_factory):
+    """Magasin principal (fichiers du dossier courant) dans un dossier temporaire, backend SQLite.
+
+    Le magasin principal et son store sont chargés une fois par processus :
+    tous les tests du module partagent ce dossier.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(tmp_path_factory.mktemp("scan_api"))
+        mp.setattr(storage, "STORAGE_BACKEND", "sqlite")
+        mp.setattr(storage, "ARCHIVAGE", False)
+        mp.setattr(scan_api, "API_TOKEN", JETON)
+        creer_classeur(storage.EXCEL_PATH, {"PMP-01": 40, "PMP-02": 5, "PMP-03": 3})
+        storage.init_storage()
+        yield
+
+
+def _avec_client(scenario):
+    """Exécute scenario(client) contre l'application, serveur de test local."""
+    async def executer():
+        async with TestClient(TestServer(scan_api.create_app(workers=4))) as client:
+            return await scenario(client)
+    return asyncio.run(executer())
+
+
+def test_jeton(magasin_principal):
+    async def scenario(client):
+        sans = await client.get("/api/stock")
+        faux = await client.get("/api/stock", headers={"Authorization": "Bearer autre"})
+        sante = await client.get("/api/sante")
+        bon = await client.get("/api/stock", headers=AUTH)
+        sortie = await client.post("/api/sorties", json={"id_qr": "PMP-01", "technicien": TECHNICIEN})
+        return sans.status, faux.status, sante.status, bon.status, sortie.status, await sans.json()
+
+    sans, faux, sante, bon, sortie, corps = _avec_client(scenario)
+    assert (sans, faux, sortie) == (401, 401, 401)
+    assert (sante, bon) == (200, 200)
+    assert "erreur" in corps
+
+
+@pytest.mark.parametrize("chemin, corps", [
+    ("/api/stock?page=0", None),
+    ("/api/stock?taille=0", None),
+    ("/api/stock?page=abc", None),
+    ("/api/stock?tri=Inconnu", None),
+    ("/api/sorties", "pas du json"),
+    ("/api/sorties", [1, 2]),
+    ("/api/sorties", {"id_qr": "PMP-01", "quantite": 0, "technicien": TECHNICIEN}),
+    ("/api/sorties", {"id_qr": "PMP-01", "quantite": "deux", "technicien": TECHNICIEN}),
+    ("/api/sorties", {"id_qr": "PMP-01", "quantite": 1, "technicien": "Inconnu"}),
+    ("/api/sorties/lot", {"technicien": TECHNICIEN, "items": []}),
+    ("/api/sorties/lot", {"technicien": TECHNICIEN, "items": [{"id_qr": "", "quantite": 1}]}),
+])
+def test_requete_invalide(magasin_principal, chemin, corps):
+    async def scenario(client):
+        if corps is None:
+            reponse = await client.get(chemin, headers=AUTH)
+        elif isinstance(corps, str):
+            # Corps brut (pas du JSON)
+            reponse = await client.post(chemin, data=corps, headers=AUTH)
+        else:
+            reponse = await client.post(chemin, json=corps, headers=AUTH)
+        return reponse.status, await reponse.json()
+
+    status, reponse = _avec_client(scenario)
+    assert status == 400
+    assert "erreur" in reponse
+
+
+def test_stock_insuffisant(magasin_principal):
+    async def scenario(client):
+        seule = await client.post("/api/sorties", headers=AUTH,
+                                  json={"id_qr": "PMP-03", "quantite": 4, "technicien": TECHNICIEN})
+        lot = await client.post("/api/sorties/lot", headers=AUTH, json={"technicien": TECHNICIEN, "items": [
+            {"id_qr": "PMP-03", "quantite": 1}, {"id_qr": "PMP-02", "quantite": 6}]})
+        piece = await client.get("/api/pieces/PMP-03", headers=AUTH)
+        return seule.status, await seule.json(), lot.status, await lot.json(), await piece.json()
+
+    status, seule, status_lot, lot, piece = _avec_client(scenario)
+    assert status == 409
+    assert seule["stock_actuel"] == 3
+    assert status_lot == 409
+    assert lot["refus"] == [{"id_qr": "PMP-02", "erreur": lot["refus"][0]["erreur"], "stock_actuel": 5}]
+    # Tout ou rien : la ligne valide du panier n'a pas été sortie
+    assert piece["quantite"] == 3
+
+
+def test_stock_final(magasin_principal):
+    avant = storage.load_stock_from_db().set_index("ID_QR")["Quantite"].to_dict()
+    sorties_avant = len(storage.load_historique_from_db())
+
+    async def scenario(client):
+        # 20 sorties simultanées, puis un panier
+        reponses = await asyncio.gather(*(client.post("/api/sorties", headers=AUTH, json={
+            "id_qr": "PMP-01", "quantite": 1, "technicien": TECHNICIEN}) for _ in range(20)))
+        lot = await client.post("/api/sorties/lot", headers=AUTH, json={"technicien": TECHNICIEN, "items": [
+            {"id_qr": "PMP-01", "quantite": 2}, {"id_qr": "PMP-02", "quantite": 5}]})
+        piece = await client.get("/api/pieces/PMP-01", headers=AUTH)
+        return [r.status for r in reponses], lot.status, await lot.json(), await piece.json()
+
+    statuts, status_lot, lot, piece = _avec_client(scenario)
+    assert statuts == [200] * 20
+    assert status_lot == 200
+    assert [(s["id_qr"], s["restant"]) for s in lot["sorties"]] == [("PMP-01", avant["PMP-01"] - 22),
+                                                                     ("PMP-02", 0)]
+    assert piece["quantite"] == avant["PMP-01"] - 22
+    # Relu dans la base : stock et historique des sorties
+    apres = storage.load_stock_from_db().set_index("ID_QR")["Quantite"].to_dict()
+    assert apres == {**avant, "PMP-01": avant["PMP-01"] - 22, "PMP-02": 0}
+    assert len(storage.load_historique_from_db()) == sorties_avant + 22
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+from stock_store import StockInsuffisant, StockStore
+
+THREADS = 8
+SORTIES = 25
+
+
+def _persiste(stockage):
+    """Stock, sorties et mouvements relus sur disque par un Stockage neuf (sans rien en mémoire)."""
+    stockage.flush_pending()
+    relu = storage.Stockage(stockage.dossier)
+    df = relu.load_stock()
+    stock = dict(zip(df["ID_QR"], df["Quantite"]))
+    historique = relu.load_historique().dropna(how="all")
+    mouvements = relu.query_mouvements()
+    return stock, historique, mouvements[mouvements["Type"] == "sortie"]
+
+
+def _en_parallele(fonction, n=THREADS):
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        return list(pool.map(fonction, range(n)))
+
+
+def test_sorties_concurrentes(nouveau_stockage):
+    # Une pièce commune à tous les threads, une pièce propre à chacun
+    quantites = {"COMMUNE": 1000, **{f"P-{k}": 100 for k in range(THREADS)}}
+    stockage = nouveau_stockage(quantites)
+    store = StockStore(stockage)
+
+    def sorties(k):
+        for _ in range(SORTIES):
+            store.sortie("COMMUNE", 2, f"Tech {k}")
+            store.sortie(f"P-{k}", 1, f"Tech {k}")
+
+    _en_parallele(sorties)
+
+    attendu = {"COMMUNE": 1000 - 2 * SORTIES * THREADS, **{f"P-{k}": 100 - SORTIES for k in range(THREADS)}}
+    assert dict(zip(store.df["ID_QR"], store.df["Quantite"])) == attendu
+    stock, historique, mouvements = _persiste(stockage)
+    assert stock == attendu
+    assert len(historique) == 2 * SORTIES * THREADS
+    assert historique.groupby("ID_QR")["Quantite_Sortie"].sum().to_dict() == {
+        id_qr: quantites[id_qr] - q for id_qr, q in attendu.items()}
+    assert len(mouvements) == 2 * SORTIES * THREADS
+
+
+def test_stock_jamais_negatif(nouveau_stockage):
+    stockage = nouveau_stockage({"RARE": 50})
+    store = StockStore(stockage)
+
+    def sorties(k):
+        acceptees = 0
+        for _ in range(10):
+            try:
+                store.sortie("RARE", 1, f"Tech {k}")
+                acceptees += 1
+            except StockInsuffisant:
+                pass
+        return acceptees
+
+    assert sum(_en_parallele(sorties)) == 50
+    assert store.get("RARE")["Quantite"] == 0
+    stock, historique, mouvements = _persiste(stockage)
+    assert stock == {"RARE": 0}
+    assert len(historique) == 50
+    assert len(mouvements) == 50
+
+
+def test_paniers_concurrents(nouveau_stockage):
+    stockage = nouveau_stockage({"A": 500, "B": 500})
+    store = StockStore(stockage)
+
+    def paniers(k):
+        for _ in range(SORTIES):
+            store.sortie_batch([("A", 1), ("B", 2), ("A", 1)], f"Tech {k}")
+
+    _en_parallele(paniers)
+
+    attendu = {"A": 500 - 2 * SORTIES * THREADS, "B": 500 - 2 * SORTIES * THREADS}
+    stock, historique, mouvements = _persiste(stockage)
+    assert stock == attendu
+    assert historique["Quantite_Sortie"].astype(int).sum() == 4 * SORTIES * THREADS
+    assert -mouvements["Variation"].sum() == 4 * SORTIES * THREADS
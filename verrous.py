@@ -0,0 +1,97 @@
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# ─────────────────────────────────────────────
+# VERROUS ENTRE PROCESSUS
+# ─────────────────────────────────────────────
+# Un VerrouFichier est un verrou de thread réentrant suivi d'un verrou
+# exclusif sur un fichier compagnon (flock, msvcrt sous Windows) : les
+# threads d'un processus s'attendent entre eux, puis le processus attend
+# les autres. Le fichier est ouvert au premier niveau et fermé au dernier ;
+# un chemin relatif suit donc le dossier courant au moment de la prise.
+#
+# Le fichier de verrou peut porter un compteur (lire_compteur /
+# ecrire_compteur) : un numéro lu et écrit sous le verrou est unique entre
+# processus.
+
+
+def _verrouiller(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK abandonne après 10 s : on attend encore
+            continue
+
+
+def _deverrouiller(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class VerrouFichier:
+    """Verrou réentrant partagé par les threads et les processus (fichier path)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._niveau = 0
+        self._fichier = None
+
+    def __enter__(self):
+        """Prend le verrou ; renvoie le fichier de verrou ouvert (voir lire_compteur)."""
+        self._lock.acquire()
+        try:
+            if self._niveau == 0:
+                f = open(self.path, "a+b")
+                try:
+                    _verrouiller(f)
+                except BaseException:
+                    f.close()
+                    raise
+                self._fichier = f
+            self._niveau += 1
+        except BaseException:
+            self._lock.release()
+            raise
+        return self._fichier
+
+    def __exit__(self, *exc):
+        try:
+            self._niveau -= 1
+            if self._niveau == 0:
+                f, self._fichier = self._fichier, None
+                try:
+                    _deverrouiller(f)
+                finally:
+                    f.close()
+        finally:
+            self._lock.release()
+
+
+def lire_compteur(f):
+    """Entier rangé dans le fichier de verrou (0 s'il est vide)."""
+    f.seek(0)
+    contenu = f.read().strip()
+    return int(contenu) if contenu else 0
+
+
+def ecrire_compteur(f, valeur):
+    f.seek(0)
+    f.truncate()
+    f.write(str(int(valeur)).encode("ascii"))
+    f.flush()